@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+from query_cache import query_cache
+
+
+class BarcodeCache:
+    """
+    Кэши для повторных сканирований одного и того же штрихкода (пересчет одинаковых коробок)
+    с вытеснением давно не используемых записей (LRU):
+    - результаты разбора штрихкода (BarcodeParser.parse, ui_barcodes.parse_barcode);
+    - товар по штрихкоду: id_good, id_property, id_series, id_unit, ratio, use_mark.
+    Товар хранится вместе с версиями RS_barcodes, RS_goods и RS_types_goods из query_cache:
+    после загрузки или изменения этих таблиц запись перестает считаться актуальной.
+    Коды марок (с разделителем GS, пачки табака) не кэшируются: серия у каждой марки своя
+    """
+
+    resolution_tables = ('RS_barcodes', 'RS_goods', 'RS_types_goods')
+    resolution_fields = ('id_good', 'id_property', 'id_series', 'id_unit', 'ratio', 'use_mark')
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self._parsed = OrderedDict()
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'parse_hits': 0, 'parse_misses': 0, 'resolve_hits': 0, 'resolve_misses': 0}
+
+    def parse(self, kind, barcode, parser):
+        """
+        Результат parser(barcode) из кэша. kind - какой разбор (у BarcodeParser и ui_barcodes результаты разные).
+        Возвращается копия: вызывающий код может менять результат
+        """
+
+        if self.is_mark_code(barcode):
+            return parser(barcode)
+
+        key = (kind, barcode)
+        with self._lock:
+            result = self._parsed.get(key)
+            if result is not None:
+                self._parsed.move_to_end(key)
+                self._stats['parse_hits'] += 1
+                return self._copy(result)
+            self._stats['parse_misses'] += 1
+
+        result = parser(barcode)
+
+        with self._lock:
+            self._put(self._parsed, key, self._copy(result))
+
+        return result
+
+    def resolve(self, barcode, loader):
+        """
+        Товар по штрихкоду (словарь resolution_fields) или None, если штрихкода нет.
+        loader() читает его из базы, когда записи нет или справочники изменились
+        """
+
+        versions = query_cache.versions(*self.resolution_tables)
+        with self._lock:
+            entry = self._resolved.get(barcode)
+            if entry is not None and entry[0] == versions:
+                self._resolved.move_to_end(barcode)
+                self._stats['resolve_hits'] += 1
+                return dict(entry[1]) if entry[1] else None
+            self._stats['resolve_misses'] += 1
+
+        result = loader()
+        if result:
+            result = {key: result[key] for key in self.resolution_fields}
+
+        with self._lock:
+            # Пока выполнялся запрос, справочники могли измениться - такой результат не сохраняем
+            if versions == query_cache.versions(*self.resolution_tables):
+                self._put(self._resolved, barcode, (versions, result))
+
+        return dict(result) if result else None
+
+    def clear(self):
+        with self._lock:
+            self._parsed.clear()
+            self._resolved.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, parsed=len(self._parsed), resolved=len(self._resolved),
+                        max_size=self.max_size)
+
+    @staticmethod
+    def is_mark_code(barcode) -> bool:
+        return not barcode or len(barcode) == 29 or chr(29) in barcode or '<GS>' in barcode
+
+    @staticmethod
+    def _copy(result):
+        # Поверхностная копия: copy.copy для dataclass в несколько раз медленнее самого разбора EAN-13.
+        # Вложенный словарь AI (ui_utils.BarcodeInfo.ai) копируется отдельно, чтобы не менять запись кэша
+        if isinstance(result, dict):
+            return result.copy()
+        result_copy = object.__new__(type(result))
+        result_copy.__dict__.update(result.__dict__)
+        if isinstance(result_copy.__dict__.get('ai'), dict):
+            result_copy.ai = dict(result.ai)
+        return result_copy
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+
+barcode_cache = BarcodeCache()
@@ -335,6 +335,14 @@ def database_shema():
         timestamp DATETIME DEFAULT (CURRENT_TIMESTAMP)) 
     ''')
 
+    # Примененные версии database_migrations()
+    Rs.append('''
+    CREATE TABLE IF NOT EXISTS RS_migrations (
+    version    INTEGER  PRIMARY KEY,
+    applied_at DATETIME DEFAULT (CURRENT_TIMESTAMP)
+    )
+    ''')
+
     Rs.append('''
     CREATE INDEX  IF NOT EXISTS cell_name ON RS_cells (
     name
@@ -354,6 +362,234 @@ def database_shema():
 #          + RS_docs_table + RS_price_types + RS_prices + RS_countragents + RS_warehouses
 
     return Rs
+
+
+def database_migrations():
+    """
+    Версионированные изменения схемы. Каждая версия применяется один раз,
+    номер последней примененной хранится в RS_migrations
+    """
+
+    migrations = []
+
+    # Вторичные индексы для горячих запросов сканирования, деталей документа и выгрузки
+    # Индекс на mark_code с NOCASE - чтобы LIKE '01...%' (регистронезависимый по умолчанию) мог его использовать
+    migrations.append((1, [
+        'CREATE INDEX IF NOT EXISTS docs_table_doc_good ON RS_docs_table (id_doc, id_good, id_properties, id_unit)',
+        'CREATE INDEX IF NOT EXISTS docs_table_doc_updated ON RS_docs_table (id_doc, last_updated)',
+        'CREATE INDEX IF NOT EXISTS docs_barcodes_doc_gtin ON RS_docs_barcodes (id_doc, GTIN, Series)',
+        'CREATE INDEX IF NOT EXISTS barc_flow_doc ON RS_barc_flow (id_doc)',
+        'CREATE INDEX IF NOT EXISTS adr_docs_table_doc_good ON RS_adr_docs_table (id_doc, id_good, id_properties, id_series)',
+        'CREATE INDEX IF NOT EXISTS marking_codes_mark_code ON RS_marking_codes (mark_code COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS docs_verified ON RS_docs (verified, sent)',
+        'CREATE INDEX IF NOT EXISTS adr_docs_verified ON RS_adr_docs (verified, sent)',
+        'CREATE INDEX IF NOT EXISTS cell_barcode ON RS_cells (barcode)',
+    ]))
+
+    # Сводная статистика по документам для плиток. Поддерживается триггерами,
+    # при создании заполняется по уже загруженным документам
+    migrations.append((2, [
+        '''
+        CREATE TABLE IF NOT EXISTS RS_doc_stats (
+            id_doc      TEXT    NOT NULL PRIMARY KEY,
+            doc_type    TEXT,
+            sent        INTEGER DEFAULT 0,
+            verified    INTEGER DEFAULT 0,
+            lines_count INTEGER DEFAULT 0,
+            qtty_plan   REAL    DEFAULT 0,
+            barc_count  INTEGER DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_doc_insert AFTER INSERT ON RS_docs BEGIN
+            REPLACE INTO RS_doc_stats (id_doc, doc_type, sent, verified, lines_count, qtty_plan, barc_count)
+            SELECT new.id_doc, new.doc_type, IFNULL(new.sent, 0), IFNULL(new.verified, 0),
+                (SELECT COUNT(*) FROM RS_docs_table WHERE id_doc = new.id_doc),
+                (SELECT IFNULL(SUM(qtty_plan), 0) FROM RS_docs_table WHERE id_doc = new.id_doc),
+                (SELECT COUNT(*) FROM RS_barc_flow WHERE id_doc = new.id_doc);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_doc_update AFTER UPDATE OF id_doc, doc_type, sent, verified
+        ON RS_docs BEGIN
+            DELETE FROM RS_doc_stats WHERE id_doc = old.id_doc;
+            REPLACE INTO RS_doc_stats (id_doc, doc_type, sent, verified, lines_count, qtty_plan, barc_count)
+            SELECT new.id_doc, new.doc_type, IFNULL(new.sent, 0), IFNULL(new.verified, 0),
+                (SELECT COUNT(*) FROM RS_docs_table WHERE id_doc = new.id_doc),
+                (SELECT IFNULL(SUM(qtty_plan), 0) FROM RS_docs_table WHERE id_doc = new.id_doc),
+                (SELECT COUNT(*) FROM RS_barc_flow WHERE id_doc = new.id_doc);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_doc_delete AFTER DELETE ON RS_docs BEGIN
+            DELETE FROM RS_doc_stats WHERE id_doc = old.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_line_insert AFTER INSERT ON RS_docs_table BEGIN
+            UPDATE RS_doc_stats
+            SET lines_count = lines_count + 1, qtty_plan = qtty_plan + IFNULL(new.qtty_plan, 0)
+            WHERE id_doc = new.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_line_update AFTER UPDATE OF id_doc, qtty_plan
+        ON RS_docs_table BEGIN
+            UPDATE RS_doc_stats
+            SET lines_count = lines_count - 1, qtty_plan = qtty_plan - IFNULL(old.qtty_plan, 0)
+            WHERE id_doc = old.id_doc;
+            UPDATE RS_doc_stats
+            SET lines_count = lines_count + 1, qtty_plan = qtty_plan + IFNULL(new.qtty_plan, 0)
+            WHERE id_doc = new.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_line_delete AFTER DELETE ON RS_docs_table BEGIN
+            UPDATE RS_doc_stats
+            SET lines_count = lines_count - 1, qtty_plan = qtty_plan - IFNULL(old.qtty_plan, 0)
+            WHERE id_doc = old.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_flow_insert AFTER INSERT ON RS_barc_flow BEGIN
+            UPDATE RS_doc_stats SET barc_count = barc_count + 1 WHERE id_doc = new.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_flow_update AFTER UPDATE OF id_doc ON RS_barc_flow BEGIN
+            UPDATE RS_doc_stats SET barc_count = barc_count - 1 WHERE id_doc = old.id_doc;
+            UPDATE RS_doc_stats SET barc_count = barc_count + 1 WHERE id_doc = new.id_doc;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_doc_stats_flow_delete AFTER DELETE ON RS_barc_flow BEGIN
+            UPDATE RS_doc_stats SET barc_count = barc_count - 1 WHERE id_doc = old.id_doc;
+        END
+        ''',
+        'DELETE FROM RS_doc_stats',
+        doc_stats_query('INSERT INTO RS_doc_stats (id_doc, doc_type, sent, verified, lines_count, qtty_plan, '
+                        'barc_count)'),
+    ]))
+
+    # Номер последнего скана журнала отложенной записи (scan_journal), записанного в базу
+    migrations.append((3, [
+        '''
+        CREATE TABLE IF NOT EXISTS RS_scan_journal (
+            id       INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+    ]))
+
+    # Очередь сканирований (tiny_db_services.ScanningQueueService) вместо JSON-файла TinyDB
+    migrations.append((4, [
+        '''
+        CREATE TABLE IF NOT EXISTS RS_scanning_queue (
+            id     INTEGER PRIMARY KEY,
+            id_doc TEXT,
+            row_id TEXT,
+            sent   INTEGER NOT NULL DEFAULT 0,
+            data   TEXT    NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS scanning_queue_doc_sent ON RS_scanning_queue (id_doc, sent)',
+        'CREATE INDEX IF NOT EXISTS scanning_queue_doc_row ON RS_scanning_queue (id_doc, row_id)',
+    ]))
+
+    # Сумма количества очереди сканирований по строке (id_doc, row_id), поддерживается триггерами.
+    # Пустой row_id хранится как '' - NULL в первичном ключе не сравнивается
+    migrations.append((5, [
+        'ALTER TABLE RS_scanning_queue ADD COLUMN qtty NUMERIC NOT NULL DEFAULT 0',
+        "UPDATE RS_scanning_queue SET qtty = IFNULL(json_extract(data, '$.qtty'), 0)",
+        '''
+        CREATE TABLE IF NOT EXISTS RS_scanning_queue_rows (
+            id_doc TEXT    NOT NULL,
+            row_id TEXT    NOT NULL,
+            qtty   NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_doc, row_id)
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_scanning_queue_rows_insert AFTER INSERT ON RS_scanning_queue BEGIN
+            INSERT OR IGNORE INTO RS_scanning_queue_rows (id_doc, row_id) VALUES (IFNULL(new.id_doc, ''), IFNULL(new.row_id, ''));
+            UPDATE RS_scanning_queue_rows SET qtty = qtty + new.qtty
+            WHERE id_doc = IFNULL(new.id_doc, '') AND row_id = IFNULL(new.row_id, '');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_scanning_queue_rows_update AFTER UPDATE OF id_doc, row_id, qtty
+        ON RS_scanning_queue BEGIN
+            UPDATE RS_scanning_queue_rows SET qtty = qtty - old.qtty
+            WHERE id_doc = IFNULL(old.id_doc, '') AND row_id = IFNULL(old.row_id, '');
+            INSERT OR IGNORE INTO RS_scanning_queue_rows (id_doc, row_id) VALUES (IFNULL(new.id_doc, ''), IFNULL(new.row_id, ''));
+            UPDATE RS_scanning_queue_rows SET qtty = qtty + new.qtty
+            WHERE id_doc = IFNULL(new.id_doc, '') AND row_id = IFNULL(new.row_id, '');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS RS_scanning_queue_rows_delete AFTER DELETE ON RS_scanning_queue BEGIN
+            UPDATE RS_scanning_queue_rows SET qtty = qtty - old.qtty
+            WHERE id_doc = IFNULL(old.id_doc, '') AND row_id = IFNULL(old.row_id, '');
+        END
+        ''',
+        'DELETE FROM RS_scanning_queue_rows',
+        '''
+        INSERT INTO RS_scanning_queue_rows (id_doc, row_id, qtty)
+        SELECT IFNULL(id_doc, ''), IFNULL(row_id, ''), SUM(qtty) FROM RS_scanning_queue
+        GROUP BY IFNULL(id_doc, ''), IFNULL(row_id, '')
+        ''',
+    ]))
+
+    # Время добавления записи очереди сканирований: по нему сжатие удаляет старые отправленные записи
+    migrations.append((6, [
+        'ALTER TABLE RS_scanning_queue ADD COLUMN created_at INTEGER NOT NULL DEFAULT 0',
+        "UPDATE RS_scanning_queue SET created_at = CAST(strftime('%s', 'now') AS INTEGER)",
+        'CREATE INDEX IF NOT EXISTS scanning_queue_sent_created ON RS_scanning_queue (sent, created_at)',
+    ]))
+
+    # Записи очереди BarcodeWorker хранят строку документа в row_key, количество - в d_qtty:
+    # колонки row_id и qtty заполняются из них (триггеры пересчитывают RS_scanning_queue_rows)
+    migrations.append((7, [
+        '''
+        UPDATE RS_scanning_queue SET row_id = json_extract(data, '$.row_key')
+        WHERE row_id IS NULL AND json_extract(data, '$.row_id') IS NULL
+        ''',
+        '''
+        UPDATE RS_scanning_queue SET qtty = IFNULL(json_extract(data, '$.d_qtty'), 0)
+        WHERE json_extract(data, '$.qtty') IS NULL
+        ''',
+        'DELETE FROM RS_scanning_queue_rows WHERE qtty = 0',
+    ]))
+
+    return migrations
+
+
+def doc_stats_query(prefix=''):
+    """Статистика RS_doc_stats, посчитанная заново по документам, строкам и потоку штрихкодов"""
+
+    return f'''
+        {prefix}
+        SELECT
+            RS_docs.id_doc,
+            RS_docs.doc_type,
+            IFNULL(RS_docs.sent, 0) AS sent,
+            IFNULL(RS_docs.verified, 0) AS verified,
+            IFNULL(lines.lines_count, 0) AS lines_count,
+            IFNULL(lines.qtty_plan, 0) AS qtty_plan,
+            IFNULL(flow.barc_count, 0) AS barc_count
+        FROM RS_docs
+        LEFT JOIN (
+            SELECT id_doc, COUNT(*) AS lines_count, IFNULL(SUM(qtty_plan), 0) AS qtty_plan
+            FROM RS_docs_table
+            GROUP BY id_doc
+        ) AS lines ON lines.id_doc = RS_docs.id_doc
+        LEFT JOIN (
+            SELECT id_doc, COUNT(*) AS barc_count
+            FROM RS_barc_flow
+            GROUP BY id_doc
+        ) AS flow ON flow.id_doc = RS_docs.id_doc
+        '''
+
 #print(database_shema())
     #
     # Rs.append(RS_constants)
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionManager:
+    """
+    Долгоживущие соединения с SQLite: одно соединение на поток и на файл базы.
+    Соединение открывается лениво, настраивается один раз (WAL + pragmas) и переиспользуется
+    всеми вызовами ui_global.get_query_result / bulk_query / execute_script.
+    """
+
+    pragmas = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-8000',
+        # REPLACE должен вызывать триггеры на удаление (синхронизация RS_goods_fts)
+        'PRAGMA recursive_triggers=ON',
+    )
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get_connection(self, db_path) -> sqlite3.Connection:
+        connections = self._get_thread_connections()
+        conn = connections.get(db_path)
+
+        if conn is None:
+            try:
+                conn = sqlite3.connect(db_path, timeout=self.timeout, isolation_level=None)
+            except sqlite3.Error:
+                raise ValueError('No connection with database')
+
+            self._configure(conn)
+            connections[db_path] = conn
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    @contextmanager
+    def transaction(self, db_path):
+        """
+        Транзакция на соединении текущего потока. Вложенные вызовы работают внутри внешней транзакции,
+        commit выполняется при выходе из самого внешнего блока, rollback - при исключении.
+        """
+
+        conn = self.get_connection(db_path)
+        depth = self._get_depth(db_path)
+
+        if depth == 0:
+            conn.execute('BEGIN')
+
+        self._set_depth(db_path, depth + 1)
+        try:
+            yield conn
+        except BaseException:
+            self._set_depth(db_path, depth)
+            if depth == 0 and conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+        self._set_depth(db_path, depth)
+        if depth == 0 and conn.in_transaction:
+            conn.execute('COMMIT')
+
+    def in_transaction(self, db_path) -> bool:
+        return self._get_depth(db_path) > 0
+
+    def close(self, db_path=None):
+        """Закрывает соединения текущего потока (все или только для db_path)"""
+
+        connections = self._get_thread_connections()
+        paths = [db_path] if db_path else list(connections)
+
+        for path in paths:
+            conn = connections.pop(path, None)
+            self._get_depths().pop(path, None)
+            if conn is not None:
+                with self._lock:
+                    if conn in self._connections:
+                        self._connections.remove(conn)
+                conn.close()
+
+    def close_all(self):
+        """
+        Закрывает соединения всех потоков, например при выходе из приложения. Соединение, созданное
+        в другом живом потоке (фоновая запись журнала сканирований), sqlite3 закрыть не дает - оно остается
+        зарегистрированным и рабочим для своего потока, который закроет его сам (close)
+        """
+
+        with self._lock:
+            connections = list(self._connections)
+
+        closed = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                continue
+            closed.append(conn)
+
+        with self._lock:
+            self._connections = [conn for conn in self._connections if conn not in closed]
+
+        self._get_thread_connections().clear()
+        self._get_depths().clear()
+
+    def _configure(self, conn):
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+
+    def _get_thread_connections(self) -> dict:
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def _get_depths(self) -> dict:
+        if not hasattr(self._local, 'depths'):
+            self._local.depths = {}
+        return self._local.depths
+
+    def _get_depth(self, db_path) -> int:
+        return self._get_depths().get(db_path, 0)
+
+    def _set_depth(self, db_path, value):
+        self._get_depths()[db_path] = value
+
+
+connection_manager = ConnectionManager()
@@ -1,8 +1,12 @@
 import json
+import time
 from typing import List
 
 from ru.travelfood.simple_ui import SimpleSQLProvider as sqlClass
-from ui_global import get_query_result, bulk_query
+import ui_barcodes
+from ui_global import get_query_result, iter_query, bulk_query, transaction, get_barcode_resolution
+from goods_search import goods_search_index
+from query_cache import query_cache
 from tiny_db_services import TinyNoSQLProvider, ScanningQueueService
 
 
@@ -56,6 +60,8 @@ class TimerService(DbService):
             else:
                 self.provider.replace(values)
 
+            query_cache.bump(table_name)
+
     def get_new_load_docs(self, data: dict) -> dict:
         loaded_documents = {}
 
@@ -83,8 +89,15 @@ class TimerService(DbService):
         data = DocService().get_data_to_send() + AdrDocService().get_data_to_send()
         return data
 
+    def iter_data_to_send(self, batch_size=100):
+        for service in (DocService(), AdrDocService()):
+            yield from service.iter_data_to_send(batch_size)
+
 
 class BarcodeService(DbService):
+    # 4 параметра на штрихкод, с запасом до лимита 999 параметров старых сборок SQLite
+    barcodes_chunk_size = 200
+
     def __init__(self):
         super().__init__()
         self.provider = SqlQueryProvider(table_name='Rs_barcodes', sql_class=sqlClass())
@@ -93,7 +106,7 @@ class BarcodeService(DbService):
         if barcode_info.scheme == 'GS1':
             search_value = barcode_info.gtin
         else:
-            search_value = barcode_info.barcode
+            return self._get_barcode_data_by_resolution(barcode_info.barcode, id_doc)
 
         q = '''
             SELECT 
@@ -104,39 +117,160 @@ class BarcodeService(DbService):
                 barcodes.ratio AS ratio,
                 IFNULL(doc_barcodes.approved, 0) AS approved,
                 IFNULL(doc_barcodes.id, 0) AS mark_id,
-                IFNULL(goods.use_mark, false) AS use_mark,
+                IFNULL(types_goods.use_mark, false) AS use_mark,
                 IFNULL(doc_table.id, '') AS row_key,
                 IFNULL(doc_table.qtty, 0.0) AS qtty,
                 IFNULL(doc_table.qtty_plan, 0.0) AS qtty_plan
                 
             FROM RS_barcodes AS barcodes
-            LEFT JOIN 
-                    (SELECT 
-                        goods.id AS id_goods, 
-                        types_goods.use_mark 
-                        
-                    FROM  RS_goods AS goods
-                    JOIN RS_types_goods AS types_goods ON goods.type_good = types_goods.id) AS goods
-                ON barcodes.id_good = goods.id_goods
+            LEFT JOIN RS_goods AS goods
+                ON barcodes.id_good = goods.id
+            LEFT JOIN RS_types_goods AS types_goods
+                ON goods.type_good = types_goods.id
             
             LEFT JOIN RS_docs_table AS doc_table 
                 ON barcodes.id_good = doc_table.id_good
                      AND barcodes.id_property = doc_table.id_properties
                      AND barcodes.id_unit = doc_table.id_unit
-                     AND doc_table.id_doc = {}
+                     AND doc_table.id_doc = :id_doc
                      
             LEFT JOIN RS_docs_barcodes as doc_barcodes
-                ON doc_barcodes.id_doc = {}
-                    AND doc_barcodes.GTIN = {}
-                    AND doc_barcodes.Series = {}
+                ON doc_barcodes.id_doc = :id_doc
+                    AND doc_barcodes.GTIN = :gtin
+                    AND doc_barcodes.Series = :series
                 
-            WHERE barcodes.barcode = {}'''.format(
-            id_doc, id_doc, barcode_info.GTIN, barcode_info.Series, search_value)
+            WHERE barcodes.barcode = :barcode'''
 
-        result = self.provider.sql_query(q)
+        params = {
+            'id_doc': id_doc,
+            'gtin': barcode_info.gtin,
+            'series': barcode_info.serial,
+            'barcode': search_value,
+        }
+
+        result = get_query_result(q, params, return_dict=True)
         if result:
             return result[0]
 
+    @staticmethod
+    def _get_barcode_data_by_resolution(barcode, id_doc):
+        # Обычный штрихкод: товар из кэша штрихкодов, из базы читается только строка документа
+        barcode_data = get_barcode_resolution(barcode)
+        if not barcode_data:
+            return None
+
+        q = '''
+            SELECT id, qtty, qtty_plan
+            FROM RS_docs_table
+            WHERE id_doc = ? AND id_good = ? AND id_properties = ? AND id_unit = ?
+            LIMIT 1'''
+        rows = get_query_result(
+            q, (id_doc, barcode_data['id_good'], barcode_data['id_property'], barcode_data['id_unit']),
+            return_dict=True)
+        row = rows[0] if rows else {}
+
+        if barcode_data['use_mark'] is None:
+            barcode_data['use_mark'] = 0
+        barcode_data.update({
+            'approved': 0,
+            'mark_id': 0,
+            'row_key': row.get('id') if row.get('id') is not None else '',
+            'qtty': row.get('qtty') if row.get('qtty') is not None else 0.0,
+            'qtty_plan': row.get('qtty_plan') if row.get('qtty_plan') is not None else 0.0,
+        })
+
+        return barcode_data
+
+    def get_barcodes_data(self, barcodes_info: list, id_doc) -> list:
+        """
+        То же, что get_barcode_data, для списка штрихкодов: один запрос на порцию из barcodes_chunk_size кодов.
+        Результат - список той же длины, что barcodes_info: данные штрихкода или None, если он не найден
+        """
+
+        result = [None] * len(barcodes_info)
+
+        for start in range(0, len(barcodes_info), self.barcodes_chunk_size):
+            chunk = barcodes_info[start:start + self.barcodes_chunk_size]
+            params = []
+            for idx, barcode_info in enumerate(chunk, start):
+                search_value = barcode_info.gtin if barcode_info.scheme == 'GS1' else barcode_info.barcode
+                params.extend((idx, search_value, barcode_info.gtin, barcode_info.serial))
+            params.extend((id_doc, id_doc))
+
+            q = '''
+                WITH scanned (idx, barcode, gtin, series) AS (VALUES {})
+                SELECT
+                    scanned.idx AS idx,
+                    barcodes.id_good AS id_good,
+                    barcodes.id_property AS id_property,
+                    barcodes.id_series AS id_series,
+                    barcodes.id_unit AS id_unit,
+                    barcodes.ratio AS ratio,
+                    IFNULL(doc_barcodes.approved, 0) AS approved,
+                    IFNULL(doc_barcodes.id, 0) AS mark_id,
+                    IFNULL(types_goods.use_mark, false) AS use_mark,
+                    IFNULL(doc_table.id, '') AS row_key,
+                    IFNULL(doc_table.qtty, 0.0) AS qtty,
+                    IFNULL(doc_table.qtty_plan, 0.0) AS qtty_plan
+
+                FROM scanned
+                JOIN RS_barcodes AS barcodes
+                    ON barcodes.barcode = scanned.barcode
+                LEFT JOIN RS_goods AS goods
+                    ON barcodes.id_good = goods.id
+                LEFT JOIN RS_types_goods AS types_goods
+                    ON goods.type_good = types_goods.id
+
+                LEFT JOIN RS_docs_table AS doc_table
+                    ON barcodes.id_good = doc_table.id_good
+                         AND barcodes.id_property = doc_table.id_properties
+                         AND barcodes.id_unit = doc_table.id_unit
+                         AND doc_table.id_doc = ?
+
+                LEFT JOIN RS_docs_barcodes as doc_barcodes
+                    ON doc_barcodes.id_doc = ?
+                        AND doc_barcodes.GTIN = scanned.gtin
+                        AND doc_barcodes.Series = scanned.series
+                '''.format(', '.join('(?, ?, ?, ?)' for _ in chunk))
+
+            for row in get_query_result(q, params, return_dict=True):
+                idx = row.pop('idx')
+                if result[idx] is None:
+                    result[idx] = row
+
+        return result
+
+    @staticmethod
+    def save_scan_batch(docs_table_rows: list, marks_rows: list) -> list:
+        """
+        Записывает строки товаров (RS_docs_table) и марки (RS_docs_barcodes) одной транзакцией.
+        Строки с id обновляются, без id - добавляются. Возвращает id записанных строк товаров
+        """
+
+        rows_ids = []
+        with transaction():
+            for row in docs_table_rows:
+                rows_ids.append(BarcodeService._save_row('RS_docs_table', row))
+
+            for row in marks_rows:
+                BarcodeService._save_row('RS_docs_barcodes', row)
+
+        return rows_ids
+
+    @staticmethod
+    def _save_row(table_name, row: dict):
+        row = dict(row)
+        row_id = row.pop('id', None)
+
+        if row_id:
+            q = 'UPDATE {} SET {} WHERE id = ?'.format(table_name, ', '.join(f'{key} = ?' for key in row))
+            get_query_result(q, tuple(row.values()) + (row_id,))
+            return row_id
+
+        q = 'INSERT INTO {} ({}) VALUES ({})'.format(table_name, ', '.join(row), ','.join('?' * len(row)))
+        get_query_result(q, tuple(row.values()))
+        return get_query_result('SELECT last_insert_rowid()')[0][0]
+
     def get_barcode_from_doc_table(self, id_doc_table: str) -> str:
         q = '''
         SELECT barcode
@@ -166,6 +300,135 @@ class BarcodeService(DbService):
         provider = ScanningQueueService()
         provider.save_scanned_row_data(queue_update_data)
 
+    @staticmethod
+    def insert_no_sql_many(queue_update_data: list):
+        if not queue_update_data:
+            return
+        provider = ScanningQueueService()
+        provider.save_scanned_rows_data(queue_update_data)
+
+
+class BulkLoader:
+    """
+    Загрузка данных обмена (НСИ и документы) в SQLite через executemany с параметрами.
+    Каждая таблица грузится одной транзакцией, строки передаются в executemany порциями по chunk_size.
+    После загрузки в stats лежит количество строк и время загрузки по каждой таблице.
+    """
+
+    table_list = (
+        'RS_doc_types', 'RS_goods', 'RS_properties', 'RS_units', 'RS_types_goods', 'RS_series', 'RS_countragents',
+        'RS_warehouses', 'RS_price_types', 'RS_cells', 'RS_barcodes', 'RS_prices', 'RS_docs',
+        'RS_docs_table', 'RS_docs_barcodes', 'RS_adr_docs', 'RS_adr_docs_table')
+    tables_for_delete = ('RS_docs_table', 'RS_adr_docs_table')
+    docs_tables = ('RS_docs', 'RS_adr_docs')
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self.stats = {}
+
+    def load(self, data: dict, docs=None) -> dict:
+        """
+        :param data: словарь {имя таблицы: список строк} из ответа сервера
+        :param docs: {id_doc: verified} - сохраняемый флаг verified для загружаемых документов
+        :return: stats
+        """
+
+        if docs is None:
+            docs = {}
+
+        self.stats = {}
+        doc_ids = []
+
+        for table_name in self.table_list:
+            rows = data.get(table_name)
+            if not rows:
+                continue
+
+            if table_name in self.docs_tables:
+                doc_ids.extend(row['id_doc'] for row in rows)
+
+            start = time.time()
+            columns = self._get_columns(table_name, rows[0])
+            query = 'REPLACE INTO {} ({}) VALUES ({})'.format(
+                table_name, ', '.join(columns), ','.join('?' * len(columns)))
+
+            count = 0
+            with transaction() as conn:
+                # Удалим из базы строки тех документов, что мы загружаем
+                if table_name in self.tables_for_delete and doc_ids:
+                    self._delete_doc_rows(conn, table_name, doc_ids)
+
+                for chunk in self._get_chunks(self._get_params(table_name, rows, docs)):
+                    conn.executemany(query, chunk)
+                    count += len(chunk)
+
+            query_cache.bump(table_name)
+            self.stats[table_name] = {'rows': count, 'time': round(time.time() - start, 3)}
+
+        return self.stats
+
+    def _get_columns(self, table_name, first_row: dict) -> list:
+        columns = [col for col in first_row if col != 'mark_code']
+        if 'mark_code' in first_row:
+            columns += ['GTIN', 'Series']
+        if table_name in self.docs_tables and 'verified' not in columns:
+            columns.append('verified')
+
+        return columns
+
+    def _get_params(self, table_name, rows, docs):
+        source_columns = [col for col in rows[0] if col != 'mark_code']
+        has_mark_code = 'mark_code' in rows[0]
+        is_docs_table = table_name in self.docs_tables
+
+        # Коды марок разбираются одним проходом вместе со строками
+        marks = ui_barcodes.split_mark_codes(row.get('mark_code') for row in rows) if has_mark_code else None
+
+        for row in rows:
+            values = [self._get_value(row.get(col)) for col in source_columns]
+
+            if has_mark_code:
+                values += next(marks)
+
+            if is_docs_table:
+                # Здесь устанавливаем флаг verified!!!
+                verified = docs.get(row['id_doc'], 0)
+                if 'verified' in source_columns:
+                    values[source_columns.index('verified')] = verified
+                else:
+                    values.append(verified)
+
+            yield values
+
+    def _get_chunks(self, params):
+        chunk = []
+        for values in params:
+            chunk.append(values)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def _delete_doc_rows(self, conn, table_name, doc_ids):
+        # Ограничение SQLite на количество параметров в запросе
+        step = 500
+        for i in range(0, len(doc_ids), step):
+            part = doc_ids[i:i + step]
+            conn.execute(
+                'DELETE FROM {} WHERE id_doc IN ({})'.format(table_name, ','.join('?' * len(part))),
+                part)
+
+    @staticmethod
+    def _get_value(value):
+        return '' if value is None else value
+
+    @staticmethod
+    def parse_mark_code(val):
+        gtin, series = next(ui_barcodes.split_mark_codes([val]))
+        return {'GTIN': gtin, 'Series': series}
+
 
 class DocService:
     def __init__(self, doc_id=''):
@@ -176,9 +439,12 @@ class DocService:
         self.sql_text = ''
         self.sql_params = None
         self.debug = False
+        self.load_stats = {}
         self.provider = SqlQueryProvider(self.docs_table_name, sql_class=sqlClass())
 
-    def get_last_edited_goods(self, to_json=False):
+    def get_last_edited_goods(self, to_json=False, pending_rows: dict = None):
+        """pending_rows - незаписанные в базу сканы документа (ScanJournal.get_pending_rows)"""
+
         query_docs = f'SELECT * FROM {self.docs_table_name} WHERE id_doc = ? and verified = 1'
 
         query_goods = f'''
@@ -193,11 +459,38 @@ class DocService:
             raise e
             # return {'Error': e.args[0]}
 
+        if pending_rows:
+            self._add_pending_rows(res_goods, pending_rows)
+
         if not res_goods:
             return None
 
         return self.form_data_for_request(res_docs, res_goods, to_json)
 
+    def _add_pending_rows(self, res_goods: list, pending_rows: dict):
+        goods = {(item['id_good'], item['id_properties'], item['id_series']): item for item in res_goods}
+        query = f'''
+        SELECT * FROM {self.docs_table_name}_table
+        WHERE id_doc = ? AND id_good = ? AND id_properties = ? AND id_series = ?
+        LIMIT 1
+        '''
+
+        for key, pending_row in pending_rows.items():
+            item = goods.get(key)
+            if item is None:
+                # Строка уже отправлена (sent = 1) или еще не записана в базу
+                res = get_query_result(query, (self.doc_id, *key), True)
+                row = pending_row['row']
+                item = res[0] if res else {
+                    'id': None, 'id_doc': self.doc_id, 'id_good': row['id_good'],
+                    'id_properties': row['id_property'], 'id_series': row['id_series'], 'id_unit': row['id_unit'],
+                    'qtty': 0, 'd_qtty': None, 'qtty_plan': None, 'price': 0, 'id_price': '', 'sent': 0,
+                    'is_plan': 'False', 'id_cell': None}
+                res_goods.append(item)
+
+            item['qtty'] = (item['qtty'] or 0) + pending_row['qtty']
+            item['last_updated'] = pending_row['last_updated']
+
     def form_data_for_request(self, res_docs, res_goods, to_json):
         for item in res_docs:
             filtered_list = [d for d in res_goods if d['id_doc'] == item['id_doc']]
@@ -234,24 +527,15 @@ class DocService:
         docs = {item['id_doc']: item['verified'] or False for item in
                 self._get_query_result(query_text=query, return_dict=True)}
 
-        queries = self.json_to_sqlite_query(data, docs)
-
-        for query in queries:
-            try:
-                self._get_query_result(query)
-            except Exception as e:
-                raise e
+        self.load_stats = BulkLoader().load(data, docs)
 
         return docs
 
     def update_nsi(self, data):
-        queries = self.json_to_sqlite_query(data)
+        self.load_stats = BulkLoader().load(data)
 
-        for query in queries:
-            try:
-                self._get_query_result(query)
-            except Exception as e:
-                raise e
+        if data.get('RS_goods'):
+            goods_search_index.rebuild()
 
     def update_sent_data(self, data):
         if data:
@@ -305,10 +589,16 @@ class DocService:
 
             query = f"REPLACE INTO {table_name} ({', '.join(query_col_names)}) VALUES "
             values = []
+            if 'mark_code' in column_names:
+                marks = ui_barcodes.split_mark_codes(row.get('mark_code') for row in data[table_name])
 
             for row in data[table_name]:
+                if 'mark_code' in column_names:
+                    # Заменяем поле mark_code на поля GTIN и Series
+                    row['GTIN'], row['Series'] = next(marks)
+
                 row_values = []
-                list_quoted_fields = ('name', 'full_name', "mark_code")
+                list_quoted_fields = ('name', 'full_name', 'Series')
                 for col in query_col_names:
                     if col in list_quoted_fields and "\"" in row[col]:
                         row[col] = row[col].replace("\"", "\"\"")
@@ -320,12 +610,7 @@ class DocService:
                     if row.get(col) is None:
                         row[col] = ''
 
-                    if col == 'mark_code':  # Заменяем это поле на поля GTIN и Series
-                        barc_struct = self.parse_barcode(row[col])
-                        row_values.append(barc_struct['GTIN'])
-                        row_values.append(barc_struct['Series'])
-                    else:
-                        row_values.append(row[col])  # (f'"{row[col]}"')
+                    row_values.append(row[col])  # (f'"{row[col]}"')
 
                     if col == 'id_doc' and (table_name in ['RS_docs', 'RS_adr_docs']):
                         doc_id_list.append('"' + row[col] + '"')
@@ -358,7 +643,9 @@ class DocService:
 
     def get_doc_types(self) -> list:
         query = f'SELECT DISTINCT doc_type from {self.docs_table_name}'
-        doc_types = [rec[0] for rec in self._get_query_result(query)]
+        res = query_cache.get('get_doc_types', query, None, [self.docs_table_name],
+                              lambda: self._get_query_result(query))
+        doc_types = [rec[0] for rec in res]
         return doc_types
 
     def get_doc_view_data(self, doc_type='', doc_status='') -> list:
@@ -429,52 +716,23 @@ class DocService:
         for query in queryes:
             self._get_query_result(query, (id_doc,))
 
+        ScanningQueueService().remove_doc(id_doc)
+
 
     def get_docs_stat(self):
-        query = f'''
-        WITH tmp AS (
-            SELECT 
-                doc_type,
-                {self.docs_table_name}.id_doc,
-                1 as doc_Count,
-                IFNULL({self.docs_table_name}.sent,0) as sent,
-                IFNULL({self.docs_table_name}.verified,0) as verified, 
-                CASE WHEN IFNULL(verified,0)=0 THEN 
-                    COUNT({self.details_table_name}.id)
-                ELSE 
-                    0 
-                END as count_verified,
-                CASE WHEN IFNULL(verified,0)=1 THEN 
-                    count({self.details_table_name}.id)
-                ELSE 
-                    0 
-                END as count_unverified,
-                CASE WHEN IFNULL(verified,0)=0 THEN
-                     SUM({self.details_table_name}.qtty_plan)
-                ELSE 
-                    0 
-                END as qtty_plan_verified,
-                CASE WHEN IFNULL(verified,0)=1 THEN 
-                    SUM({self.details_table_name}.qtty_plan)
-                ELSE 
-                    0 
-                END as qtty_plan_unverified
-            FROM {self.docs_table_name}
-            LEFT JOIN {self.details_table_name} 
-                ON {self.details_table_name}.id_doc = {self.docs_table_name}.id_doc
-            GROUP BY {self.docs_table_name}.id_doc
-        )
+        # Статистика берется из RS_doc_stats, которую поддерживают триггеры на RS_docs, RS_docs_table, RS_barc_flow
+        query = '''
         SELECT 
             doc_type as docType, 
-            COUNT(id_doc),
-            SUM(doc_Count) as count, 
+            COUNT(id_doc) as "COUNT(id_doc)",
+            COUNT(*) as count, 
             SUM(sent) as sent, 
             SUM(verified) as verified,
-            SUM(count_verified) as count_verified,
-            SUM(count_unverified) as count_unverified,
-            SUM(qtty_plan_verified) as qtty_plan_verified,
-            SUM(qtty_plan_unverified) as qtty_plan_unverified
-        FROM tmp
+            SUM(CASE WHEN verified = 0 THEN lines_count ELSE 0 END) as count_verified,
+            SUM(CASE WHEN verified = 1 THEN lines_count ELSE 0 END) as count_unverified,
+            SUM(CASE WHEN verified = 0 THEN qtty_plan ELSE 0 END) as qtty_plan_verified,
+            SUM(CASE WHEN verified = 1 THEN qtty_plan ELSE 0 END) as qtty_plan_unverified
+        FROM RS_doc_stats
         GROUP BY doc_type
         '''
 
@@ -482,45 +740,156 @@ class DocService:
         return res
 
     def get_doc_flow_stat(self):
-        query = f'''
-        WITH tmp AS (
-            SELECT 
-                doc_type,
-                RS_docs.id_doc,
-                1 as doc_Count,
-                IFNULL(RS_docs.sent,0) as sent,
-                IFNULL(RS_docs.verified,0) as verified,
-
-                count(RS_barc_flow.barcode) as barc_count
-
-            FROM RS_docs
-            
-            LEFT JOIN RS_barc_flow 
-                ON RS_docs.id_doc = RS_barc_flow.id_doc
-                
-           WHERE  RS_docs.id_doc not in (SELECT distinct
-                id_doc
-                From 
-                RS_docs_table
-                )              
-                  
-            GROUP BY RS_docs.id_doc
-        )
+        query = '''
         SELECT 
             doc_type as docType, 
             COUNT(id_doc) as id_count,
-            SUM(doc_Count) as count, 
+            COUNT(*) as count, 
             SUM(sent) as sent, 
             SUM(verified) as verified,
             SUM(barc_count) as barc_count
-        FROM tmp
+        FROM RS_doc_stats
+        WHERE lines_count = 0
         GROUP BY doc_type
         '''
         res = self._get_query_result(query, return_dict=True)
         return res
 
-    def get_doc_details_data(self, id_doc, first_elem, items_on_page, row_filters=None, search_string=None) -> list:
-        select_query = f"""
+    def check_docs_stat(self) -> list:
+        """Документы, для которых RS_doc_stats расходится с данными документов"""
+
+        import database_init_queryes
+
+        query = f'''
+        WITH actual AS ({database_init_queryes.doc_stats_query()})
+        SELECT actual.id_doc
+        FROM actual
+        LEFT JOIN RS_doc_stats AS stats
+            ON stats.id_doc = actual.id_doc
+        WHERE stats.id_doc IS NULL
+            OR stats.doc_type IS NOT actual.doc_type
+            OR stats.sent != actual.sent
+            OR stats.verified != actual.verified
+            OR stats.lines_count != actual.lines_count
+            OR stats.barc_count != actual.barc_count
+            OR ABS(stats.qtty_plan - actual.qtty_plan) > 0.000001
+        UNION
+        SELECT id_doc
+        FROM RS_doc_stats
+        WHERE id_doc NOT IN (SELECT id_doc FROM RS_docs)
+        '''
+
+        return [row[0] for row in self._get_query_result(query)]
+
+    def rebuild_docs_stat(self):
+        import database_init_queryes
+
+        with transaction():
+            get_query_result('DELETE FROM RS_doc_stats')
+            get_query_result(database_init_queryes.doc_stats_query(
+                'INSERT INTO RS_doc_stats (id_doc, doc_type, sent, verified, lines_count, qtty_plan, barc_count)'))
+
+    details_key_fields = (('row_updated', 'DESC'), ('row_id', 'DESC'))
+
+    def get_doc_details_data(self, id_doc, first_elem, items_on_page, row_filters=None, search_string=None,
+                             after=None) -> list:
+        page = self.get_doc_details_page(id_doc, first_elem, items_on_page, row_filters, search_string,
+                                         after=after, with_last_scanned=False)
+        return page['rows']
+
+    def get_doc_details_page(self, id_doc, first_elem, items_on_page, row_filters=None, search_string=None,
+                             after=None, with_last_scanned=True) -> dict:
+        """
+        Страница строк документа, последняя отсканированная строка и общее количество строк за один запрос.
+        after - ключ последней строки предыдущей страницы (next_key), с ним страница выбирается
+        по ключу (keyset) без OFFSET
+        """
+
+        filtered_query, params = self._get_doc_details_filter(id_doc, row_filters, search_string)
+        select_query, joins = self._get_doc_details_select()
+        return self._get_details_page(filtered_query, select_query, joins, params,
+                                      first_elem, items_on_page, after, with_last_scanned)
+
+    def add_pending_rows(self, id_doc, page: dict, pending_rows: dict):
+        """
+        Учитывает в странице get_doc_details_page незаписанные в базу сканы (ScanJournal.get_pending_rows):
+        количество строк страницы и последняя отсканированная строка
+        """
+
+        if not pending_rows:
+            return
+
+        rows = {}
+        for row in page['rows'] + ([page['last_scanned']] if page['last_scanned'] else []):
+            key = (row['id_good'], row['id_properties'], row['id_series'])
+            pending_row = pending_rows.get(key)
+            if pending_row:
+                self._add_pending_qtty(row, pending_row)
+            rows[key] = row
+
+        # Последний скан журнала новее любого записанного в базу
+        key, pending_row = next(reversed(pending_rows.items()))
+        last_scanned = rows.get(key)
+        if last_scanned is None:
+            last_scanned = self._get_doc_details_row(id_doc, key)
+            if last_scanned:
+                self._add_pending_qtty(last_scanned, pending_row)
+            else:
+                last_scanned = self._get_new_doc_details_row(id_doc, pending_row)
+
+        page['last_scanned'] = dict(last_scanned)
+
+    @staticmethod
+    def _add_pending_qtty(row: dict, pending_row: dict):
+        row['qtty'] = (row['qtty'] or 0) + pending_row['qtty']
+        row['IsDone'] = row['qtty_plan'] - row['qtty'] if row['qtty_plan'] is not None else None
+        row['last_updated'] = pending_row['last_updated']
+
+    def _get_doc_details_row(self, id_doc, key):
+        select_query, joins = self._get_doc_details_select()
+        query = f"""
+            {select_query}
+            FROM RS_docs_table
+            {joins}
+            WHERE RS_docs_table.id_doc = ? AND RS_docs_table.id_good = ?
+            AND RS_docs_table.id_properties = ? AND RS_docs_table.id_series = ?
+            LIMIT 1
+            """
+        res = self._get_query_result(query, (id_doc, *key), return_dict=True)
+        return res[0] if res else None
+
+    def _get_new_doc_details_row(self, id_doc, pending_row: dict) -> dict:
+        """Строка, которой еще нет в базе (как ее добавит ui_global.write_scan)"""
+
+        row = pending_row['row']
+        query = """
+            SELECT
+            RS_goods.name as good_name,
+            RS_goods.code,
+            RS_goods.art,
+            RS_properties.name as properties_name,
+            RS_series.name as series_name,
+            RS_units.name as units_name
+            FROM RS_goods
+            LEFT JOIN RS_properties
+            ON RS_properties.id = :id_property
+            LEFT JOIN RS_series
+            ON RS_series.id = :id_series
+            LEFT JOIN RS_units
+            ON RS_units.id = :id_unit
+            WHERE RS_goods.id = :id_good
+            """
+        res = self._get_query_result(query, row, return_dict=True)
+        names = res[0] if res else {'good_name': None, 'code': None, 'art': None, 'properties_name': None,
+                                    'series_name': None, 'units_name': None}
+
+        return dict(names, id=None, id_doc=id_doc, id_good=row['id_good'], id_properties=row['id_property'],
+                    id_series=row['id_series'], id_unit=row['id_unit'], qtty=pending_row['qtty'], qtty_plan=None,
+                    price=0, price_name=None, IsDone=None, last_updated=pending_row['last_updated'])
+
+    @staticmethod
+    def _get_doc_details_select():
+        select_query = """
             SELECT
             RS_docs_table.id,
             RS_docs_table.id_doc,
@@ -540,10 +909,10 @@ class DocService:
             RS_price_types.name as price_name,
             RS_docs_table.qtty_plan -RS_docs_table.qtty as IsDone,
             RS_docs_table.last_updated
-            
-            FROM RS_docs_table 
+            """
 
-            LEFT JOIN RS_goods 
+        joins = """
+            LEFT JOIN RS_goods
             ON RS_goods.id=RS_docs_table.id_good
             LEFT JOIN RS_properties
             ON RS_properties.id =RS_docs_table.id_properties
@@ -555,38 +924,143 @@ class DocService:
             ON RS_price_types.id =RS_docs_table.id_price
             """
 
-        where = f"""WHERE id_doc = '{str(id_doc)}'"""
-        row_filters_condition = """AND qtty != COALESCE(qtty_plan, '0') """ if row_filters else ''
-        search_string_condition = f"""AND good_name LIKE '%{search_string}%'""" if search_string else ''
+        return select_query, joins
 
-        where_query = f"""
-        {where}
-        {row_filters_condition}
-        {search_string_condition}
+    def get_doc_details_count(self, id_doc, row_filters=None, search_string=None) -> int:
+        filtered_query, params = self._get_doc_details_filter(id_doc, row_filters, search_string)
+        res = self._get_query_result(f'SELECT COUNT(*) AS total_rows FROM ({filtered_query})', params, True)
+        return res[0]['total_rows'] if res else 0
+
+    def _get_doc_details_filter(self, id_doc, row_filters=None, search_string=None):
+        row_filters_condition = "AND RS_docs_table.qtty != COALESCE(RS_docs_table.qtty_plan, '0')" if row_filters else ''
+        search_string_condition, params = self._get_search_string_condition('RS_docs_table.id_good', search_string)
+
+        query = f"""
+            SELECT
+            RS_docs_table.id AS row_id,
+            RS_docs_table.last_updated AS row_updated
+            FROM RS_docs_table
+            WHERE RS_docs_table.id_doc = :id_doc
+            {row_filters_condition}
+            {search_string_condition}
+            """
+
+        params['id_doc'] = str(id_doc)
+        return query, params
+
+    @staticmethod
+    def _get_search_string_condition(id_good_field, search_string):
+        if not search_string:
+            return '', {}
+
+        search_query, params = goods_search_index.get_search_query(search_string)
+        return f'AND {id_good_field} IN (SELECT id FROM ({search_query}))', params
+
+    def _get_details_page(self, filtered_query, select_query, joins, params,
+                          first_elem, items_on_page, after=None, with_last_scanned=True) -> dict:
+        """
+        Строки выбираются в два шага: сначала ключи строк страницы по отфильтрованному набору,
+        затем соединения со справочниками только для этих строк
         """
-        order_by = """ORDER BY last_updated DESC"""
-        limit = f'LIMIT {items_on_page} OFFSET {first_elem}'
-        query = f"{select_query} {where_query} {order_by} {limit}"
 
-        res = self._get_query_result(query, return_dict=True)
-        # res = self._sql_query(query, '')
-        return res
+        order_by = ', '.join(f'{field} {direction}' for field, direction in self.details_key_fields)
+        key_fields = ', '.join(field for field, _ in self.details_key_fields)
+        # Ключ с NULL (строка без last_updated) не сравнивается, такую страницу выбираем через OFFSET
+        if after and None in after:
+            after = None
+        params = dict(params, limit=items_on_page, offset=0 if after else first_elem)
+
+        page_query = f'''
+            SELECT {key_fields}, 0 AS last_scanned FROM ({filtered_query})
+            ORDER BY {order_by}
+            LIMIT :limit OFFSET :offset
+            '''
 
-    def parse_barcode(self, val):
-        if len(val) < 21:
-            return {'GTIN': '', 'Series': ''}
+        if after:
+            keyset_condition, keyset_params = self._get_keyset_condition(self.details_key_fields, after)
+            params.update(keyset_params)
+            # При сортировке по убыванию строки с NULL идут в конце и в диапазон ключа не попадают
+            first_field, first_direction = self.details_key_fields[0]
+            null_tail_condition = f'{first_field} IS NULL' if first_direction == 'DESC' else '0'
+            page_query = f'''
+                SELECT * FROM (
+                    SELECT {key_fields}, 0 AS last_scanned FROM ({filtered_query})
+                    WHERE {keyset_condition}
+                    ORDER BY {order_by}
+                    LIMIT :limit)
+                UNION ALL
+                SELECT * FROM (
+                    SELECT {key_fields}, 0 AS last_scanned FROM ({filtered_query})
+                    WHERE {null_tail_condition}
+                    ORDER BY {order_by}
+                    LIMIT :limit)
+                ORDER BY {order_by}
+                LIMIT :limit
+                '''
 
-        val.replace('(01)', '01')
-        val.replace('(21)', '21')
+        last_scanned_query = f'''
+            UNION ALL
+            SELECT * FROM (
+                SELECT {key_fields}, 1 AS last_scanned FROM ({filtered_query})
+                ORDER BY {order_by}
+                LIMIT 1)
+            ''' if with_last_scanned else ''
+        total_rows = f'(SELECT COUNT(*) FROM ({filtered_query}))' if with_last_scanned else 'NULL'
 
-        if val[:2] == '01':
-            GTIN = val[2:16]
-            Series = val[18:]
-        else:
-            GTIN = val[:14]
-            Series = val[14:]
+        query = f'''
+            WITH page AS ({page_query}),
+            keys AS (
+                SELECT * FROM page
+                {last_scanned_query}
+            )
+            {select_query},
+            keys.last_scanned AS last_scanned,
+            {total_rows} AS total_rows,
+            {', '.join(f'keys.{field}' for field, _ in self.details_key_fields)}
+            FROM keys
+            JOIN {self.details_table_name} ON {self.details_table_name}.id = keys.row_id
+            {joins}
+            ORDER BY keys.last_scanned DESC, {', '.join(f'keys.{field} {direction}'
+                                                        for field, direction in self.details_key_fields)}
+            '''
+
+        result = {'rows': [], 'last_scanned': None, 'total': 0, 'next_key': None}
+        for row in self._get_query_result(query, params, return_dict=True):
+            key = [row.pop(field) for field, _ in self.details_key_fields]
+            result['total'] = row.pop('total_rows')
+            if row.pop('last_scanned'):
+                result['last_scanned'] = row
+            else:
+                result['rows'].append(row)
+                result['next_key'] = key
 
-        return {'GTIN': GTIN, 'Series': Series}
+        if not with_last_scanned:
+            result['total'] = None
+
+        return result
+
+    @staticmethod
+    def _get_keyset_condition(key_fields, after):
+        """
+        Условие "строка идет после ключа after" для сортировки по key_fields.
+        Первое поле дополнительно ограничено диапазоном, чтобы чтение индекса начиналось сразу с нужного места
+        """
+
+        params = {f'after_{i}': value for i, value in enumerate(after)}
+        conditions = []
+
+        for i, (field, direction) in enumerate(key_fields):
+            operator = '<' if direction == 'DESC' else '>'
+            equal = [f'{f} = :after_{j}' for j, (f, _) in enumerate(key_fields[:i])]
+            conditions.append('(' + ' AND '.join(equal + [f'{field} {operator} :after_{i}']) + ')')
+
+        first_field, first_direction = key_fields[0]
+        range_operator = '<=' if first_direction == 'DESC' else '>='
+
+        return f'{first_field} {range_operator} :after_0 AND ({" OR ".join(conditions)})', params
+
+    def parse_barcode(self, val):
+        return BulkLoader.parse_mark_code(val)
 
     def clear_barcode_data(self, id_doc):
         query_text = ('Update RS_docs_barcodes Set approved = 0 Where id_doc=:id_doc',
@@ -656,58 +1130,54 @@ class DocService:
             return None
         return self.form_data_for_request(res_docs, res_goods, False)
 
+    data_to_send_tables = (
+        ('RS_docs_table', ('id_doc', 'id_good', 'id_properties', 'id_series', 'id_unit', 'qtty', 'qtty_plan'),
+         'AND (sent = 0 OR sent IS NULL)'),
+        ('RS_docs_barcodes', ('id_doc', 'id_good', 'id_property', 'id_series', 'barcode_from_scanner', 'GTIN',
+                              'Series'), ''),
+        ('RS_barc_flow', ('id_doc', 'barcode'), ''),
+    )
+
     def get_data_to_send(self):
         data = []
+        for batch in self.iter_data_to_send():
+            data.extend(batch)
+
+        return data
+
+    def iter_data_to_send(self, batch_size=100):
+        """
+        Документы к выгрузке пачками по batch_size. На пачку выполняется по одному запросу
+        на каждую таблицу из data_to_send_tables, строки раскладываются по документам в Python
+        """
 
         q = f'''SELECT id_doc
                 FROM {self.docs_table_name} 
                 WHERE verified = 1  AND (sent = 0 OR sent IS NULL)
             '''
-        res = self.provider.sql_query(q)
-
-        for row in res:
-            id_doc = row['id_doc']
-
-            doc_data = {
-                'id_doc': id_doc,
-            }
+        docs_ids = [row['id_doc'] for row in self.provider.sql_query(q)]
 
-            fields = ['id_doc', 'id_good', 'id_properties', 'id_series', 'id_unit', 'qtty', 'qtty_plan']
-            q = '''
-                SELECT {}
-                FROM RS_docs_table
-                WHERE id_doc = ? AND (sent = 0 OR sent IS NULL)
-            '''.format(','.join(fields))
+        for i in range(0, len(docs_ids), batch_size):
+            yield self._get_docs_data_to_send(docs_ids[i:i + batch_size])
 
-            goods = self.provider.sql_query(q, id_doc)
-            doc_data['RS_docs_table'] = goods
+    def _get_docs_data_to_send(self, docs_ids: list) -> list:
+        docs = {id_doc: {'id_doc': id_doc} for id_doc in docs_ids}
+        placeholders = ','.join('?' * len(docs_ids))
 
+        for table_name, fields, condition in self.data_to_send_tables:
+            for doc_data in docs.values():
+                doc_data[table_name] = []
 
-            fields = ['id_doc', 'id_good', 'id_property', 'id_series', 'barcode_from_scanner', 'GTIN', 'Series']
             q = '''
                 SELECT {}
-                FROM RS_docs_barcodes
-                WHERE id_doc = ?
-            '''.format(','.join(fields))
-
-            doc_barcodes = self.provider.sql_query(q, id_doc)
-            doc_data['RS_docs_barcodes'] = doc_barcodes
+                FROM {}
+                WHERE id_doc IN ({}) {}
+            '''.format(','.join(fields), table_name, placeholders, condition)
 
+            for row in self.provider.sql_query(q, docs_ids):
+                docs[row['id_doc']][table_name].append(row)
 
-            fields = ['id_doc', 'barcode']
-            q = '''
-                SELECT {}
-                FROM RS_barc_flow
-                WHERE id_doc = ?
-            '''.format(','.join(fields))
-
-            barc_flow = self.provider.sql_query(q, id_doc)
-            doc_data['RS_barc_flow'] = barc_flow
-
-            data.append(doc_data)
-
-        return data
-
+        return list(docs.values())
 
     def get_count_mark_codes(self, id_doc):
         q = '''
@@ -772,8 +1242,68 @@ class AdrDocService(DocService):
     def get_current_cell(self):
         pass
 
+    def get_docs_stat(self):
+        query = f'''
+        WITH tmp AS (
+            SELECT 
+                doc_type,
+                {self.docs_table_name}.id_doc,
+                1 as doc_Count,
+                IFNULL({self.docs_table_name}.sent,0) as sent,
+                IFNULL({self.docs_table_name}.verified,0) as verified, 
+                CASE WHEN IFNULL(verified,0)=0 THEN 
+                    COUNT({self.details_table_name}.id)
+                ELSE 
+                    0 
+                END as count_verified,
+                CASE WHEN IFNULL(verified,0)=1 THEN 
+                    count({self.details_table_name}.id)
+                ELSE 
+                    0 
+                END as count_unverified,
+                CASE WHEN IFNULL(verified,0)=0 THEN
+                     SUM({self.details_table_name}.qtty_plan)
+                ELSE 
+                    0 
+                END as qtty_plan_verified,
+                CASE WHEN IFNULL(verified,0)=1 THEN 
+                    SUM({self.details_table_name}.qtty_plan)
+                ELSE 
+                    0 
+                END as qtty_plan_unverified
+            FROM {self.docs_table_name}
+            LEFT JOIN {self.details_table_name} 
+                ON {self.details_table_name}.id_doc = {self.docs_table_name}.id_doc
+            GROUP BY {self.docs_table_name}.id_doc
+        )
+        SELECT 
+            doc_type as docType, 
+            COUNT(id_doc),
+            SUM(doc_Count) as count, 
+            SUM(sent) as sent, 
+            SUM(verified) as verified,
+            SUM(count_verified) as count_verified,
+            SUM(count_unverified) as count_unverified,
+            SUM(qtty_plan_verified) as qtty_plan_verified,
+            SUM(qtty_plan_unverified) as qtty_plan_unverified
+        FROM tmp
+        GROUP BY doc_type
+        '''
+
+        res = self._get_query_result(query, return_dict=True)
+        return res
+
+    details_key_fields = (('row_cell', 'ASC'), ('row_updated', 'DESC'), ('row_id', 'DESC'))
+
     def get_doc_details_data(self, first_elem, items_on_page, row_filters=None, search_string=None, id_doc='',
-                             curCell='', ) -> list:
+                             curCell='', after=None) -> list:
+        page = self.get_doc_details_page(first_elem, items_on_page, row_filters, search_string, id_doc, curCell,
+                                         after=after, with_last_scanned=False)
+        return page['rows']
+
+    def get_doc_details_page(self, first_elem, items_on_page, row_filters=None, search_string=None, id_doc='',
+                             curCell='', after=None, with_last_scanned=True) -> dict:
+        filtered_query, params = self._get_doc_details_filter(id_doc, row_filters, search_string, curCell)
         select_query = '''SELECT
             RS_adr_docs_table.id,
             RS_adr_docs_table.id_doc,
@@ -792,11 +1322,10 @@ class AdrDocService(DocService):
             RS_adr_docs_table.qtty_plan - RS_adr_docs_table.qtty as IsDone,
             ifnull(RS_adr_docs_table.id_cell, :EmptyString) as id_cell,
             ifnull(RS_cells.name, :NullValue) as cell_name
-            
-            
-            FROM RS_adr_docs_table 
+            '''
 
-            LEFT JOIN RS_goods 
+        joins = '''
+            LEFT JOIN RS_goods
             ON RS_goods.id=RS_adr_docs_table.id_good
             LEFT JOIN RS_properties
             ON RS_properties.id = RS_adr_docs_table.id_properties
@@ -808,28 +1337,41 @@ class AdrDocService(DocService):
             ON RS_cells.id=RS_adr_docs_table.id_cell
             '''
 
-        basic_where = f"""WHERE id_doc = :id_doc and table_type = :table_type"""
+        params.update({'NullValue': None, 'EmptyString': ''})
+        return self._get_details_page(filtered_query, select_query, joins, params,
+                                      first_elem, items_on_page, after, with_last_scanned)
 
-        cur_cell_condition = '''and (id_cell=:current_cell OR id_cell="" OR id_cell is Null)''' if curCell else ''
-        row_filters_condition = """AND qtty != COALESCE(qtty_plan, '0') """ if row_filters else ''
-        search_string_condition = f"""AND good_name LIKE '%{search_string}%'""" if search_string else ''
+    def get_doc_details_count(self, id_doc, row_filters=None, search_string=None, curCell='') -> int:
+        filtered_query, params = self._get_doc_details_filter(id_doc, row_filters, search_string, curCell)
+        res = self._get_query_result(f'SELECT COUNT(*) AS total_rows FROM ({filtered_query})', params, True)
+        return res[0]['total_rows'] if res else 0
 
-        where_full = f"""
-                {basic_where}
-                {cur_cell_condition}
-                {row_filters_condition}
-                {search_string_condition}
-        """
+    def _get_doc_details_filter(self, id_doc, row_filters=None, search_string=None, curCell=''):
+        cur_cell_condition = '''AND (RS_adr_docs_table.id_cell = :current_cell 
+            OR RS_adr_docs_table.id_cell = "" OR RS_adr_docs_table.id_cell IS NULL)''' if curCell else ''
+        row_filters_condition = (
+            "AND RS_adr_docs_table.qtty != COALESCE(RS_adr_docs_table.qtty_plan, '0')" if row_filters else '')
+        search_string_condition, params = self._get_search_string_condition('RS_adr_docs_table.id_good',
+                                                                            search_string)
+
+        query = f'''
+            SELECT
+            RS_adr_docs_table.id AS row_id,
+            ifnull(RS_adr_docs_table.last_updated, '') AS row_updated,
+            ifnull(RS_cells.name, '') AS row_cell
+            FROM RS_adr_docs_table
+            LEFT JOIN RS_cells ON RS_cells.id = RS_adr_docs_table.id_cell
+            WHERE RS_adr_docs_table.id_doc = :id_doc AND RS_adr_docs_table.table_type = :table_type
+            {cur_cell_condition}
+            {row_filters_condition}
+            {search_string_condition}
+            '''
 
-        order_by = f"""ORDER BY RS_cells.name, RS_adr_docs_table.last_updated DESC"""
-        limit = f'LIMIT {items_on_page} OFFSET {first_elem}'
-        query_text = f"{select_query} {where_full} {order_by} {limit}"
-        # self.table_type = 'out'  #****** ОТЛАДОЧНОЕ
-        params_dict = {'id_doc': id_doc, 'NullValue': None, 'EmptyString': '', 'table_type': self.table_type}
+        params.update({'id_doc': id_doc, 'table_type': self.table_type})
         if curCell:
-            params_dict['current_cell'] = curCell
-        res = self._get_query_result(query_text, params_dict, return_dict=True)
-        return res
+            params['current_cell'] = curCell
+
+        return query, params
 
     def clear_barcode_data(self, id_doc):
         query_text = ('Update RS_adr_docs_table Set qtty = 0 Where id_doc=:id_doc',
@@ -842,34 +1384,11 @@ class AdrDocService(DocService):
 
         return {'result': True, 'error': ''}
 
-    def get_data_to_send(self):
-        data = []
-
-        q = f'''SELECT id_doc
-                FROM {self.docs_table_name} 
-                WHERE verified = 1  AND (sent = 0 OR sent IS NULL)
-            '''
-        res = self.provider.sql_query(q)
-
-        for row in res:
-            id_doc = row['id_doc']
+    data_to_send_tables = (
+        ('RS_adr_docs_table', ('id_doc', 'id_good', 'id_properties', 'id_series', 'id_unit', 'qtty', 'qtty_plan',
+                               'table_type'), 'AND (sent = 0 OR sent IS NULL)'),
+    )
 
-            doc_data = {
-                'id_doc': id_doc,
-            }
-
-            fields = ['id_doc', 'id_good', 'id_properties', 'id_series', 'id_unit', 'qtty', 'qtty_plan', 'table_type']
-            q = '''
-                SELECT {}
-                FROM RS_adr_docs_table 
-                WHERE id_doc = ? AND (sent = 0 OR sent IS NULL)
-            '''.format(','.join(fields))
-
-            goods = self.provider.sql_query(q, id_doc)
-            doc_data['RS_adr_docs_table'] = goods
-            data.append(doc_data)
-
-        return data
 
 class FlowDocService(DocService):
 
@@ -1002,10 +1521,11 @@ class GoodsService(DbService):
         self.provider = SqlQueryProvider(table_name="RS_goods", sql_class=sqlClass())
 
     def get_type_name_by_id(self, id):
-        query_text = f"SELECT name FROM RS_types_goods WHERE id ='{id}'"
-        return self._get_query_result(query_text, return_dict=True)
+        query_text = "SELECT name FROM RS_types_goods WHERE id = ?"
+        return query_cache.get('get_type_name_by_id', query_text, (id,), ['RS_types_goods'],
+                               lambda: get_query_result(query_text, (id,), return_dict=True))
 
-    def get_goods_list_data(self, goods_type='', item_id='') -> list:
+    def get_goods_list_data(self, goods_type='', item_id='', search_string='') -> list:
         query_text = f"""
             SELECT
             RS_goods.id,
@@ -1022,30 +1542,40 @@ class GoodsService(DbService):
             LEFT JOIN RS_units
             ON RS_units.id = RS_goods.unit
             """
-        where = '' if not goods_type else 'WHERE RS_goods.type_good=?'
+        where = '' if not goods_type else 'WHERE RS_goods.type_good=:goods_type'
         if where == '' and item_id:
-            where += 'WHERE RS_goods.id=?'
+            where += 'WHERE RS_goods.id=:item_id'
+
+        args = {}
+        order_by = 'RS_goods.id'
+        if search_string:
+            # Найденные товары сортируются по релевантности
+            search_query, args = goods_search_index.get_search_query(search_string)
+            query_text += f"""
+            JOIN ({search_query}) AS goods_search
+            ON goods_search.id = RS_goods.id
+            """
+            order_by = 'goods_search.rank, RS_goods.id'
 
         query_text = f'''
                     {query_text}
                     {where}
-                    ORDER BY RS_goods.id
+                    ORDER BY {order_by}
                 '''
 
         if goods_type:
-            args = goods_type
+            args['goods_type'] = goods_type
         elif item_id:
-            args = item_id
-        else:
-            args = None
+            args['item_id'] = item_id
 
-        result = self._sql_query(query_text, args)
+        result = self._sql_query(query_text, args or None)
         return result
 
     def get_all_goods_types_data(self):
         query_text = 'SELECT id,name FROM RS_types_goods'
         self.provider.table_name = 'RS_types_goods'
-        return self._sql_query(query_text, '')
+        return query_cache.get('get_all_goods_types_data', query_text, None, ['RS_types_goods'],
+                               lambda: self._sql_query(query_text, ''))
 
     def get_values_from_barcode(self, identify_field: str, identify_value: str) -> list:
         query_text = f"""
@@ -1083,7 +1613,8 @@ class GoodsService(DbService):
     def get_select_data(self, table_name):
         query_text = f'SELECT * FROM {table_name}'
         self.provider.table_name = table_name
-        return self._sql_query(query_text, '')
+        return query_cache.get('get_select_data', query_text, None, [table_name],
+                               lambda: self._sql_query(query_text, ''))
 
 
 class DbCreator(DbService):
@@ -1097,11 +1628,33 @@ class DbCreator(DbService):
         for el in schema:
             get_query_result(el)
 
+        self.apply_migrations()
+
+        goods_search_index.reset()
+        goods_search_index.create()
+
+    def apply_migrations(self):
+        import database_init_queryes
+        res = get_query_result('SELECT IFNULL(MAX(version), 0) FROM RS_migrations')
+        current_version = res[0][0] if res else 0
+
+        for version, queries in database_init_queryes.database_migrations():
+            if version <= current_version:
+                continue
+
+            with transaction():
+                for query in queries:
+                    get_query_result(query)
+                get_query_result('INSERT INTO RS_migrations (version) VALUES (?)', (version,))
+
     def drop_all_tables(self):
         tables = self.get_all_tables()
 
+        # Вместе с виртуальной таблицей FTS удаляются ее служебные таблицы
         for table in tables:
-            self._sql_query(f'DROP TABLE {table}')
+            self._sql_query(f'DROP TABLE IF EXISTS {table}')
+
+        goods_search_index.reset()
 
 
     def get_all_tables(self):
@@ -1123,7 +1676,7 @@ class ErrorService:
     @staticmethod
     def get_all_errors(date_sort):
         sort = "DESC" if not date_sort or date_sort == "Новые" else "ASC"
-        return get_query_result(f"SELECT * FROM Error_log ORDER BY timestamp {sort}")
+        return iter_query(f"SELECT * FROM Error_log ORDER BY timestamp {sort}")
 
     @staticmethod
     def clear():
@@ -1131,10 +1684,16 @@ class ErrorService:
 
 
 class SqlQueryProvider:
-    def __init__(self, table_name='', sql_class=sqlClass(), debug=False):
+    """
+    Построитель и исполнитель запросов к таблице table_name.
+    По умолчанию запросы выполняются в процессе через ui_global (параметры - кортежи/списки Python,
+    результат - список словарей). Если передан use_bridge=True, запросы идут через sql_class
+    (Java SimpleSQLProvider) и параметры/результат сериализуются в строки и JSON, как того требует мост.
+    """
+
+    def __init__(self, table_name='', sql_class=sqlClass(), debug=False, use_bridge=False):
         self.table_name = table_name
-        # self.sql = sql_class
-        self.sql = self
+        self.sql = sql_class if use_bridge else self
         self.sql_text = ''
         self.sql_params = None
         self.debug = debug
@@ -1150,6 +1709,10 @@ class SqlQueryProvider:
     def table_name(self, v):
         self._table_name = v
 
+    @property
+    def use_bridge(self) -> bool:
+        return self.sql is not self
+
     def create(self, data):
         if not data:
             return
@@ -1206,10 +1769,10 @@ class SqlQueryProvider:
 
     def select(self, _filter=None) -> list:
         where = None
-        params = ''
+        params = None
         if _filter:
             where = list(_filter)
-            params = [str(v) for v in _filter.values()]
+            params = list(_filter.values())
 
         return self._exec_select(
             params=params,
@@ -1222,7 +1785,6 @@ class SqlQueryProvider:
 
         q = f'INSERT INTO {self.table_name} ({str_keys}) VALUES ({str_values})'
 
-        params = json.dumps(params, ensure_ascii=False)
         return self.sql_exec_many(q, params)
 
     def _exec_replace(self, columns, params):
@@ -1231,7 +1793,6 @@ class SqlQueryProvider:
 
         q = f'REPLACE INTO {self.table_name} ({str_columns}) VALUES ({str_values})'
 
-        params = json.dumps(params, ensure_ascii=False)
         return self.sql_exec_many(q, params)
 
     def _exec_update(self, columns, params, where=None):
@@ -1244,7 +1805,6 @@ class SqlQueryProvider:
 
         q = f'UPDATE {self.table_name} SET {str_values} WHERE {str_where}'
 
-        params = json.dumps(params, ensure_ascii=False)
         return self.sql_exec_many(q, params)
 
     def _exec_delete(self, params, where=None):
@@ -1255,7 +1815,6 @@ class SqlQueryProvider:
 
         q = f'DELETE FROM {self.table_name} WHERE {str_where}'
 
-        params = json.dumps(params, ensure_ascii=False)
         return self.sql_exec_many(q, params)
 
     def _exec_select(self, params, where=None):
@@ -1266,30 +1825,84 @@ class SqlQueryProvider:
 
         q = f'SELECT * FROM {self.table_name} WHERE {str_where}'
 
-        params = ', '.join(params)
         return self.sql_query(q, params)
 
     def sql_exec_many(self, q, params):
         self.sql_text = q
         self.sql_params = params
 
-        if not self.debug:
-            return self.sql.SQLExecMany(q, params)
+        if self.debug:
+            return
+
+        if self.use_bridge:
+            # Запись мимо ui_global - версии таблиц для кэша увеличиваем сами
+            query_cache.bump_for_query(q)
+            return self.sql.SQLExecMany(q, self._to_bridge_params_many(params))
+        return bulk_query(q, self._to_native_params_many(params))
 
-    def sql_exec(self, q, params):
+    def sql_exec(self, q, params=None):
         self.sql_text = q
         self.sql_params = params
 
-        if not self.debug:
-            return self.sql.SQLExec(q, params=params)
+        if self.debug:
+            return
+
+        if self.use_bridge:
+            query_cache.bump_for_query(q)
+            return self.sql.SQLExec(q, params=self._to_bridge_params(params))
+        return get_query_result(q, self._to_native_params(params))
 
-    def sql_query(self, q, params: str = '') -> List[dict]:
+    def sql_query(self, q, params=None) -> List[dict]:
         self.sql_text = q
         self.sql_params = params
 
-        if not self.debug:
-            result = self.sql.SQLQuery(q, params)
+        if self.debug:
+            return
+
+        if self.use_bridge:
+            result = self.sql.SQLQuery(q, self._to_bridge_params(params))
             return json.loads(result)
+        return get_query_result(q, self._to_native_params(params), return_dict=True)
+
+    @staticmethod
+    def _to_native_params(params):
+        """
+        Параметры одного запроса для sqlite3: кортеж или словарь.
+        Строка считается значением единственного параметра. Строки через запятую ('a,b')
+        поддерживаются только мостом (SQLExec/SQLQuery) - значения с запятыми там ломаются.
+        """
+
+        if params is None or params == '':
+            return None
+        elif isinstance(params, dict):
+            return params
+        elif isinstance(params, (list, tuple)):
+            return tuple(params)
+        else:
+            return (params,)
+
+    @staticmethod
+    def _to_native_params_many(params):
+        if isinstance(params, str):
+            return json.loads(params) if params else []
+        return params or []
+
+    @staticmethod
+    def _to_bridge_params(params):
+        if params is None:
+            return ''
+        elif isinstance(params, str):
+            return params
+        elif isinstance(params, (list, tuple)):
+            return ','.join(str(v) for v in params)
+        else:
+            return str(params)
+
+    @staticmethod
+    def _to_bridge_params_many(params):
+        if isinstance(params, str):
+            return params
+        return json.dumps(params, ensure_ascii=False)
 
     @staticmethod
     def _convert_query_data(data, filter_data=None):
@@ -0,0 +1,245 @@
+import threading
+
+from ui_global import get_query_result, transaction
+from query_cache import query_cache
+
+
+class DocSession:
+    """
+    Данные документа на время работы с ним на экране сканирования: строки товаров по ключу
+    (id_good, id_properties, id_unit), итоги плана, признак контроля и множество одобренных марок (GTIN, Series).
+    Экран хранит сессию у себя (экран - синглтон new_handlers.current_screen), поэтому между событиями
+    данные не перечитываются из базы.
+    Изменения пишутся сразу в базу и в сессию (write-through). Если таблица изменилась в обход
+    сессии (загрузка таймером, _update_document_data), ее версия в query_cache меняется
+    и соответствующая часть сессии перечитывается при следующем обращении. invalidate() сбрасывает все части.
+    Сканы, которые записал в базу журнал (scan_journal), сессия получает через on_scans_written
+    из его фонового потока - поэтому загрузка и изменения частей выполняются под self.lock
+    """
+
+    # Части сессии и таблицы, от которых они зависят. Части загружаются и перечитываются независимо,
+    # чтобы, например, запись строки товаров не приводила к перечитыванию всех марок документа
+    parts = {
+        'doc': 'RS_docs',
+        'rows': 'RS_docs_table',
+        'marks': 'RS_docs_barcodes',
+    }
+    row_fields = ('id', 'id_doc', 'id_good', 'id_properties', 'id_series', 'id_unit', 'qtty', 'd_qtty',
+                  'qtty_plan', 'last_updated', 'id_cell')
+
+    def __init__(self, id_doc):
+        self.id_doc = id_doc
+        self._rows = {}
+        self._approved_marks = set()
+        self._qtty_plan = 0
+        self._mark_plan_count = 0
+        self._control = False
+        self._versions = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_row_key(id_good, id_properties, id_unit) -> tuple:
+        return id_good or '', id_properties or '', id_unit or ''
+
+    @property
+    def qtty_plan(self) -> float:
+        if self.is_loaded('rows'):
+            return self._qtty_plan
+
+        # Версия таблицы общая для всех документов и меняется при каждой записи скана - чтобы не перечитывать
+        # все строки документа, итог плана берется из RS_doc_stats (его поддерживают триггеры)
+        res = get_query_result('SELECT qtty_plan FROM RS_doc_stats WHERE id_doc = ?', (self.id_doc,))
+        if res:
+            return res[0][0] or 0
+
+        self._check_loaded('rows')
+        return self._qtty_plan
+
+    @property
+    def have_qtty_plan(self) -> bool:
+        return self.qtty_plan > 0
+
+    @property
+    def have_mark_plan(self) -> bool:
+        self._check_loaded('marks')
+        return self._mark_plan_count > 0
+
+    @property
+    def control(self) -> bool:
+        self._check_loaded('doc')
+        return self._control
+
+    def get_row(self, id_good, id_properties, id_unit) -> dict:
+        self._check_loaded('rows')
+        row = self._rows.get(self.get_row_key(id_good, id_properties, id_unit))
+        return dict(row) if row else None
+
+    def get_rows(self) -> list:
+        self._check_loaded('rows')
+        return [dict(row) for row in self._rows.values()]
+
+    def is_mark_approved(self, gtin, series, check_db=True) -> bool:
+        """
+        Марка уже отсканирована в документе. Проверка по множеству в памяти, без запроса к базе.
+        Если марки в множестве нет и check_db, она ищется в базе (например, одобрена в обход сессии)
+        """
+
+        self._check_loaded('marks')
+        if (gtin, series) in self._approved_marks:
+            return True
+
+        if check_db:
+            res = get_query_result(
+                'SELECT 1 FROM RS_docs_barcodes WHERE id_doc = ? AND GTIN = ? AND Series = ? AND approved = ? LIMIT 1',
+                (self.id_doc, gtin, series, '1'))
+            if res:
+                self._approved_marks.add((gtin, series))
+                return True
+
+        return False
+
+    def get_versions(self, part=None):
+        """
+        Версии таблицы части сессии (без part - словарь по всем частям) - запоминаются перед записью
+        в обход сессии (add_approved_marks, on_scans_written)
+        """
+
+        if part is None:
+            return {name: query_cache.versions(table) for name, table in self.parts.items()}
+        return query_cache.versions(self.parts[part])
+
+    def add_approved_marks(self, marks, versions_before):
+        """
+        Марки (GTIN, Series) только что записаны в базу одобренными (сканирование) - добавляем их в множество
+        без перечитывания. versions_before - get_versions('marks') перед записью: если марки в сессии уже тогда
+        были устаревшими (таблицу изменили в обход сессии) или еще не загружались, они будут перечитаны из базы
+        при следующем обращении
+        """
+
+        with self.lock:
+            if self._versions.get('marks') is not None and self._versions['marks'] == versions_before:
+                self._approved_marks.update(marks)
+                self._update_versions('marks')
+
+    def on_scans_written(self, entries, versions_before: dict):
+        """
+        Журнал сканирований записал в базу сканы entries (ScanJournal.drain), versions_before - get_versions()
+        перед записью. Сканы документа учитываются в сессии без перечитывания марок и строк
+        """
+
+        entries = [entry for entry in entries if entry['id_doc'] == self.id_doc]
+        self.add_approved_marks([(entry['mark']['GTIN'], entry['mark']['Series'])
+                                 for entry in entries if entry['mark']], versions_before['marks'])
+
+        with self.lock:
+            if self._versions.get('rows') is None or self._versions['rows'] != versions_before['rows']:
+                return
+
+            for entry in entries:
+                row = entry['row']
+                session_row = self._rows.get(self.get_row_key(row['id_good'], row['id_property'], row['id_unit']))
+                if session_row is None or (session_row['id_series'] or '') != (row['id_series'] or ''):
+                    # Новая строка документа: ее id известен только базе - строки перечитаются при обращении
+                    return
+                session_row['qtty'] = (session_row['qtty'] or 0) + entry['qtty']
+                session_row['last_updated'] = entry['last_updated']
+
+            self._update_versions('rows')
+
+    def add_approved_mark(self, gtin, series, versions_before):
+        self.add_approved_marks([(gtin, series)], versions_before)
+
+    def update_row(self, row: dict) -> dict:
+        """
+        Записывает строку товаров документа (с id - обновление переданных полей, без id - новая строка)
+        в базу и в сессию. Возвращает записанную строку с id
+        """
+
+        self._check_loaded('rows')
+        row = {key: value for key, value in row.items() if key in self.row_fields}
+        row['id_doc'] = self.id_doc
+        row_id = row.pop('id', None)
+        versions_before = self.get_versions('rows')
+
+        with transaction():
+            if row_id:
+                query = 'UPDATE RS_docs_table SET {} WHERE id = ?'.format(', '.join(f'{key} = ?' for key in row))
+                get_query_result(query, tuple(row.values()) + (row_id,))
+            else:
+                query = 'INSERT INTO RS_docs_table ({}) VALUES ({})'.format(
+                    ', '.join(row), ','.join('?' * len(row)))
+                get_query_result(query, tuple(row.values()))
+                row_id = get_query_result('SELECT last_insert_rowid()')[0][0]
+        row['id'] = row_id
+
+        with self.lock:
+            # Как в add_approved_marks: если таблицу между проверкой и записью изменили в обход сессии
+            # (например, журнал сканирований), строки перечитаются при следующем обращении
+            if self._versions.get('rows') is not None and self._versions['rows'] == versions_before:
+                key = self.get_row_key(row.get('id_good'), row.get('id_properties'), row.get('id_unit'))
+                old_row = self._rows.get(key) or {}
+                self._qtty_plan += (row.get('qtty_plan') or 0) - (old_row.get('qtty_plan') or 0)
+                self._rows[key] = dict(old_row, **row)
+                self._update_versions('rows')
+
+        return dict(row)
+
+    def approve_mark(self, gtin, series, barcode_from_scanner=None):
+        """Отмечает марку документа (GTIN + серия) отсканированной"""
+
+        self._check_loaded('marks')
+        versions_before = self.get_versions('marks')
+        get_query_result(
+            'UPDATE RS_docs_barcodes SET approved = ?, barcode_from_scanner = ifnull(?, barcode_from_scanner) '
+            'WHERE id_doc = ? AND GTIN = ? AND Series = ?',
+            ('1', barcode_from_scanner, self.id_doc, gtin, series))
+
+        self.add_approved_mark(gtin, series, versions_before)
+
+    def invalidate(self):
+        self._versions = {}
+
+    def is_loaded(self, part=None) -> bool:
+        parts = [part] if part else list(self.parts)
+        return all(self._versions.get(name) is not None
+                   and self._versions[name] == query_cache.versions(self.parts[name]) for name in parts)
+
+    def load(self, part=None):
+        with self.lock:
+            for name in ([part] if part else list(self.parts)):
+                versions = query_cache.versions(self.parts[name])
+                getattr(self, f'_load_{name}')()
+                self._versions[name] = versions
+
+    def _load_doc(self):
+        res = get_query_result('SELECT control FROM RS_docs WHERE id_doc = ?', (self.id_doc,))
+        self._control = bool(res) and res[0][0] not in (0, '0', 'false', 'False', None)
+
+    def _load_rows(self):
+        rows = get_query_result(
+            'SELECT {} FROM RS_docs_table WHERE id_doc = ? ORDER BY id'.format(', '.join(self.row_fields)),
+            (self.id_doc,), True)
+        self._rows = {}
+        for row in rows:
+            # Как и в запросах сканирования, берется первая строка с таким ключом
+            self._rows.setdefault(self.get_row_key(row['id_good'], row['id_properties'], row['id_unit']), row)
+        self._qtty_plan = sum(row['qtty_plan'] or 0 for row in rows)
+
+    def _load_marks(self):
+        self._approved_marks = set()
+        self._mark_plan_count = 0
+        marks = get_query_result(
+            'SELECT GTIN, Series, is_plan, approved FROM RS_docs_barcodes WHERE id_doc = ?', (self.id_doc,))
+        for gtin, series, is_plan, approved in marks:
+            if approved in (1, '1'):
+                self._approved_marks.add((gtin, series))
+            if is_plan in (1, '1'):
+                self._mark_plan_count += 1
+
+    def _check_loaded(self, part):
+        if not self.is_loaded(part):
+            self.load(part)
+
+    def _update_versions(self, part):
+        # Свои изменения уже учтены в сессии - перечитывать не нужно
+        self._versions[part] = query_cache.versions(self.parts[part])
@@ -0,0 +1,107 @@
+import re
+import sqlite3
+
+from ui_global import get_query_result, transaction
+
+
+class GoodsSearchIndex:
+    """
+    Полнотекстовый поиск товаров по наименованию, артикулу, коду и описанию.
+    Индекс RS_goods_fts (FTS5, external content над RS_goods) поддерживается триггерами,
+    после массовой загрузки НСИ перестраивается целиком (rebuild).
+    Если SQLite собран без FTS5, поиск выполняется через LIKE по тем же полям.
+    """
+
+    table_name = 'RS_goods_fts'
+    fields = ('name', 'art', 'code', 'description')
+
+    def __init__(self):
+        self._available = None
+
+    def create(self) -> bool:
+        fields = ', '.join(self.fields)
+        new_values = ', '.join(f'new.{field}' for field in self.fields)
+        old_values = ', '.join(f'old.{field}' for field in self.fields)
+
+        queries = [
+            f'''CREATE VIRTUAL TABLE IF NOT EXISTS {self.table_name} USING fts5(
+                {fields}, content='RS_goods', content_rowid='rowid', tokenize='unicode61', prefix='2 3')''',
+
+            f'''CREATE TRIGGER IF NOT EXISTS RS_goods_fts_insert AFTER INSERT ON RS_goods BEGIN
+                INSERT INTO {self.table_name} (rowid, {fields}) VALUES (new.rowid, {new_values});
+            END''',
+
+            f'''CREATE TRIGGER IF NOT EXISTS RS_goods_fts_delete AFTER DELETE ON RS_goods BEGIN
+                INSERT INTO {self.table_name} ({self.table_name}, rowid, {fields})
+                VALUES ('delete', old.rowid, {old_values});
+            END''',
+
+            f'''CREATE TRIGGER IF NOT EXISTS RS_goods_fts_update AFTER UPDATE ON RS_goods BEGIN
+                INSERT INTO {self.table_name} ({self.table_name}, rowid, {fields})
+                VALUES ('delete', old.rowid, {old_values});
+                INSERT INTO {self.table_name} (rowid, {fields}) VALUES (new.rowid, {new_values});
+            END''',
+        ]
+
+        try:
+            with transaction():
+                for query in queries:
+                    get_query_result(query)
+        except sqlite3.OperationalError:
+            # Нет модуля fts5 - остаемся на поиске через LIKE
+            self._available = False
+            return False
+
+        self._available = True
+        self.rebuild()
+        return True
+
+    def rebuild(self):
+        if self.is_available():
+            get_query_result(f"INSERT INTO {self.table_name} ({self.table_name}) VALUES ('rebuild')")
+
+    def is_available(self) -> bool:
+        if self._available is None:
+            res = get_query_result('SELECT name FROM sqlite_master WHERE type = ? AND name = ?',
+                                   ('table', self.table_name))
+            self._available = bool(res)
+
+        return self._available
+
+    def reset(self):
+        """Сбрасывает признак наличия индекса, например после пересоздания таблиц"""
+        self._available = None
+
+    def get_search_query(self, search_string, fields=None):
+        """
+        Подзапрос (id, rank) товаров, подходящих под строку поиска, и его параметры.
+        Каждое слово строки ищется по префиксу, rank - релевантность (меньше - лучше).
+        Результат можно использовать в условии "id_good IN (SELECT id FROM ...)" или в JOIN с сортировкой по rank
+        """
+
+        fields = [field for field in (fields or self.fields) if field in self.fields] or list(self.fields)
+        words = re.findall(r'\w+', search_string or '')
+
+        if self.is_available():
+            match = ' AND '.join(f'"{word}"*' for word in words) or '""'
+            if len(fields) < len(self.fields):
+                match = '{{{}}} : ({})'.format(' '.join(fields), match)
+
+            query = f'''
+                SELECT RS_goods.id AS id, {self.table_name}.rank AS rank
+                FROM {self.table_name}
+                JOIN RS_goods ON RS_goods.rowid = {self.table_name}.rowid
+                WHERE {self.table_name} MATCH :goods_search
+                '''
+            return query, {'goods_search': match}
+
+        conditions = [f'RS_goods.{field} LIKE :goods_search' for field in fields]
+        query = f'''
+            SELECT RS_goods.id AS id, 0 AS rank
+            FROM RS_goods
+            WHERE {' OR '.join(conditions)}
+            '''
+        return query, {'goods_search': f'%{search_string}%'}
+
+
+goods_search_index = GoodsSearchIndex()
@@ -1,9 +1,136 @@
+import threading
 from typing import Optional
 from dataclasses import dataclass
 
 import requests
 import json
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class _ConnectCountingPool:
+    """Считает соединения, которые пулу urllib3 пришлось открыть перед запросом (новые и переоткрытые)"""
+
+    connects = 0
+
+    def _validate_conn(self, conn):
+        if getattr(conn, 'sock', None) is None:
+            self.connects += 1
+        super()._validate_conn(conn)
+
+
+class _CountingHTTPConnectionPool(_ConnectCountingPool, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_ConnectCountingPool, HTTPSConnectionPool):
+    pass
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool, 'https': _CountingHTTPSConnectionPool}
+
+
+class HttpSessionPool:
+    """
+    Общие requests.Session по базовому адресу и учетным данным: соединения с сервером 1С
+    и отладочным хостом переиспользуются (keep-alive), а не открываются заново (TCP, TLS) на каждый запрос.
+    Сессия создается при первом запросе. pool_size - соединений на хост, keep_alive=False - закрывать
+    соединение после ответа, timeout (подключение, чтение) - если запрос не передал свой. Время чтения
+    по умолчанию не ограничено: загрузка НСИ (get_data, server_load_data) может отвечать минутами.
+    stats()/report() - запросы и сколько из них ушло по уже открытому соединению (отладочный экран)
+    """
+
+    def __init__(self, pool_size=4, keep_alive=True, connect_timeout=5, read_timeout=None):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        # Соединения закрытых сессий (configure, close)
+        self._closed_connections = 0
+
+    @property
+    def timeout(self) -> tuple:
+        return self.connect_timeout, self.read_timeout
+
+    def configure(self, **settings):
+        """Новые параметры применяются к сессиям, созданным после вызова: открытые закрываются"""
+
+        for key, value in settings.items():
+            if not hasattr(self, key):
+                raise ValueError(f'Unknown http session setting: {key}')
+            setattr(self, key, value)
+        self.close()
+
+    def get_session(self, base_url, auth: tuple = None) -> requests.Session:
+        key = (base_url, auth)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = _CountingHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if auth:
+                    session.auth = HTTPBasicAuth(*auth)
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._sessions[key] = session
+
+            return session
+
+    def request(self, method, url, base_url, auth: tuple = None, **kwargs) -> requests.Response:
+        session = self.get_session(base_url, auth)
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            self._requests += 1
+
+        return session.request(method, url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._closed_connections += self._count_connections()
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            connections = self._closed_connections + self._count_connections()
+            return {
+                'sessions': len(self._sessions),
+                'requests': self._requests,
+                'connections': connections,
+                'reused': max(self._requests - connections, 0),
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        if not stats['requests']:
+            return 'HTTP: запросов не было'
+
+        return 'HTTP: запросов {requests}, новых соединений {connections}, повторно использовано {reused}'.format(
+            **stats)
+
+    def _count_connections(self) -> int:
+        count = 0
+        for session in self._sessions.values():
+            for adapter in set(session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    count += adapter.poolmanager.pools[key].connects
+        return count
+
+
+http_sessions = HttpSessionPool()
 
 
 class HsService:
@@ -16,14 +143,14 @@ class HsService:
         self.user_name = http_params['user_name']
         self.params = {'user_name': self.user_name, 'device_model': self.device_model}
         self._hs = ''
-        self._method = requests.get
+        self._method = 'GET'
         self.auth = HTTPBasicAuth(self.username, self.password)
         self.headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
         self.http_answer: Optional[HsService.HttpAnswer] = None
 
     def get_templates(self, **kwargs):
         self._hs = 'label_templates'
-        self._method = requests.get
+        self._method = 'GET'
         answer = self._send_request(kwargs)
         if answer['status_code'] == 200:
 
@@ -39,7 +166,7 @@ class HsService:
 
     def get_data(self, **kwargs) -> dict:
         self._hs = 'data'
-        self._method = requests.get
+        self._method = 'GET'
         answer = self._send_request(kwargs)
 
         if answer['status_code'] == 200:
@@ -67,7 +194,7 @@ class HsService:
 
     def get_document_lines(self, id_doc: str, **kwargs) -> 'HttpAnswer':
         self._hs = 'document_lines'
-        self._method = requests.get
+        self._method = 'GET'
         self.params['id_doc'] = id_doc
         answer = self._send_request(kwargs)
 
@@ -85,7 +212,7 @@ class HsService:
         kwargs['data'] = data if isinstance(data, str) else json.dumps(data)
 
         self._hs = 'document_lines'
-        self._method = requests.post
+        self._method = 'POST'
         self.params['id_doc'] = id_doc
 
         answer = self._send_request(kwargs)
@@ -99,7 +226,7 @@ class HsService:
 
     def reset_exchange(self, **kwargs):
         self._hs = 'reset_exchange'
-        self._method = requests.post
+        self._method = 'POST'
         answer = self._send_request(kwargs)
         self.http_answer = self._create_http_answer(answer)
         return answer
@@ -109,13 +236,13 @@ class HsService:
 
     def communication_test(self, **kwargs) -> dict:
         self._hs = 'communication_test'
-        self._method = requests.get
+        self._method = 'GET'
         answer = self._send_request(kwargs)
         self.http_answer = self._create_http_answer(answer)
         return answer
 
     def get_balances_goods(self, id_warehouse=False, id_cell=False, id_good=False, **kwargs):
-        self._method = requests.get
+        self._method = 'GET'
         params = {}
         if id_good:
             params['id_good'] = id_good
@@ -137,7 +264,7 @@ class HsService:
         return self.http_answer
 
     def get_prices_goods(self, id_good, id_property=False, id_unit=False, id_price_type=False, **kwargs):
-        self._method = requests.get
+        self._method = 'GET'
         self._hs = 'good_prices'
         params = {'id_good': id_good}
         if id_property:
@@ -163,7 +290,7 @@ class HsService:
 
         kwargs['data'] = data if isinstance(data, str) else json.dumps(data)
         self._hs = 'documents'
-        self._method = requests.post
+        self._method = 'POST'
 
         answer = self._send_request(kwargs)
         self.http_answer = self._create_http_answer(answer)
@@ -172,7 +299,7 @@ class HsService:
     def send_data(self, data, **kwargs) -> 'HttpAnswer':
         kwargs['data'] = data if isinstance(data, str) else json.dumps(data)
         self._hs = 'documents'
-        self._method = requests.post
+        self._method = 'POST'
 
         answer = self._send_request(kwargs)
         self.http_answer = self._create_http_answer(answer)
@@ -181,11 +308,13 @@ class HsService:
     def _send_request(self, kwargs) -> dict:
         answer = {'empty': True}
         try:
-            r = self._method(f'{self.url}/simple_accounting/{self._hs}?android_id={self.android_id}',
-                             auth=self.auth,
-                             headers=self.headers,
-                             params=self.params,
-                             **kwargs)
+            r = http_sessions.request(self._method,
+                                      f'{self.url}/simple_accounting/{self._hs}?android_id={self.android_id}',
+                                      self.url,
+                                      auth=(self.username, self.password),
+                                      headers=self.headers,
+                                      params=self.params,
+                                      **kwargs)
 
             answer['status_code'] = r.status_code
             answer['url'] = r.url
@@ -247,7 +376,7 @@ class DebugService:
         self.port = port
         self.url = f'http://{self.ip_host}:{self.port}'
         self._hs = ''
-        self._method = requests.post
+        self._method = 'POST'
 
     def export_database(self, file):
         self._hs = 'post'
@@ -264,7 +393,7 @@ class DebugService:
     def _send_request(self, kwargs) -> dict:
         answer = {'empty': True}
         try:
-            r = self._method(f'{self.url}/{self._hs}', **kwargs)
+            r = http_sessions.request(self._method, f'{self.url}/{self._hs}', self.url, **kwargs)
 
             answer['status_code'] = r.status_code
             if r.status_code == 200:
@@ -1,12 +1,10 @@
 import ipaddress
 import json
-import requests
-from requests.auth import HTTPBasicAuth
 #import time
 import ui_barcodes
 
 import ui_global
-from hs_services import HsService
+from hs_services import HsService, http_sessions
 from db_services import DocService
 from ui_global import get_query_result
 
@@ -46,9 +44,10 @@ def server_load_data(http):
     # r = requests.get(url + '/get_data?android_id=' + android_id, auth=HTTPBasicAuth(username, password, ),
     #                  headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
     #                  params={'code': android_id, 'full_load': full_load})
-    r = requests.get(url + '/simple_accounting/data?android_id=' + android_id, auth=HTTPBasicAuth(username, password, ),
-                     headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
-                     params={'user_name': http['user_name'], 'device_model': http['device_model']})
+    r = http_sessions.request('GET', url + '/simple_accounting/data?android_id=' + android_id, url,
+                              auth=(username, password),
+                              headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
+                              params={'user_name': http['user_name'], 'device_model': http['device_model']})
     # print(r.status_code)
     # print(r.text)
     answer = {'status_code': r.status_code}
@@ -59,10 +58,8 @@ def server_load_data(http):
         if 'format' in jdata.keys():
             answer['format'] = jdata['format']
             if jdata['format'] == 'is_data':
-                #Парсим, параметр data содержит список словарей с данными запроса
-                res_for_sql = json_to_sqlite_query(jdata['data'])
-                if res_for_sql:
-                    answer['res_for_sql'] = res_for_sql
+                #Параметр data содержит список словарей с данными запроса, загружаются через db_services.BulkLoader
+                answer['data'] = jdata['data']
 
             elif jdata['format'] == 'is_ok': #Наш запрос принят, но вернуть пока нечего. Данные или готовятся или их нет
                 if jdata.get('batch') is not None:
@@ -97,128 +94,51 @@ def server_load_data(http):
 
 
 
-def json_to_sqlite_query(data):
-
-    qlist = []
-    #Цикл по именам таблиц
-    table_list = (
-    'RS_doc_types', 'RS_goods', 'RS_properties', 'RS_units', 'RS_types_goods', 'RS_series', 'RS_countragents',
-    'RS_warehouses', 'RS_price_types', 'RS_cells', 'RS_barcodes', 'RS_prices', 'RS_doc_types', 'RS_docs',
-    'RS_docs_table', 'RS_docs_barcodes', 'RS_adr_docs', 'RS_adr_docs_table') #,, 'RS_barc_flow'
-    table_for_delete = ('RS_docs_table', 'RS_docs_barcodes, RS_adr_docs_table')  #, 'RS_barc_flow'
-    doc_id_list = []
-    for table_name in table_list:
-        if data.get(table_name) is None:
-            continue
-
-    #for table_name in data['data']:
-        if data[table_name] == []:
-            continue
-        #Добавим в запросы удаление из базы строк тех документов, что мы загружаем
-        if table_name in table_for_delete:
-            query = f"DELETE FROM {table_name} WHERE id_doc in ({', '.join(doc_id_list)}) "
-            qlist.append(query)
-
-        column_names = data[table_name][0].keys()
-        if 'mark_code' in column_names:
-            query_col_names = list(column_names)
-            query_col_names.append('GTIN')
-            query_col_names.append('Series')
-            query_col_names.remove('mark_code')
-        else:
-            query_col_names = column_names
-
-        query = f"REPLACE INTO {table_name} ({', '.join(query_col_names)}) VALUES "
-        values = []
-
-        for row in data[table_name]:
-
-            row_values = []
-            list_quoted_fields = ('name', 'full_name', "mark_code", "art")
-            for col in column_names:
-                if col in list_quoted_fields and  "\"" in row[col]:
-                    row[col] = row[col].replace("\"", "\"\"")
-                if row[col] is None:
-                    row[col] = ''
-                if col == 'mark_code':   #Заменяем это поле на поля GTIN и Series
-                    barc_struct = parse_barcode(row[col])
-                    row_values.append(barc_struct['GTIN'])
-                    row_values.append(barc_struct['Series'])
-                else:
-                    row_values.append(row[col])  #(f'"{row[col]}"')
-                if col == 'id_doc' and table_name == 'RS_docs':
-                    doc_id_list.append('"'+row[col]+'"')
-            formatted_val  = [f'"{x}"' if isinstance(x, str) else str(x) for x in row_values]
-            values.append(f"({', '.join(formatted_val)})")
-        query += ", ".join(values)
-        qlist.append(query)
-
-
-    return qlist
-
-
 def get_all_changes_from_database(doc_list: str = ''):
+    # Строки подчиненных таблиц читаются порциями (iter_query) и за один проход
+    # раскладываются по документам через словарь id_doc -> документ
     try:
-        qtext = f'''
-        SELECT * FROM RS_docs WHERE id_doc in ({doc_list})'''
-        res = ui_global.get_query_result(qtext,None,True)
-        qtext = f'''
-            SELECT * FROM RS_docs_table WHERE id_doc in ({doc_list})'''# in (
-            #SELECT id_doc FROM RS_docs WHERE verified is Null)'''
-        res_docs_table = ui_global.get_query_result(qtext,None,True)
-        qtext = f'''
-            SELECT * FROM RS_docs_barcodes WHERE id_doc in ({doc_list}) and barcode_from_scanner is not Null'''# in (
-            #SELECT id_doc FROM RS_docs WHERE verified is Null)'''
-        res_docs_barcode = ui_global.get_query_result(qtext,None,True)
-        res_docs_barcode = replase_gs_in_res(res_docs_barcode)
-        qtext = f'''
-            SELECT * FROM RS_barc_flow WHERE id_doc in ({doc_list})'''# in (
-            #SELECT id_doc FROM RS_docs WHERE verified is Null)'''
-        res_flow = ui_global.get_query_result(qtext,None,True)
-        res_flow = replase_gs_in_res(res_flow)
+        docs = _get_docs_by_id(f'SELECT * FROM RS_docs WHERE id_doc in ({doc_list})')
+        _add_doc_rows(docs, 'RS_docs_table',
+                      f'SELECT * FROM RS_docs_table WHERE id_doc in ({doc_list})')
+        _add_doc_rows(docs, 'RS_docs_barcodes',
+                      f'SELECT * FROM RS_docs_barcodes WHERE id_doc in ({doc_list}) and barcode_from_scanner is not Null',
+                      replace_gs=True)
+        _add_doc_rows(docs, 'RS_barc_flow',
+                      f'SELECT * FROM RS_barc_flow WHERE id_doc in ({doc_list})',
+                      replace_gs=True)
     except Exception as e:
-            sql_error = True
             #error_pool.append(e.args[0])
             return {'Error':e.args[0]}
-    # if len(res) == 0:
-    #     return None
 
-    for item in res:
-        filtered_list = [d for d in res_docs_table if d['id_doc'] == item['id_doc']]
-        item['RS_docs_table'] = filtered_list
-
-        filtered_list = [d for d in res_docs_barcode if d['id_doc'] == item['id_doc']]
-        item['RS_docs_barcodes'] = filtered_list
-
-        filtered_list = [d for d in res_flow if d['id_doc'] == item['id_doc']]
-        item['RS_barc_flow'] = filtered_list
     #Адресное хранение
     try:
-        qtext = f'''
-        SELECT * FROM RS_adr_docs WHERE id_doc in ({doc_list})'''
-        res_adr = ui_global.get_query_result(qtext,None,True)
-        qtext = f'''
-            SELECT * FROM RS_adr_docs_table WHERE id_doc in ({doc_list})'''# in (
-            #SELECT id_doc FROM RS_docs WHERE verified is Null)'''
-        res_adr_docs_table = ui_global.get_query_result(qtext,None,True)
-
+        adr_docs = _get_docs_by_id(f'SELECT * FROM RS_adr_docs WHERE id_doc in ({doc_list})')
+        _add_doc_rows(adr_docs, 'RS_adr_docs_table',
+                      f'SELECT * FROM RS_adr_docs_table WHERE id_doc in ({doc_list})')
     except Exception as e:
-            sql_error = True
             #error_pool.append(e.args[0])
             return {'Error':e.args[0]}
-    # if len(res) == 0:
-    #     return None
 
-    for item in res_adr:
-        filtered_list = [d for d in res_adr_docs_table if d['id_doc'] == item['id_doc']]
-        item['RS_adr_docs_table'] = filtered_list
+    if len(docs) + len(adr_docs) == 0:
+        return None
 
+    return json.dumps(list(docs.values()) + list(adr_docs.values()))
 
 
-    if len(res) + len(res_adr) == 0:
-        return None
+def _get_docs_by_id(qtext):
+    return {row['id_doc']: dict(row) for row in ui_global.iter_query(qtext)}
+
+
+def _add_doc_rows(docs: dict, table_name, qtext, replace_gs=False):
+    for doc in docs.values():
+        doc[table_name] = []
 
-    return json.dumps(res + res_adr)
+    for row in ui_global.iter_query(qtext):
+        doc = docs.get(row['id_doc'])
+        if doc is not None:
+            row = dict(row)
+            doc[table_name].append(replase_gs_in_res([row])[0] if replace_gs else row)
 
 
 def post_changes_to_server(doc_list: str, htpparams):
@@ -233,11 +153,12 @@ def post_changes_to_server(doc_list: str, htpparams):
     answer = {'empty': True}
     if res is not None:
         try:
-            r = requests.post(url + '/simple_accounting/documents?android_id=' + android_id,
-                             auth=HTTPBasicAuth(username, password, ),
-                             headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
-                             params={'user_name': htpparams['user_name'], 'device_model': htpparams['device_model']},
-                              data=res)
+            r = http_sessions.request('POST', url + '/simple_accounting/documents?android_id=' + android_id, url,
+                                      auth=(username, password),
+                                      headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
+                                      params={'user_name': htpparams['user_name'],
+                                              'device_model': htpparams['device_model']},
+                                      data=res)
             answer['status_code'] = r.status_code
             if r.status_code == 200:
                 answer['empty'] = False
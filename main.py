@@ -5,6 +5,8 @@ import os
 
 import ui_global
 import ui_form_data
+from goods_search import goods_search_index
+from query_cache import query_cache
 
 from new_handlers import *
 
@@ -127,8 +129,9 @@ class UniversalCard:
         self.exclude_list = exclude_list
         self.no_label = no_label
         self.struct_view = struct_view
+        self.query_args = None
 
-        res = ui_global.get_query_result(f"PRAGMA table_info({table_name})")
+        res = get_table_info(table_name)
         self.fields = [f[1] for f in res]
         # Словарь русских имен полей
         self.aliases = ui_form_data.fields_alias_dict()
@@ -161,11 +164,8 @@ class UniversalCard:
                     ON {link_table_name}.id = {self.table_name}.{el}
                     ''')
         qtext = 'Select ' + ','.join(qfield_text) + f' FROM {self.table_name} ' + ' '.join(left_joins_list)
-        # Если есть фильтры/отборы - добавим их в запрос
-        if self.filter_value:
-            # conditions = [f"{field} LIKE '%{filter_value}%'" for field in filter_fields]
-            conditions = [f"{self.table_name}.{field} LIKE '%{self.filter_value}%'" for field in self.filter_fields]
-            qtext = qtext + f" WHERE {' OR '.join(conditions)}"
+        # Если есть фильтры/отборы - добавим их в запрос. Параметры запроса - в self.query_args
+        qtext, self.query_args = add_filter_to_query(qtext, self.table_name, self.filter_fields, self.filter_value)
         return qtext
 
     def form_card_struct(self):
@@ -217,7 +217,7 @@ class UniversalCard:
 def get_table_cards(table_name: str, filter_fields=list(), filter_value='', exclude_list=list(), no_label=False, struct_view:list = list()):
     # Получим список полей таблицы
     # table_name = 'RS_goods'
-    res = ui_global.get_query_result(f"PRAGMA table_info({table_name})")
+    res = get_table_info(table_name)
     fields = [f[1] for f in res]
     # Словарь русских имен полей
     aliases = ui_form_data.fields_alias_dict()
@@ -268,11 +268,8 @@ def get_table_cards(table_name: str, filter_fields=list(), filter_value='', excl
 
     qtext = 'Select ' + ','.join(qfield_text) + f' FROM {table_name} ' + ' '.join(left_joins_list)
     # Если есть фильтры/отборы - добавим их в запрос
-    if filter_value:
-        # conditions = [f"{field} LIKE '%{filter_value}%'" for field in filter_fields]
-        conditions = [f"{table_name}.{field} LIKE '%{filter_value}%'" for field in filter_fields]
-        qtext = qtext + f" WHERE {' OR '.join(conditions)}"
-    res_query = ui_global.get_query_result(qtext, None, True)
+    qtext, query_args = add_filter_to_query(qtext, table_name, filter_fields, filter_value)
+    res_query = ui_global.get_query_result(qtext, query_args, True)
     # settings_global.get
 
     cards['customcards']['cardsdata'] = []
@@ -289,4 +286,29 @@ def get_table_cards(table_name: str, filter_fields=list(), filter_value='', excl
 
     return json.dumps(cards)
 
+
+def get_table_info(table_name: str) -> list:
+    # Структура таблицы меняется только DDL, который сбрасывает кэш целиком
+    query_text = f"PRAGMA table_info({table_name})"
+    return query_cache.get('table_info', query_text, None, [], lambda: ui_global.get_query_result(query_text))
+
+
+def add_filter_to_query(qtext: str, table_name: str, filter_fields=list(), filter_value=''):
+    # Отбор товаров по полям полнотекстового индекса идет через него с сортировкой по релевантности,
+    # остальные таблицы и поля - через LIKE
+    if not filter_value or not filter_fields:
+        return qtext, None
+
+    if table_name == 'RS_goods' and set(filter_fields) <= set(goods_search_index.fields):
+        search_query, args = goods_search_index.get_search_query(filter_value, filter_fields)
+        qtext = f'''{qtext}
+            JOIN ({search_query}) AS goods_search
+            ON goods_search.id = RS_goods.id
+            ORDER BY goods_search.rank'''
+        return qtext, args
+
+    conditions = [f"{table_name}.{field} LIKE :filter_value" for field in filter_fields]
+    qtext = qtext + f" WHERE {' OR '.join(conditions)}"
+    return qtext, {'filter_value': f'%{filter_value}%'}
+
 # ^^^^^^^^^^^^^^^^^ Universal cards ^^^^^^^^^^^^^^^^^
\ No newline at end of file
@@ -3,6 +3,10 @@ from ru.travelfood.simple_ui import SimpleUtilites as suClass
 
 from ui_utils import HashMap
 import ui_models
+from db_connection import connection_manager
+from db_services import DocService
+from hs_services import http_sessions
+from tiny_db_services import BufferedJSONStorage, ScanningQueueService
 
 noClass = jclass("ru.travelfood.simple_ui.NoSQL")
 rs_settings = noClass("rs_settings")
@@ -72,6 +76,13 @@ def on_sql_error(hash_map):
 def on_close_app(hash_map):
     # Попытка очистки кэша при выходе с приложения
     suClass.deleteCache()
+    BufferedJSONStorage.flush_all()
+    try:
+        ScanningQueueService().compact()
+    except Exception as e:
+        DocService().write_error_on_log(f'Ошибка сжатия очереди сканирований: {e}')
+    http_sessions.close()
+    connection_manager.close_all()
 
 
 # ^^^^^^^^^^^^^^^^^ Main events ^^^^^^^^^^^^^^^^^
@@ -0,0 +1,121 @@
+import copy
+import re
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Кэш результатов запросов к справочным данным с вытеснением давно не используемых записей (LRU).
+    Запись хранится вместе с версиями таблиц, из которых она прочитана. Любая запись в таблицу
+    (через ui_global, SqlQueryProvider, загрузку данных таймером) увеличивает версию таблицы,
+    и прочитанные из нее записи кэша перестают считаться актуальными.
+    """
+
+    write_statements = ('INSERT', 'REPLACE', 'UPDATE', 'DELETE', 'WITH')
+    schema_statements = ('CREATE', 'DROP', 'ALTER')
+    tables_pattern = re.compile(
+        r'(?:INSERT|REPLACE)\s+(?:OR\s+\w+\s+)?INTO\s+[\'"`\[]?(\w+)'
+        r'|UPDATE\s+(?:OR\s+\w+\s+)?[\'"`\[]?(\w+)'
+        r'|DELETE\s+FROM\s+[\'"`\[]?(\w+)',
+        re.IGNORECASE)
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._schema_version = 0
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'by_name': {}}
+
+    def get(self, name, query, params, tables, loader):
+        """
+        Результат запроса из кэша или loader(), если записи нет или таблицы tables изменились.
+        name - имя для статистики попаданий (метод сервиса, экран)
+        """
+
+        key = (query, self._get_params_key(params))
+
+        with self._lock:
+            versions = self._get_versions(tables)
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self._count(name, 'hits')
+                return copy.deepcopy(entry[1])
+
+            self._count(name, 'misses')
+
+        result = loader()
+
+        with self._lock:
+            # Пока выполнялся запрос, таблицы могли измениться - такой результат не сохраняем
+            if versions == self._get_versions(tables):
+                self._entries[key] = (versions, copy.deepcopy(result))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+
+        return result
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                table = table.lower()
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def bump_for_query(self, query_text: str):
+        """Увеличивает версии таблиц, в которые пишет запрос. DDL сбрасывает весь кэш"""
+
+        statement = query_text.lstrip()[:7].upper()
+
+        if statement.startswith(self.schema_statements):
+            with self._lock:
+                self._schema_version += 1
+                self._entries.clear()
+        elif statement.startswith(self.write_statements):
+            tables = [name for match in self.tables_pattern.findall(query_text) for name in match if name]
+            self.bump(*tables)
+
+    def versions(self, *tables) -> tuple:
+        """Текущие версии таблиц - по ним другие кэши могут определить, что данные изменились"""
+        with self._lock:
+            return self._get_versions(tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._schema_version += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = copy.deepcopy(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+            return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'by_name': {}}
+
+    def _get_versions(self, tables) -> tuple:
+        return (self._schema_version,) + tuple(self._versions.get(table.lower(), 0) for table in tables)
+
+    def _count(self, name, counter):
+        self._stats[counter] += 1
+        if name:
+            name_stats = self._stats['by_name'].setdefault(name, {'hits': 0, 'misses': 0})
+            name_stats[counter] += 1
+
+    @staticmethod
+    def _get_params_key(params):
+        if isinstance(params, dict):
+            return tuple(sorted(params.items()))
+        if isinstance(params, (list, tuple)):
+            return tuple(params)
+        return params
+
+
+query_cache = QueryCache()
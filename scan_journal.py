@@ -0,0 +1,347 @@
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+from java import jclass
+from ui_global import get_query_result, transaction, write_scan
+
+
+noClass = jclass("ru.travelfood.simple_ui.NoSQL")
+rs_settings = noClass("rs_settings")
+
+
+class ScanJournal:
+    """
+    Отложенная запись сканирований (write-behind) для Rs_doc.process_the_barcode, включается настройкой
+    use_scan_journal. Проверенный скан сразу учитывается в памяти (количество по строке документа, одобренные марки)
+    и дописывается в журнал <path_to_databases>/scan_journal.jsonl, а в RS_docs_table и RS_docs_barcodes его
+    записывает фоновый поток пачками по batch_size сканов в одной транзакции.
+    Номер последнего записанного в базу скана хранится в RS_scan_journal в той же транзакции,
+    поэтому после сбоя recover() (app_on_start) записывает в базу только незаписанные сканы журнала.
+    Пачка пишется в базу без блокировки журнала: сканы в это время принимаются. Читающие (read) берут номер
+    последнего записанного скана в том же снимке базы, что и свои данные, и учитывают только сканы с большим номером -
+    скан пачки, которая уже в базе, но еще не убрана из памяти, не учитывается дважды
+    """
+
+    file_name = 'scan_journal.jsonl'
+
+    def __init__(self, path='', batch_size=100, batch_delay=0.05):
+        self.path = path
+        self.batch_size = batch_size
+        # Фоновый поток копит сканы batch_delay секунд: одна транзакция на пачку, а не на каждый скан,
+        # и поток не конкурирует с каждым следующим сканом
+        self.batch_delay = batch_delay
+        # Блокировка памяти журнала. На время записи пачки в базу не держится
+        self.lock = threading.RLock()
+        self._has_pending = threading.Condition(self.lock)
+        # Пачки пишутся в базу по одной (фоновый поток и flush). Берется раньше self.lock
+        self._drain_lock = threading.RLock()
+        self._pending = deque()
+        # Незаписанные сканы по строке (id_doc, id_good, id_property, id_series) и по марке (id_doc, GTIN, Series)
+        self._rows = {}
+        self._marks = {}
+        # Номер последнего скана пачки, которая сейчас пишется в базу (0 - запись не идет)
+        self._in_flight_seq = 0
+        # Сессии документов (doc_session.DocSession), которым сообщается о записанных в базу сканах
+        self._listeners = weakref.WeakSet()
+        self._seq = None
+        self._file = None
+        self._worker = None
+        self._stats = {'appended': 0, 'applied': 0, 'batches': 0, 'recovered': 0}
+
+    def is_enabled(self) -> bool:
+        return rs_settings.get('use_scan_journal') in (True, 'true')
+
+    def append(self, id_doc, row: dict, qtty, last_updated, mark: dict = None, new_row=False):
+        """
+        Скан с параметрами ui_global.write_scan: в журнал на диске и в память, запись в базу - в фоне.
+        id строки документа не сохраняется: к моменту записи строка могла быть перезагружена, она ищется по товару.
+        new_row - строки товара в документе не было (для показа скана до записи в базу)
+        """
+
+        with self.lock:
+            self._open()
+            self._seq += 1
+            entry = {'seq': self._seq, 'id_doc': id_doc, 'row': row, 'qtty': qtty, 'last_updated': last_updated,
+                     'mark': mark, 'new_row': new_row}
+
+            # Без fsync на каждый скан, как и коммит базы (WAL, synchronous=NORMAL): после сбоя приложения
+            # журнал цел, при отключении питания могут потеряться последние сканы
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+            self._add_pending(entry)
+            self._stats['appended'] += 1
+            self._start_worker()
+            self._has_pending.notify()
+
+    def read(self, loader):
+        """
+        Чтение базы с учетом незаписанных в нее сканов: loader(entries) выполняется в одном снимке базы
+        (транзакции) с номером последнего записанного скана, entries - сканы журнала, которых в этом снимке нет
+        """
+
+        with self.lock:
+            with transaction():
+                last_seq = self._get_last_seq()
+                return loader([entry for entry in self._pending if entry['seq'] > last_seq])
+
+    def get_scan_data(self, id_doc, barcode_info: dict, loader) -> dict:
+        """
+        Результат ui_global.get_scan_data (loader) с учетом незаписанных в базу сканов:
+        количество строки документа, новая строка и одобренные марки.
+        Снимок базы с номером записанного скана (read) нужен, только если сканы этой строки или марки
+        сейчас пишутся в базу: остальные незаписанные сканы точно не в базе
+        """
+
+        with self.lock:
+            scan_data = loader()
+            entries = self._get_scan_entries(id_doc, barcode_info, scan_data)
+            if not entries:
+                return scan_data
+            if entries[0]['seq'] > self._in_flight_seq:
+                return self._apply_scan_entries(id_doc, barcode_info, scan_data, entries)
+
+            def load(_):
+                scan_data = loader()
+                last_seq = self._get_last_seq()
+                entries = [entry for entry in self._get_scan_entries(id_doc, barcode_info, scan_data)
+                           if entry['seq'] > last_seq]
+                return self._apply_scan_entries(id_doc, barcode_info, scan_data, entries)
+
+            return self.read(load)
+
+    def _get_scan_entries(self, id_doc, barcode_info: dict, scan_data: dict) -> list:
+        if not scan_data:
+            return []
+
+        entries = list(self._rows.get(
+            (id_doc, scan_data['id_good'], scan_data['id_property'], scan_data['id_series']), ()))
+        mark_entry = self._marks.get((id_doc, barcode_info.get('GTIN'), barcode_info.get('SERIAL')))
+        if mark_entry:
+            entries.append(mark_entry)
+        return sorted(entries, key=lambda entry: entry['seq'])
+
+    @staticmethod
+    def _apply_scan_entries(id_doc, barcode_info: dict, scan_data: dict, entries: list) -> dict:
+        gtin, series = barcode_info.get('GTIN'), barcode_info.get('SERIAL')
+        qtty = 0
+        for entry in entries:
+            row, mark = entry['row'], entry['mark']
+            if (row['id_good'], row['id_property'], row['id_series']) == \
+                    (scan_data['id_good'], scan_data['id_property'], scan_data['id_series']):
+                qtty += entry['qtty']
+            if mark and (mark.get('GTIN'), mark.get('Series')) == (gtin, series):
+                scan_data['mark'] = dict(scan_data['mark'] or {'id': None, 'id_doc': id_doc, 'is_plan': '0',
+                                                               'GTIN': gtin, 'Series': series, **row},
+                                         approved='1')
+
+        if qtty:
+            doc_row = scan_data['doc_row']
+            if doc_row:
+                scan_data['doc_row'] = dict(doc_row, qtty=doc_row['qtty'] + qtty)
+            else:
+                scan_data['doc_row'] = {'id': None, 'qtty_plan': 0, 'qtty': qtty}
+
+        return scan_data
+
+    @staticmethod
+    def get_pending_rows(id_doc, entries) -> dict:
+        """
+        Незаписанные сканы документа по строкам: (id_good, id_property, id_series) ->
+        {'row', 'qtty', 'last_updated', 'new_row'}. Порядок - по последнему скану строки
+        """
+
+        rows = {}
+        for entry in entries:
+            if entry['id_doc'] != id_doc:
+                continue
+
+            row = entry['row']
+            key = (row['id_good'], row['id_property'], row['id_series'])
+            pending_row = rows.pop(key, None) or {'row': row, 'qtty': 0, 'new_row': entry.get('new_row', False)}
+            pending_row['qtty'] += entry['qtty']
+            pending_row['last_updated'] = entry['last_updated']
+            rows[key] = pending_row
+
+        return rows
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self._pending)
+
+    def add_listener(self, listener):
+        """
+        listener.get_versions() вызывается перед записью пачки в базу, listener.on_scans_written(entries, versions)
+        - после: запись журнала не делает данные слушателя устаревшими
+        """
+
+        self._listeners.add(listener)
+
+    def has_pending(self, id_docs) -> bool:
+        """Есть незаписанные в базу сканы документов id_docs"""
+
+        with self.lock:
+            return any(entry['id_doc'] in id_docs for entry in self._pending)
+
+    def flush(self):
+        """Записывает в базу все сканы журнала в текущем потоке (перед загрузкой документа с сервера и отправкой)"""
+
+        while self.drain():
+            pass
+
+    def drain(self) -> int:
+        """Записывает в базу одну пачку сканов журнала, возвращает количество записанных"""
+
+        with self._drain_lock:
+            with self.lock:
+                batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return 0
+                self._in_flight_seq = batch[-1]['seq']
+
+            listeners = list(self._listeners)
+            listeners_versions = [listener.get_versions() for listener in listeners]
+
+            # Без блокировки журнала: сканы продолжают приниматься, пока пачка пишется в базу
+            try:
+                with transaction():
+                    for entry in batch:
+                        write_scan(entry['id_doc'], entry['row'], entry['qtty'], entry['last_updated'],
+                                   mark=entry['mark'])
+                    get_query_result('REPLACE INTO RS_scan_journal (id, last_seq) VALUES (1, ?)',
+                                     (batch[-1]['seq'],))
+            except Exception:
+                with self.lock:
+                    self._in_flight_seq = 0
+                raise
+
+            with self.lock:
+                for entry in batch:
+                    self._pending.popleft()
+                    self._remove_pending(entry)
+                self._in_flight_seq = 0
+
+                self._stats['applied'] += len(batch)
+                self._stats['batches'] += 1
+
+                if not self._pending:
+                    # Все записано в базу - журнал на диске больше не нужен
+                    self._file.truncate(0)
+                    self._file.seek(0)
+
+            for listener, versions in zip(listeners, listeners_versions):
+                listener.on_scans_written(batch, versions)
+
+            return len(batch)
+
+    def recover(self) -> int:
+        """
+        Восстановление после сбоя (app_on_start): сканы журнала, которые не успели попасть в базу,
+        записываются в нее. Возвращает их количество
+        """
+
+        with self._drain_lock, self.lock:
+            self._seq = None
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._pending.clear()
+            self._rows.clear()
+            self._marks.clear()
+
+            last_seq = self._get_last_seq()
+            entries = [entry for entry in self._read_file() if entry['seq'] > last_seq]
+            for entry in entries:
+                self._add_pending(entry)
+
+            self._open()
+            self._seq = max([self._seq] + [entry['seq'] for entry in entries])
+            self.flush()
+            if not entries:
+                self._file.truncate(0)
+                self._file.seek(0)
+
+            self._stats['recovered'] += len(entries)
+            return len(entries)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self._stats, pending=len(self._pending))
+
+    def get_file_path(self) -> str:
+        return os.path.join(self.path or rs_settings.get('path_to_databases') or '', self.file_name)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.get_file_path(), 'a+', encoding='utf-8')
+        if self._seq is None:
+            entries = self._read_file()
+            self._seq = max([self._get_last_seq()] + [entry['seq'] for entry in entries])
+
+    def _read_file(self) -> list:
+        file_path = self.get_file_path()
+        if not os.path.exists(file_path):
+            return []
+
+        entries = []
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Строка, недописанная при сбое: скан не был подтвержден
+                    break
+
+        return entries
+
+    def _add_pending(self, entry):
+        self._pending.append(entry)
+        row, mark = entry['row'], entry['mark']
+        self._rows.setdefault((entry['id_doc'], row['id_good'], row['id_property'], row['id_series']),
+                              deque()).append(entry)
+        if mark:
+            self._marks[(entry['id_doc'], mark.get('GTIN'), mark.get('Series'))] = entry
+
+    def _remove_pending(self, entry):
+        # Сканы пишутся в базу по порядку: скан строки - первый в ее очереди
+        row, mark = entry['row'], entry['mark']
+        key = (entry['id_doc'], row['id_good'], row['id_property'], row['id_series'])
+        self._rows[key].popleft()
+        if not self._rows[key]:
+            del self._rows[key]
+        if mark:
+            mark_key = (entry['id_doc'], mark.get('GTIN'), mark.get('Series'))
+            if self._marks.get(mark_key) is entry:
+                del self._marks[mark_key]
+
+    @staticmethod
+    def _get_last_seq() -> int:
+        res = get_query_result('SELECT last_seq FROM RS_scan_journal WHERE id = 1')
+        return res[0][0] if res else 0
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='scan_journal', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self._pending:
+                    self._has_pending.wait()
+                deadline = time.monotonic() + self.batch_delay
+                while len(self._pending) < self.batch_size and time.monotonic() < deadline:
+                    self._has_pending.wait(deadline - time.monotonic())
+            try:
+                self.drain()
+            except Exception:
+                # База занята или недоступна - сканы остаются в журнале, следующая попытка позже
+                with self.lock:
+                    self._has_pending.wait(1)
+
+
+scan_journal = ScanJournal()
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+
+class ScanMetrics:
+    """
+    Время этапов обработки сканирования. По каждому этапу хранится скользящее окно последних
+    window_size замеров (мс), по которому считаются перцентили. Замеры живут в памяти процесса,
+    смотреть их можно на отладочном экране и выгружать через DebugService.export_log
+    """
+
+    # Этапы в порядке выполнения, с названиями для отладочного экрана
+    stages = {
+        'total': 'Сканирование целиком',
+        'parse': 'Разбор штрихкода',
+        'db_lookup': 'Поиск в базе',
+        'checks': 'Проверки',
+        'db_write': 'Запись в базу',
+        'on_start': 'Перестроение таблицы',
+        'hash_map': 'Сериализация в hash_map',
+        'http_post': 'Отправка на сервер',
+    }
+    percentiles = (50, 95, 99)
+
+    def __init__(self, window_size=1000):
+        self.window_size = window_size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    def timed(self, stage):
+        """Декоратор: время выполнения функции пишется в этап stage"""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.measure(stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add(self, stage, duration_ms):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window_size)
+            samples.append(duration_ms)
+
+    def stats(self) -> dict:
+        """{этап: {'count', 'p50', 'p95', 'p99', 'max'}} по этапам, для которых есть замеры"""
+
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items() if values}
+
+        result = {}
+        for stage in sorted(samples, key=self._stage_order):
+            values = samples[stage]
+            stage_stats = {'count': len(values)}
+            for p in self.percentiles:
+                stage_stats[f'p{p}'] = round(self._percentile(values, p), 2)
+            stage_stats['max'] = round(values[-1], 2)
+            result[stage] = stage_stats
+
+        return result
+
+    def report(self) -> str:
+        """Текст для отладочного экрана: этап, количество замеров, p50/p95/p99 в мс"""
+
+        lines = []
+        for stage, stage_stats in self.stats().items():
+            lines.append('{}: {} шт, p50 {} / p95 {} / p99 {} мс'.format(
+                self.stages.get(stage, stage), stage_stats['count'],
+                stage_stats['p50'], stage_stats['p95'], stage_stats['p99']))
+
+        return '\n'.join(lines) or 'Нет данных о времени сканирования'
+
+    def export_data(self) -> list:
+        """Замеры в формате записей лога для DebugService.export_log"""
+
+        return [dict(stage=stage, name=self.stages.get(stage, stage), **stage_stats)
+                for stage, stage_stats in self.stats().items()]
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def _stage_order(self, stage):
+        names = list(self.stages)
+        return (names.index(stage) if stage in names else len(names), stage)
+
+    @staticmethod
+    def _percentile(values, p):
+        # Ближайший ранг: значение, не меньше которого p% замеров
+        index = max(0, -(-len(values) * p // 100) - 1)
+        return values[min(index, len(values) - 1)]
+
+
+scan_metrics = ScanMetrics()
@@ -0,0 +1,80 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+from java import jclass
+
+
+noClass = jclass("ru.travelfood.simple_ui.NoSQL")
+rs_settings = noClass("rs_settings")
+
+
+class ScanRecorder:
+    """
+    Запись сессий сканирования для воспроизведения вне устройства (tests/benchmarks/replay_scan_session.py).
+    По каждому документу в файл <path_to_databases>/scan_sessions/<id_doc>.jsonl пишется строка
+    на каждую обработку: время, штрихкоды, режим обработки, флаги экрана, длительность и ошибки.
+    Запись включается настройкой record_scan_sessions на отладочном экране
+    """
+
+    folder_name = 'scan_sessions'
+
+    def __init__(self, path=''):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        return rs_settings.get('record_scan_sessions') in (True, 'true')
+
+    def record(self, id_doc, mode, barcodes: list, flags: dict, duration_ms, errors: list):
+        """
+        mode - кто обрабатывал: 'rs_doc' (Rs_doc.process_the_barcode), 'worker' (BarcodeWorker),
+        'worker_batch' (BarcodeWorker.process_barcodes)
+        """
+
+        if not self.is_enabled():
+            return
+
+        record = {
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'),
+            'id_doc': id_doc,
+            'mode': mode,
+            'barcodes': barcodes,
+            'flags': flags,
+            'use_mark': rs_settings.get('use_mark'),
+            'duration_ms': round(duration_ms, 3),
+            'errors': errors,
+        }
+
+        try:
+            file_path = self.get_file_path(id_doc)
+            with self._lock:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError:
+            # Запись сессии не должна мешать сканированию
+            pass
+
+    def get_file_path(self, id_doc) -> str:
+        file_name = re.sub(r'[^\w.-]', '_', str(id_doc)) + '.jsonl'
+        return os.path.join(self.get_folder(), file_name)
+
+    def get_folder(self) -> str:
+        return os.path.join(self.path or rs_settings.get('path_to_databases') or '', self.folder_name)
+
+    def get_files(self) -> list:
+        folder = self.get_folder()
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.jsonl'))
+
+    @staticmethod
+    def load(file_path) -> list:
+        with open(file_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+scan_recorder = ScanRecorder()
@@ -0,0 +1,155 @@
+"""
+Разбор кодов GS1: прежний разбор цепочкой if/elif с пересечением остатка строки на каждом AI
+против разбора за один проход по таблице AI (ui_barcodes.parse_gs1_elements).
+Коды берутся из тестов tests_utils/test_barcode_parser.py.
+Отдельно - документ из 100 000 марок: прежний разбор кода марки против ui_barcodes.split_mark_codes.
+
+Запуск из каталога tests:
+    python -m benchmarks.bench_barcode_parser [количество повторов]
+"""
+
+import statistics
+import sys
+import time
+import unittest
+
+from tests_utils.test_barcode_parser import TestBarcodeParser
+from ui_barcodes import split_mark_codes
+from ui_utils import BarcodeParser
+
+
+def collect_barcodes() -> list:
+    """Штрихкоды, которые разбирают тесты TestBarcodeParser"""
+
+    barcodes = []
+
+    class RecordingParser(BarcodeParser):
+        def __init__(self, barcode):
+            barcodes.append(barcode)
+            super().__init__(barcode)
+
+    for test in unittest.TestLoader().loadTestsFromTestCase(TestBarcodeParser):
+        test.setUp()
+        test.sut = RecordingParser
+        try:
+            getattr(test, test._testMethodName)()
+        except unittest.SkipTest:
+            pass
+
+    return barcodes
+
+
+class LegacyBarcodeParser(BarcodeParser):
+    """Прежний разбор GS1 (BarcodeParser.check_gs1_gtin до перехода на таблицу AI)"""
+
+    def check_gs1_gtin(self, barcode: str):
+        if self.gs1_separator in barcode:
+            while barcode:
+                if barcode[:2] == '01':
+                    self.barcode_info.gtin = barcode[2:16]
+                    barcode = barcode[16:] if len(barcode) > 16 else None
+                elif barcode[:3] == chr(29) + '01':
+                    self.barcode_info.gtin = barcode[3:17]
+                    barcode = barcode[17:] if len(barcode) > 17 else None
+                elif barcode[:2] == '17':
+                    self.barcode_info.expiry = barcode[2:8]
+                    barcode = barcode[8:] if len(barcode) > 8 else None
+                elif barcode[:2] in ('10', '21', '91'):
+                    field = {'10': 'batch', '21': 'serial', '91': 'nhrn'}[barcode[:2]]
+                    if chr(29) in barcode:
+                        index = barcode.index(chr(29))
+                        setattr(self.barcode_info, field, barcode[2:index])
+                        barcode = barcode[index + 1:]
+                    else:
+                        setattr(self.barcode_info, field, barcode[2:] if field != 'nhrn' else barcode[2:6])
+                        barcode = None
+                elif barcode[:2] == '93':
+                    self.barcode_info.check = barcode[2:6]
+                    barcode = barcode[7:]
+                elif barcode[:2] == '92':
+                    self.barcode_info.check = barcode[2:]
+                    barcode = None
+                elif barcode[:4] == '8005':
+                    self.barcode_info.nhrn = barcode[4:10]
+                    barcode = barcode[11:]
+                elif barcode[:4] == '3103':
+                    self.barcode_info.weight = barcode[4:]
+                    barcode = None
+                else:
+                    self.barcode_info.error = 'INVALID BARCODE'
+                    return
+        else:
+            self.barcode_info.error = 'No GS Separator'
+
+
+def measure(parser_classes, barcodes, repeat) -> list:
+    """Замеры разных парсеров чередуются, чтобы фоновая нагрузка влияла на них одинаково"""
+
+    timings = [[] for _ in parser_classes]
+    for _ in range(repeat):
+        for parser_class, parser_timings in zip(parser_classes, timings):
+            start = time.perf_counter()
+            for barcode in barcodes:
+                parser_class(barcode).parse(as_dict=False)
+            parser_timings.append((time.perf_counter() - start) * 1_000_000 / len(barcodes))
+
+    return timings
+
+
+def print_timings(name, timings):
+    print(f'{name:<10} минимум: {min(timings):.2f} мкс на код, медиана: {statistics.median(timings):.2f} мкс')
+
+
+def legacy_parse_mark_code(val):
+    """Прежний разбор кода марки при загрузке (BulkLoader.parse_mark_code)"""
+
+    if len(val) < 21:
+        return {'GTIN': '', 'Series': ''}
+
+    if val[:2] == '01':
+        return {'GTIN': val[2:16], 'Series': val[18:]}
+    else:
+        return {'GTIN': val[:14], 'Series': val[14:]}
+
+
+def measure_bulk(count=100_000):
+    marks = ['010462007052044121{:013d}'.format(i) for i in range(count)]
+
+    cases = (
+        ('Марки: прежний', lambda: [legacy_parse_mark_code(mark) for mark in marks]),
+        ('Марки: пакетом', lambda: list(split_mark_codes(marks))),
+    )
+
+    print(f'Документ из {count} марок')
+    for title, func in cases:
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        print(f'{title:<16} минимум: {min(timings) * 1000:.1f} мс, медиана: {statistics.median(timings) * 1000:.1f} мс')
+
+
+def main(repeat=2000):
+    repeat = int(repeat)
+    barcodes = collect_barcodes()
+    gs1_barcodes = [barcode for barcode in barcodes if chr(29) in barcode]
+
+    for barcode in gs1_barcodes:
+        legacy = LegacyBarcodeParser(barcode).parse()
+        new = BarcodeParser(barcode).parse()
+        if legacy != new:
+            print(f'Результаты разбора отличаются: {barcode!r}\n  {legacy}\n  {new}')
+
+    print(f'Кодов из тестов: {len(barcodes)}, из них GS1 с разделителем: {len(gs1_barcodes)}')
+    for title, codes in (('Все коды', barcodes), ('GS1', gs1_barcodes)):
+        print(title)
+        legacy_timings, new_timings = measure((LegacyBarcodeParser, BarcodeParser), codes, repeat)
+        print_timings('Прежний', legacy_timings)
+        print_timings('Новый', new_timings)
+
+    measure_bulk()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,103 @@
+"""
+Задержка обработки одного скана в Rs_doc.process_the_barcode: прежняя цепочка
+(отдельные запросы поиска и записи, каждый со своим коммитом) против одного запроса
+get_scan_data и одной транзакции записи, а также отложенная запись через журнал сканирований
+(use_scan_journal: запись в базу - фоновым потоком пачками).
+
+Запуск из каталога tests:
+    python -m benchmarks.bench_scan_pipeline [количество сканов]
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+
+from db_services import DbCreator, get_query_result, bulk_query
+from ui_global import Rs_doc, find_barcode_in_barcode_table, find_barcode_in_marking_codes_table, \
+    check_barcode_compliance
+import ui_barcodes
+from scan_journal import ScanJournal
+
+GOODS_COUNT = 500
+
+
+def prepare_data():
+    service = DbCreator()
+    service.drop_all_tables()
+    service.create_tables()
+
+    get_query_result('INSERT INTO RS_types_goods (id, name, use_mark) VALUES ("tg_1", "Товар", 0)')
+    bulk_query('INSERT INTO RS_goods (id, code, name, type_good) VALUES (?, ?, ?, "tg_1")',
+               [(f'good_{i}', str(i), f'Товар {i}') for i in range(GOODS_COUNT)])
+    bulk_query('INSERT INTO RS_barcodes (barcode, id_good, id_property, id_series, id_unit, ratio) '
+               'VALUES (?, ?, "", "", "unit", 1)',
+               [(get_barcode(i), f'good_{i}') for i in range(GOODS_COUNT)])
+    get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse) '
+                     'VALUES ("doc_1", "Приход", "1", "", "", "")')
+    # План по половине товаров
+    bulk_query('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, qtty_plan) '
+               'VALUES ("doc_1", ?, "", "", "unit", 0, 1000)',
+               [(f'good_{i}',) for i in range(0, GOODS_COUNT, 2)])
+
+    Rs_doc.id_doc = 'doc_1'
+
+
+def get_barcode(i):
+    return str(4600000000000 + i)
+
+
+def legacy_process_the_barcode(barcode, use_mark_setting='false'):
+    """Прежняя последовательность запросов process_the_barcode (без маркировки)"""
+
+    barcode_info = ui_barcodes.parse_barcode(barcode)
+    elem = find_barcode_in_barcode_table(barcode_info['BARCODE'])[0]
+    if use_mark_setting == 'true' and elem['use_mark'] == 1:
+        find_barcode_in_marking_codes_table(Rs_doc, barcode_info)
+    check_barcode_compliance(elem, Rs_doc.id_doc)
+    Rs_doc.update_doc_table_data(Rs_doc, elem, elem['ratio'])
+
+
+def new_process_the_barcode(barcode):
+    Rs_doc.process_the_barcode(Rs_doc, barcode, have_qtty_plan=True)
+
+
+def journal_process_the_barcode(journal):
+    return lambda barcode: Rs_doc.process_the_barcode(Rs_doc, barcode, have_qtty_plan=True, scan_journal=journal)
+
+
+def measure(func, scans_count):
+    timings = []
+    for i in range(scans_count):
+        barcode = get_barcode(i % GOODS_COUNT)
+        start = time.perf_counter()
+        func(barcode)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def print_timings(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{name:<10} сканов: {len(timings)}, среднее: {statistics.mean(timings):.3f} мс, '
+          f'p50: {statistics.median(timings):.3f} мс, p95: {p95:.3f} мс')
+
+
+def main(scans_count=2000):
+    prepare_data()
+    print_timings('Прежний', measure(legacy_process_the_barcode, scans_count))
+
+    prepare_data()
+    print_timings('Новый', measure(new_process_the_barcode, scans_count))
+
+    prepare_data()
+    with tempfile.TemporaryDirectory() as path:
+        journal = ScanJournal(path=path)
+        print_timings('Журнал', measure(journal_process_the_barcode(journal), scans_count))
+        journal.flush()
+        journal._file.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
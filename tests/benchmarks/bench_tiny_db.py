@@ -0,0 +1,53 @@
+"""
+Вставка записей по одной в TinyNoSQLProvider: JSONStorage по умолчанию (запись всего файла
+на каждую вставку) против буферизованного хранилища BufferedJSONStorage.
+
+Запуск из каталога tests:
+    python -m benchmarks.bench_tiny_db [количество записей] [flush_ops]
+"""
+
+import sys
+import tempfile
+import time
+
+from tiny_db_services import TinyNoSQLProvider
+
+
+def make_rows(count) -> list:
+    return [{'id_doc': 'doc_{}'.format(i % 10), 'row_key': str(i), 'id_good': 'good_{}'.format(i),
+             'id_properties': '', 'id_series': '', 'id_unit': 'unit_1', 'd_qtty': 1, 'sent': False}
+            for i in range(count)]
+
+
+def measure(rows, **provider_params) -> float:
+    with tempfile.TemporaryDirectory() as work_dir:
+        provider = TinyNoSQLProvider(table_name='scanning_queue', db_path=work_dir, **provider_params)
+        start = time.perf_counter()
+        for row in rows:
+            provider.insert(row)
+        provider.close()
+        seconds = time.perf_counter() - start
+
+        provider = TinyNoSQLProvider(table_name='scanning_queue', db_path=work_dir)
+        assert provider.count(id_doc='doc_0') == len(rows[::10])
+        provider.close()
+
+    return seconds
+
+
+def main(count=10_000, flush_ops=100):
+    rows = make_rows(int(count))
+
+    cases = (
+        ('JSONStorage', {}),
+        ('Буфер', {'buffered': True, 'flush_ops': int(flush_ops), 'flush_interval': 5.0}),
+    )
+
+    print(f'Вставка {len(rows)} записей по одной, запись на диск в буфере - каждые {flush_ops} изменений')
+    for title, params in cases:
+        seconds = measure(rows, **params)
+        print(f'{title:<12} {seconds:.2f} с, {len(rows) / seconds:.0f} вставок в секунду')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,128 @@
+"""
+Воспроизведение записанной сессии сканирования (scan_recorder) на копии базы вне устройства.
+Каждая запись обрабатывается так же, как на экране: Rs_doc через RsDoc или BarcodeWorker
+(по одному или пачкой), с теми же флагами экрана и настройкой маркировки.
+Выводит пропускную способность, распределение задержек (воспроизведение и записанное на устройстве),
+время по этапам и количество расхождений ошибок с записью.
+
+Запуск из каталога tests:
+    python -m benchmarks.replay_scan_session <файл сессии .jsonl> <база SQLite> [количество повторов]
+
+База копируется во временный каталог, исходный файл не меняется.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from data_for_tests.utils_for_tests import noSQL, stub_simple_ui_modules
+
+stub_simple_ui_modules()
+
+import ui_global
+from doc_session import DocSession
+from query_cache import query_cache
+from scan_metrics import ScanMetrics, scan_metrics
+from scan_recorder import ScanRecorder
+from ui_utils import BarcodeWorker, RsDoc
+
+
+def prepare_database(seed_db_path, work_dir):
+    db_path = os.path.join(work_dir, os.path.basename(seed_db_path))
+    shutil.copyfile(seed_db_path, db_path)
+
+    ui_global.close_connection()
+    ui_global.db_path = db_path
+    query_cache.clear()
+
+    rs_settings = noSQL('rs_settings')
+    rs_settings.put('path_to_databases', work_dir)
+    rs_settings.put('record_scan_sessions', 'false')
+
+    return rs_settings
+
+
+def replay_record(record, doc_sessions):
+    id_doc = record['id_doc']
+    flags = record['flags']
+    doc_session = doc_sessions.setdefault(id_doc, DocSession(id_doc))
+
+    if record['mode'] == 'rs_doc':
+        result = RsDoc(id_doc).process_the_barcode(
+            record['barcodes'][0],
+            flags.get('have_qtty_plan', False),
+            flags.get('have_zero_plan', False),
+            flags.get('control', False),
+            flags.get('have_mark_plan', False),
+            use_mark_setting=record.get('use_mark') or 'false',
+            doc_session=doc_session)
+        return [result.get('Error') or '']
+
+    barcode_worker = BarcodeWorker(id_doc, **flags, doc_session=doc_session)
+    if record['mode'] == 'worker_batch':
+        results = barcode_worker.process_barcodes(record['barcodes'])
+    else:
+        results = [barcode_worker.process_the_barcode(record['barcodes'][0])]
+
+    return [result.error for result in results]
+
+
+def replay(records, seed_db_path, work_dir):
+    rs_settings = prepare_database(seed_db_path, work_dir)
+    doc_sessions = {}
+    timings = ScanMetrics(window_size=max(len(records), 1))
+    mismatches = 0
+    scans_count = 0
+
+    start = time.perf_counter()
+    for record in records:
+        rs_settings.put('use_mark', record.get('use_mark') or 'false')
+
+        record_start = time.perf_counter()
+        errors = replay_record(record, doc_sessions)
+        timings.add('replay', (time.perf_counter() - record_start) * 1000)
+        timings.add('recorded', record['duration_ms'])
+
+        scans_count += len(record['barcodes'])
+        if errors != record['errors']:
+            mismatches += 1
+
+    return {
+        'records': len(records),
+        'scans': scans_count,
+        'seconds': time.perf_counter() - start,
+        'timings': timings.stats(),
+        'mismatches': mismatches,
+    }
+
+
+def print_result(result):
+    print(f"Записей: {result['records']}, сканов: {result['scans']}, время: {result['seconds']:.3f} с, "
+          f"сканов в секунду: {result['scans'] / result['seconds']:.1f}")
+
+    for name, title in (('replay', 'Воспроизведение'), ('recorded', 'На устройстве')):
+        stats = result['timings'].get(name)
+        if stats:
+            print(f"{title:<16} p50: {stats['p50']} мс, p95: {stats['p95']} мс, "
+                  f"p99: {stats['p99']} мс, max: {stats['max']} мс")
+
+    print('Ошибки отличаются от записанных: {}'.format(result['mismatches']))
+    print(scan_metrics.report())
+
+
+def main(session_path, seed_db_path, repeat=1):
+    records = ScanRecorder.load(session_path)
+
+    for _ in range(int(repeat)):
+        scan_metrics.reset()
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                print_result(replay(records, seed_db_path, work_dir))
+            finally:
+                ui_global.close_connection()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
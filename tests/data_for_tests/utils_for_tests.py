@@ -27,3 +27,48 @@ class hashMap:
             ex_hashMap.append({"key": key, "value": self.d[key]})
         return ex_hashMap
 
+
+
+class noSQL:
+    """Хранилище NoSQL SimpleUI в памяти, экземпляры с одним именем видят одни данные"""
+
+    _stores = {}
+
+    def __init__(self, name):
+        self.d = noSQL._stores.setdefault(name, {})
+
+    def put(self, key, val, _=None):
+        self.d[key] = val
+
+    def get(self, key):
+        return self.d.get(key)
+
+    def delete(self, key):
+        self.d.pop(key, None)
+
+
+def stub_simple_ui_modules():
+    """
+    Подменяет модули java и ru.travelfood.simple_ui, если их нет (запуск вне устройства):
+    jclass("ru.travelfood.simple_ui.NoSQL") возвращает noSQL
+    """
+
+    import sys
+    import types
+
+    try:
+        import java
+        return
+    except ImportError:
+        pass
+
+    java = types.ModuleType('java')
+    java.jclass = lambda name: noSQL if name.endswith('NoSQL') else type(name.split('.')[-1], (), {})
+    sys.modules['java'] = java
+
+    for name in ('ru', 'ru.travelfood'):
+        sys.modules[name] = types.ModuleType(name)
+    simple_ui = types.ModuleType('ru.travelfood.simple_ui')
+    simple_ui.SimpleUtilites = type('SimpleUtilites', (), {})
+    simple_ui.SimpleSQLProvider = type('SimpleSQLProvider', (), {})
+    sys.modules['ru.travelfood.simple_ui'] = simple_ui
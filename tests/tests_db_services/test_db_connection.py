@@ -0,0 +1,81 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from db_connection import ConnectionManager
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'test.db')
+        self.sut = ConnectionManager()
+        self.sut.get_connection(self.db_path).execute('CREATE TABLE test_table (id INTEGER, name TEXT)')
+
+    def tearDown(self) -> None:
+        self.sut.close_all()
+        self.temp_dir.cleanup()
+
+    def test_must_reuse_connection_in_thread(self):
+        conn = self.sut.get_connection(self.db_path)
+        self.assertIs(conn, self.sut.get_connection(self.db_path))
+
+    def test_must_create_connection_per_thread(self):
+        main_conn = self.sut.get_connection(self.db_path)
+        thread_conn = []
+
+        thread = threading.Thread(target=lambda: thread_conn.append(self.sut.get_connection(self.db_path)))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(main_conn, thread_conn[0])
+
+    def test_close_all_keeps_connections_of_other_threads(self):
+        closed, used = threading.Event(), []
+
+        def worker():
+            conn = self.sut.get_connection(self.db_path)
+            closed.wait(5)
+            used.append(self.sut.get_connection(self.db_path) is conn)
+            conn.execute('SELECT COUNT(*) FROM test_table')
+            self.sut.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        while len(self.sut._connections) < 2:
+            thread.join(0.01)
+
+        self.sut.close_all()
+        self.assertEqual(1, len(self.sut._connections))
+        closed.set()
+        thread.join()
+
+        self.assertEqual([True], used)
+        self.assertEqual([], self.sut._connections)
+
+    def test_must_enable_wal(self):
+        conn = self.sut.get_connection(self.db_path)
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', journal_mode)
+
+    def test_must_commit_transaction(self):
+        with self.sut.transaction(self.db_path) as conn:
+            conn.execute('INSERT INTO test_table VALUES (1, "first")')
+            with self.sut.transaction(self.db_path):
+                conn.execute('INSERT INTO test_table VALUES (2, "second")')
+            self.assertTrue(conn.in_transaction)
+
+        self.sut.close()
+        count = self.sut.get_connection(self.db_path).execute('SELECT COUNT(*) FROM test_table').fetchone()[0]
+        self.assertEqual(2, count)
+
+    def test_must_rollback_transaction_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.sut.transaction(self.db_path) as conn:
+                conn.execute('INSERT INTO test_table VALUES (1, "first")')
+                raise RuntimeError('test')
+
+        count = self.sut.get_connection(self.db_path).execute('SELECT COUNT(*) FROM test_table').fetchone()[0]
+        self.assertEqual(0, count)
+        self.assertFalse(self.sut.in_transaction(self.db_path))
@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import patch
+
+import db_services
+import ui_global
+from db_services import DbCreator, DocService, BarcodeService, SqlQueryProvider, get_query_result
+from ui_utils import BarcodeParser
+
+
+class TestQueryPlans(unittest.TestCase):
+    """ Горячие запросы не должны приводить к полному сканированию таблиц """
+
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        get_query_result(
+            'INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse, verified, sent) '
+            'VALUES (?,?,?,?,?,?,?,?)', ('id_doc_1', 'Приход', '1', '2023-01-01', '', '', 1, 0))
+        self.queries = []
+
+    def test_get_barcode_data_use_indexes(self):
+        get_query_result('INSERT INTO RS_barcodes (barcode, id_good, id_property, id_series, id_unit, ratio) '
+                         'VALUES (?,?,?,?,?,?)', ('4601234567893', 'good_1', '', '', 'unit_1', 1))
+        barcode_info = BarcodeParser('4601234567893').parse(as_dict=False)
+
+        with patch.object(db_services, 'get_query_result', side_effect=self._capture_query), \
+                patch.object(ui_global, 'get_query_result', side_effect=self._capture_query):
+            BarcodeService().get_barcode_data(barcode_info, 'id_doc_1')
+
+        self.assertEqual(2, len(self.queries))
+
+        self.assert_no_full_scan()
+
+    def test_get_doc_details_data_use_indexes(self):
+        with patch.object(db_services, 'get_query_result', side_effect=self._capture_query):
+            DocService('id_doc_1').get_doc_details_data('id_doc_1', 0, 20, search_string='молоко')
+
+        self.assert_no_full_scan()
+
+    def test_get_data_to_send_use_indexes(self):
+        service = DocService()
+        sql_query = service.provider.sql_query
+
+        def capture_sql_query(q, params=None):
+            self.queries.append((q, SqlQueryProvider._to_native_params(params)))
+            return sql_query(q, params)
+
+        with patch.object(service.provider, 'sql_query', side_effect=capture_sql_query):
+            service.get_data_to_send()
+
+        self.assertEqual(4, len(self.queries))
+        self.assert_no_full_scan()
+
+    def assert_no_full_scan(self):
+        self.assertTrue(self.queries)
+
+        # Промежуточные выборки (CTE, подзапросы) ограничены LIMIT, проверяются только таблицы базы.
+        # Виртуальная таблица FTS читается через свой индекс (MATCH) и в проверку не входит
+        tables = {row[0] for row in get_query_result(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL TABLE%'")}
+
+        for q, args in self.queries:
+            plan = get_query_result(f'EXPLAIN QUERY PLAN {q}', args, return_dict=True)
+            full_scans = [row['detail'] for row in plan
+                          if row['detail'].startswith('SCAN') and row['detail'].split()[1] in tables]
+            self.assertEqual([], full_scans, q)
+
+    def _capture_query(self, query_text, args=None, return_dict=False):
+        self.queries.append((query_text, args))
+        return get_query_result(query_text, args, return_dict)
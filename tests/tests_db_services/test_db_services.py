@@ -2,7 +2,9 @@ import unittest
 import json
 import os
 
-from db_services import DocService, DbCreator, TimerService, DbService, SqlQueryProvider, GoodsService, get_query_result
+from db_services import DocService, DbCreator, TimerService, DbService, SqlQueryProvider, GoodsService, get_query_result, \
+    BulkLoader, ErrorService, iter_query
+from query_cache import query_cache
 
 
 class TestDocService(unittest.TestCase):
@@ -63,6 +65,14 @@ class TestDocService(unittest.TestCase):
         actual = self.service.json_to_sqlite_query(data)
         self.assertEqual(expected, actual)
 
+    def test_json_to_sqlite_query_splits_mark_code(self):
+        data = {'RS_docs_barcodes': [{'id_doc': 'doc_1', 'mark_code': '010462007052044121tEjE+7qAAAAXi6n'}]}
+
+        actual = self.service.json_to_sqlite_query(data)
+
+        self.assertEqual(['REPLACE INTO RS_docs_barcodes (id_doc, GTIN, Series) '
+                          'VALUES ("doc_1", "04620070520441", "tEjE+7qAAAAXi6n")'], actual)
+
     def get_data_from_file(self, file_name):
         with open(f'{self.http_results_path}/{file_name}', encoding='utf-8') as fp:
             return json.load(fp)
@@ -105,6 +115,22 @@ class TestTimerService(unittest.TestCase):
         self.assertIsNotNone((actual[1].get('RS_adr_docs_table')))
         self.assertTrue(actual[1]['RS_adr_docs_table'])
 
+    def test_iter_data_to_send_by_batches(self):
+        for i in range(5):
+            get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse, '
+                             'verified, sent) VALUES (?, "", "", "", "", "", 1, 0)', (f'doc_{i}',))
+            get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_unit, qtty) VALUES (?, ?, ?, ?)',
+                             (f'doc_{i}', 'good', 'unit', i))
+        get_query_result('INSERT INTO RS_barc_flow (id_doc, barcode) VALUES (?, ?)', ('doc_3', '4680134840398'))
+
+        actual = list(DocService().iter_data_to_send(batch_size=2))
+
+        self.assertEqual([2, 2, 1], [len(batch) for batch in actual])
+        docs = {doc['id_doc']: doc for batch in actual for doc in batch}
+        self.assertEqual(3, docs['doc_3']['RS_docs_table'][0]['qtty'])
+        self.assertEqual([{'id_doc': 'doc_3', 'barcode': '4680134840398'}], docs['doc_3']['RS_barc_flow'])
+        self.assertEqual([], docs['doc_1']['RS_barc_flow'])
+
 
 class TestDbService(unittest.TestCase):
     def setUp(self) -> None:
@@ -114,7 +140,7 @@ class TestDbService(unittest.TestCase):
         sut = DbService()
         sut._write_error_on_log('123')
         self.assertEqual('INSERT INTO Error_log (log) VALUES (?)', sut.sql_text)
-        self.assertEqual([["123"]], json.loads(sut.sql_params))
+        self.assertEqual([["123"]], sut.sql_params)
 
 
 class TestSQLQueryProvider(unittest.TestCase):
@@ -241,6 +267,228 @@ class TestSQLQueryProvider(unittest.TestCase):
                                 'out']
 
 
+class TestBulkLoader(unittest.TestCase):
+    def setUp(self) -> None:
+        self.http_results_path = './tests_db_services/http_result_data_example'
+
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+    def test_load_returns_table_stats(self):
+        data = self.get_data_from_file('get_nsi_data_example.json')
+        sut = BulkLoader(chunk_size=1)
+
+        stats = sut.load(data)
+
+        for table_name, rows in data.items():
+            if rows and table_name in sut.table_list:
+                self.assertEqual(len(rows), stats[table_name]['rows'])
+
+    def test_load_values_with_quotes(self):
+        data = {'RS_goods': [
+            {'id': 'id_1', 'code': '1', 'name': 'Молоко "Домик", 1л', 'art': None, 'unit': '', 'type_good': 't1'}
+        ]}
+
+        BulkLoader().load(data)
+
+        actual = get_query_result('SELECT name, art FROM RS_goods WHERE id = ?', ('id_1',), True)
+        self.assertEqual([{'name': 'Молоко "Домик", 1л', 'art': ''}], actual)
+
+    def test_load_docs_keeps_verified_and_splits_mark_code(self):
+        doc = {'id_doc': 'doc_1', 'doc_type': '', 'doc_n': '1', 'doc_date': '', 'id_countragents': '',
+               'id_warehouse': ''}
+        mark = {'id_doc': 'doc_1', 'id_good': 'g', 'id_property': '', 'id_series': '', 'id_unit': '',
+                'mark_code': '010462007052044121tEjE+7qAAAAXi6n'}
+
+        BulkLoader().load({'RS_docs': [doc], 'RS_docs_barcodes': [mark]}, docs={'doc_1': 1})
+
+        actual = get_query_result('SELECT verified FROM RS_docs WHERE id_doc = ?', ('doc_1',))
+        self.assertEqual([(1,)], actual)
+
+        actual = get_query_result('SELECT GTIN, Series FROM RS_docs_barcodes WHERE id_doc = ?', ('doc_1',), True)
+        self.assertEqual([{'GTIN': '04620070520441', 'Series': 'tEjE+7qAAAAXi6n'}], actual)
+
+    def test_load_mark_codes_with_gs_separator(self):
+        marks = [{'id_doc': 'doc_1', 'id_good': 'g', 'id_property': '', 'id_series': '', 'id_unit': '',
+                  'mark_code': mark_code} for mark_code in
+                 ('010462007052044121tEjE+7q{}93AAAA'.format(chr(29)), '04620070520441SER2', None)]
+
+        BulkLoader().load({'RS_docs_barcodes': marks})
+
+        actual = get_query_result('SELECT GTIN, Series FROM RS_docs_barcodes ORDER BY id', return_dict=True)
+        self.assertEqual([{'GTIN': '04620070520441', 'Series': 'tEjE+7q'}, {'GTIN': '', 'Series': ''},
+                          {'GTIN': '', 'Series': ''}], actual)
+
+    def get_data_from_file(self, file_name):
+        with open(f'{self.http_results_path}/{file_name}', encoding='utf-8') as fp:
+            return json.load(fp)
+
+
+class TestDocDetailsPagination(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        self.service = DocService('doc_1')
+        rows = [('doc_1', f'good_{i}', '', '', '', 0, 1, f'2023-01-01 00:00:{i % 5:02}') for i in range(23)]
+        rows.append(('doc_1', 'good_null', '', '', '', 0, 1, None))
+        get_query_result(
+            'INSERT INTO RS_goods (id, code, name, type_good) VALUES (?, ?, ?, ?)',
+            ('good_7', '7', 'Молоко', ''))
+        for row in rows:
+            get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                             'qtty_plan, last_updated) VALUES (?,?,?,?,?,?,?,?)', row)
+
+    def test_keyset_pages_equal_offset_pages(self):
+        expected = [row['id'] for row in self.service.get_doc_details_data('doc_1', 0, 100)]
+
+        actual = []
+        after = None
+        while True:
+            page = self.service.get_doc_details_page('doc_1', len(actual), 5, after=after)
+            actual.extend(row['id'] for row in page['rows'])
+            if not page['rows']:
+                break
+            after = page['next_key']
+
+        self.assertEqual(24, len(expected))
+        self.assertEqual(expected, actual)
+
+    def test_page_returns_last_scanned_and_total(self):
+        page = self.service.get_doc_details_page('doc_1', 10, 5)
+
+        first_row = self.service.get_doc_details_data('doc_1', 0, 1)[0]
+        self.assertEqual(first_row, page['last_scanned'])
+        self.assertEqual(24, page['total'])
+        self.assertEqual(5, len(page['rows']))
+        self.assertEqual(24, self.service.get_doc_details_count('doc_1'))
+
+    def test_search_string_is_parameter(self):
+        page = self.service.get_doc_details_page('doc_1', 0, 5, search_string="моло'ко")
+        self.assertEqual(0, page['total'])
+
+        page = self.service.get_doc_details_page('doc_1', 0, 5, search_string='Моло')
+        self.assertEqual(['good_7'], [row['id_good'] for row in page['rows']])
+        self.assertEqual(1, self.service.get_doc_details_count('doc_1', search_string='Моло'))
+
+
+class TestDocsStat(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        self.service = DocService()
+        self.data_creator = DataCreator()
+
+    def test_stats_follow_documents_changes(self):
+        self.data_creator.insert_data('RS_docs', 'RS_docs_table', 'RS_barc_flow')
+        get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse, '
+                         'verified, sent) VALUES ("flow_doc", "Сбор", "", "", "", "", 0, 0)')
+        get_query_result('INSERT INTO RS_barc_flow (id_doc, barcode) VALUES ("flow_doc", "1"), ("flow_doc", "2")')
+
+        get_query_result('UPDATE RS_docs_table SET qtty_plan = 7')
+        get_query_result('REPLACE INTO RS_docs_table (id, id_doc, id_good, id_unit, qtty_plan) '
+                         'SELECT id, id_doc, id_good, id_unit, 3 FROM RS_docs_table')
+        get_query_result('UPDATE RS_docs SET sent = 1 WHERE id_doc = "flow_doc"')
+        get_query_result('DELETE FROM RS_barc_flow WHERE barcode = "2"')
+
+        self.assertEqual([], self.service.check_docs_stat())
+        self.assertEqual(self.service.get_docs_stat(), self.calc_docs_stat())
+
+        flow_stat = self.service.get_doc_flow_stat()
+        self.assertEqual([{'docType': 'Сбор', 'id_count': 1, 'count': 1, 'sent': 1, 'verified': 0,
+                           'barc_count': 1}], flow_stat)
+
+    def test_check_and_rebuild(self):
+        self.data_creator.insert_data('RS_docs', 'RS_docs_table')
+        get_query_result('UPDATE RS_doc_stats SET lines_count = 10')
+        get_query_result('INSERT INTO RS_doc_stats (id_doc) VALUES ("deleted_doc")')
+
+        self.assertEqual({'37c4c709-d22b-11e4-869d-0050568b35ac1', 'deleted_doc'},
+                         set(self.service.check_docs_stat()))
+
+        self.service.rebuild_docs_stat()
+
+        self.assertEqual([], self.service.check_docs_stat())
+
+    def calc_docs_stat(self):
+        # Прежний расчет по всем строкам документов
+        query = '''
+        WITH tmp AS (
+            SELECT
+                doc_type,
+                RS_docs.id_doc,
+                IFNULL(RS_docs.sent, 0) as sent,
+                IFNULL(RS_docs.verified, 0) as verified,
+                CASE WHEN IFNULL(verified, 0) = 0 THEN COUNT(RS_docs_table.id) ELSE 0 END as count_verified,
+                CASE WHEN IFNULL(verified, 0) = 1 THEN COUNT(RS_docs_table.id) ELSE 0 END as count_unverified,
+                CASE WHEN IFNULL(verified, 0) = 0 THEN TOTAL(RS_docs_table.qtty_plan) ELSE 0 END as qtty_plan_verified,
+                CASE WHEN IFNULL(verified, 0) = 1 THEN TOTAL(RS_docs_table.qtty_plan) ELSE 0 END as qtty_plan_unverified
+            FROM RS_docs
+            LEFT JOIN RS_docs_table ON RS_docs_table.id_doc = RS_docs.id_doc
+            GROUP BY RS_docs.id_doc
+        )
+        SELECT
+            doc_type as docType,
+            COUNT(id_doc) as "COUNT(id_doc)",
+            COUNT(id_doc) as count,
+            SUM(sent) as sent,
+            SUM(verified) as verified,
+            SUM(count_verified) as count_verified,
+            SUM(count_unverified) as count_unverified,
+            SUM(qtty_plan_verified) as qtty_plan_verified,
+            SUM(qtty_plan_unverified) as qtty_plan_unverified
+        FROM tmp
+        GROUP BY doc_type
+        '''
+        return get_query_result(query, return_dict=True)
+
+
+class TestIterQuery(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        get_query_result('INSERT INTO RS_warehouses (id, name) VALUES ' +
+                         ', '.join(f'("wh_{i}", "Склад {i}")' for i in range(7)))
+
+    def test_rows_equal_get_query_result(self):
+        query = 'SELECT id, name FROM RS_warehouses ORDER BY id'
+        expected = get_query_result(query, return_dict=True)
+
+        rows = list(iter_query(query, batch_size=3))
+
+        self.assertEqual(expected, [dict(row) for row in rows])
+        self.assertEqual(('wh_0', 'Склад 0'), tuple(rows[0]))
+        self.assertEqual('wh_0', rows[0]['id'])
+
+    def test_rows_are_read_lazily(self):
+        rows = iter_query('SELECT id FROM RS_warehouses WHERE id > ?', ('wh_4',), batch_size=1)
+        self.assertEqual('wh_5', next(rows)['id'])
+        rows.close()
+
+    def test_services_stream_rows(self):
+        ErrorService.clear()
+        get_query_result('INSERT INTO Error_log (log, timestamp) VALUES ("first", "2023-01-01"), '
+                         '("second", "2023-01-02")')
+
+        errors = ErrorService.get_all_errors('Cтарые')
+        self.assertEqual(['first', 'second'], [row[0] for row in errors])
+
+    def test_select_data_of_small_tables_is_cached(self):
+        service = GoodsService()
+        query_cache.reset_stats()
+        rows = service.get_select_data('RS_warehouses')
+
+        self.assertEqual(7, len(rows))
+        self.assertEqual(rows, service.get_select_data('RS_warehouses'))
+        self.assertEqual(1, query_cache.stats()['by_name']['get_select_data']['hits'])
+
+
 class DataCreator:
     def __init__(self):
         self.samples = {
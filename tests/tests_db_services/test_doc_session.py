@@ -0,0 +1,154 @@
+import unittest
+
+from db_services import DbCreator, get_query_result
+from doc_session import DocSession
+from ui_global import get_connection, write_scan
+
+
+class TestDocSession(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse, '
+                         'control) VALUES ("doc_1", "Приход", "1", "", "", "", "1")')
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan) VALUES ("doc_1", "good_1", "", "", "unit_1", 1, 5)')
+        get_query_result('INSERT INTO RS_docs_barcodes (id_doc, id_good, id_property, id_series, id_unit, is_plan, '
+                         'approved, GTIN, Series) VALUES ("doc_1", "good_1", "", "", "unit_1", "1", "0", "046", "s1")')
+
+        self.sut = DocSession('doc_1')
+
+    def test_load_document_data(self):
+        self.assertTrue(self.sut.have_qtty_plan)
+        self.assertTrue(self.sut.have_mark_plan)
+        self.assertTrue(self.sut.control)
+        self.assertEqual(1, self.sut.get_row('good_1', '', 'unit_1')['qtty'])
+        self.assertIsNone(self.sut.get_row('good_2', '', 'unit_1'))
+        self.assertFalse(self.sut.is_mark_approved('046', 's1'))
+
+    def test_data_is_not_reloaded_between_events(self):
+        self.sut.load()
+
+        statements = []
+        conn = get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            self.sut.get_row('good_1', '', 'unit_1')
+            self.assertTrue(self.sut.have_qtty_plan)
+            self.assertTrue(self.sut.control)
+        finally:
+            conn.set_trace_callback(None)
+
+        self.assertEqual([], statements)
+
+    def test_write_through(self):
+        row = self.sut.get_row('good_1', '', 'unit_1')
+        row['qtty'] = 2
+        self.sut.update_row(row)
+        new_row = self.sut.update_row({'id_good': 'good_2', 'id_properties': '', 'id_series': '', 'id_unit': 'unit_1',
+                                       'qtty': 1, 'qtty_plan': 0})
+        self.sut.approve_mark('046', 's1', 'barcode')
+
+        self.assertTrue(self.sut.is_loaded('rows'))
+        self.assertTrue(self.sut.is_loaded('marks'))
+        self.assertEqual(2, self.sut.get_row('good_1', '', 'unit_1')['qtty'])
+        self.assertEqual(new_row['id'], self.sut.get_row('good_2', '', 'unit_1')['id'])
+        self.assertTrue(self.sut.is_mark_approved('046', 's1'))
+
+        self.assertEqual([('good_1', 2), ('good_2', 1)],
+                         get_query_result('SELECT id_good, qtty FROM RS_docs_table ORDER BY id'))
+        self.assertEqual([('1', 'barcode')], get_query_result('SELECT approved, barcode_from_scanner '
+                                                              'FROM RS_docs_barcodes'))
+
+    def test_update_row_keeps_external_changes(self):
+        row = self.sut.get_row('good_1', '', 'unit_1')
+        get_versions = self.sut.get_versions
+
+        def get_versions_and_write(part=None):
+            # Скан другой строки, записанный журналом после проверки сессии в update_row
+            write_scan('doc_1', {'id_good': 'good_2', 'id_property': '', 'id_series': '', 'id_unit': 'unit_1'},
+                       1, '2024-01-01 00:00:00')
+            return get_versions(part)
+
+        self.sut.get_versions = get_versions_and_write
+        self.sut.update_row(dict(row, qtty=2))
+        del self.sut.get_versions
+
+        self.assertFalse(self.sut.is_loaded('rows'))
+        self.assertEqual(2, self.sut.get_row('good_1', '', 'unit_1')['qtty'])
+        self.assertEqual(1, self.sut.get_row('good_2', '', 'unit_1')['qtty'])
+
+    def test_reload_after_external_changes(self):
+        self.assertEqual(5, self.sut.qtty_plan)
+
+        # Например, загрузка документа таймером
+        get_query_result('UPDATE RS_docs_table SET qtty_plan = 10')
+        self.assertEqual(10, self.sut.qtty_plan)
+
+        self.sut.invalidate()
+        self.assertFalse(self.sut.is_loaded())
+        self.assertEqual(10, self.sut.qtty_plan)
+
+    def test_qtty_plan_does_not_reload_rows_after_scan(self):
+        self.sut.load()
+        write_scan('doc_1', {'id_good': 'good_1', 'id_property': '', 'id_series': '', 'id_unit': 'unit_1'},
+                   1, '2024-01-01 00:00:00')
+
+        statements = []
+        conn = get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            self.assertTrue(self.sut.have_qtty_plan)
+        finally:
+            conn.set_trace_callback(None)
+
+        self.assertEqual(1, len(statements))
+        self.assertIn('RS_doc_stats', statements[0])
+        self.assertFalse(self.sut.is_loaded('rows'))
+
+    def test_approved_mark_found_without_queries(self):
+        self.sut.approve_mark('046', 's1')
+
+        statements = []
+        conn = get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            self.assertTrue(self.sut.is_mark_approved('046', 's1'))
+            self.assertFalse(self.sut.is_mark_approved('046', 's2', check_db=False))
+        finally:
+            conn.set_trace_callback(None)
+
+        self.assertEqual([], statements)
+
+    def test_approved_mark_db_fallback(self):
+        self.assertFalse(self.sut.is_mark_approved('046', 's1'))
+
+        # Марка одобрена в обход сессии, версия таблицы при этом не меняется
+        get_connection().execute('UPDATE RS_docs_barcodes SET approved = "1"')
+
+        self.assertFalse(self.sut.is_mark_approved('046', 's1', check_db=False))
+        self.assertTrue(self.sut.is_mark_approved('046', 's1'))
+        self.assertTrue(self.sut.is_mark_approved('046', 's1', check_db=False))
+
+    def test_stale_marks_are_reloaded_after_scan(self):
+        self.sut.is_mark_approved('046', 's1')
+        # Марка одобрена в обход сессии (например, загрузка документа таймером)
+        get_query_result('INSERT INTO RS_docs_barcodes (id_doc, id_good, id_property, id_series, id_unit, is_plan, '
+                         'approved, GTIN, Series) VALUES ("doc_1", "good_1", "", "", "unit_1", "1", "1", "046", "s2")')
+
+        versions_before = self.sut.get_versions('marks')
+        get_query_result('UPDATE RS_docs_barcodes SET approved = "1" WHERE Series = "s1"')
+        self.sut.add_approved_mark('046', 's1', versions_before)
+
+        self.assertFalse(self.sut.is_loaded('marks'))
+        self.assertTrue(self.sut.is_mark_approved('046', 's1', check_db=False))
+        self.assertTrue(self.sut.is_mark_approved('046', 's2', check_db=False))
+
+    def test_rows_changes_do_not_reload_marks(self):
+        self.sut.is_mark_approved('046', 's1')
+        get_query_result('UPDATE RS_docs_table SET qtty = 3')
+
+        self.assertTrue(self.sut.is_loaded('marks'))
+        self.assertFalse(self.sut.is_loaded('rows'))
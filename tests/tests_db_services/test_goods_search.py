@@ -0,0 +1,58 @@
+import unittest
+
+from db_services import DbCreator, GoodsService, get_query_result
+from goods_search import goods_search_index
+
+
+class TestGoodsSearchIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        self.insert_goods(('id_1', '001', 'Молоко Домик в деревне', 'МД-1', 'Пастеризованное'),
+                          ('id_2', '002', 'Кефир', 'КФ-2', 'Молочный продукт'),
+                          ('id_3', '003', 'Хлеб', 'ХЛ-3', ''))
+
+    def test_search_by_prefix_in_all_fields(self):
+        self.assertEqual({'id_1', 'id_2'}, set(self.search('мол')))
+        self.assertEqual(['id_3'], self.search('003'))
+        self.assertEqual(['id_1'], self.search('мол дер'))
+
+    def test_search_by_selected_fields(self):
+        self.assertEqual(['id_1'], self.search('мол', ['name']))
+
+    def test_index_follows_goods_changes(self):
+        get_query_result('UPDATE RS_goods SET name = ? WHERE id = ?', ('Сметана', 'id_1'))
+        self.assertEqual(['id_1'], self.search('смет'))
+        self.assertEqual(['id_2'], self.search('мол'))
+
+        self.insert_goods(('id_3', '003', 'Батон', 'ХЛ-3', ''))
+        self.assertEqual([], self.search('хлеб'))
+        self.assertEqual(['id_3'], self.search('бат'))
+
+        get_query_result('DELETE FROM RS_goods WHERE id = ?', ('id_2',))
+        self.assertEqual([], self.search('кефир'))
+
+    def test_goods_list_search_sorted_by_rank(self):
+        actual = GoodsService().get_goods_list_data(search_string='мол')
+        self.assertEqual(self.search('мол'), [row['id'] for row in actual])
+        self.assertEqual(2, len(actual))
+
+    def test_like_search_without_fts(self):
+        goods_search_index._available = False
+        try:
+            self.assertEqual({'id_1', 'id_2'}, set(self.search('Мол')))
+        finally:
+            goods_search_index.reset()
+
+    @staticmethod
+    def insert_goods(*goods):
+        for item in goods:
+            get_query_result('REPLACE INTO RS_goods (id, code, name, art, description, type_good) '
+                             'VALUES (?, ?, ?, ?, ?, "")', item)
+
+    @staticmethod
+    def search(search_string, fields=None):
+        query, args = goods_search_index.get_search_query(search_string, fields)
+        return [row['id'] for row in get_query_result(f'{query} ORDER BY rank', args, True)]
@@ -0,0 +1,72 @@
+import unittest
+
+from db_services import DbCreator, GoodsService, SqlQueryProvider, TimerService, get_query_result
+from query_cache import QueryCache, query_cache
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sut = QueryCache(max_size=2)
+        self.calls = 0
+
+    def load(self):
+        self.calls += 1
+        return [{'calls': self.calls}]
+
+    def test_returns_cached_result_until_table_changes(self):
+        self.assertEqual([{'calls': 1}], self.sut.get('test', 'q', None, ['RS_goods'], self.load))
+        self.assertEqual([{'calls': 1}], self.sut.get('test', 'q', None, ['RS_goods'], self.load))
+
+        self.sut.bump_for_query('UPDATE RS_goods SET name = ?')
+
+        self.assertEqual([{'calls': 2}], self.sut.get('test', 'q', None, ['RS_goods'], self.load))
+        self.assertEqual({'hits': 1, 'misses': 2}, self.sut.stats()['by_name']['test'])
+
+    def test_evicts_least_recently_used(self):
+        self.sut.get('test', 'q1', None, [], self.load)
+        self.sut.get('test', 'q2', None, [], self.load)
+        self.sut.get('test', 'q1', None, [], self.load)
+        self.sut.get('test', 'q3', None, [], self.load)
+
+        self.sut.get('test', 'q1', None, [], self.load)
+        self.assertEqual(3, self.calls)
+        self.sut.get('test', 'q2', None, [], self.load)
+        self.assertEqual(4, self.calls)
+        self.assertEqual(2, self.sut.stats()['evictions'])
+
+    def test_params_are_part_of_key(self):
+        self.sut.get('test', 'q', ('1',), [], self.load)
+        self.sut.get('test', 'q', ('2',), [], self.load)
+
+        self.assertEqual(2, self.calls)
+
+    def test_schema_change_clears_cache(self):
+        self.sut.get('test', 'q', None, [], self.load)
+        self.sut.bump_for_query('CREATE TABLE test (id)')
+        self.sut.get('test', 'q', None, [], self.load)
+
+        self.assertEqual(2, self.calls)
+
+
+class TestReferenceDataCache(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+        query_cache.reset_stats()
+
+    def test_goods_types_invalidated_by_writes(self):
+        service = GoodsService()
+        self.assertEqual([], service.get_all_goods_types_data())
+
+        get_query_result('INSERT INTO RS_types_goods (id, name) VALUES (?, ?)', ('1', 'Товар'))
+        self.assertEqual([{'id': '1', 'name': 'Товар'}], service.get_all_goods_types_data())
+
+        SqlQueryProvider('RS_types_goods').update({'name': 'Услуга'}, {'id': '1'})
+        self.assertEqual([{'name': 'Услуга'}], service.get_type_name_by_id('1'))
+
+        TimerService().save_load_data({'RS_types_goods': [{'id': '2', 'name': 'Тара'}]})
+        self.assertEqual(2, len(service.get_all_goods_types_data()))
+        self.assertEqual(2, len(service.get_all_goods_types_data()))
+
+        self.assertEqual({'hits': 1, 'misses': 3}, query_cache.stats()['by_name']['get_all_goods_types_data'])
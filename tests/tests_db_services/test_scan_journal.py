@@ -0,0 +1,202 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from db_services import DbCreator, DocService, get_query_result
+from doc_session import DocSession
+from scan_journal import ScanJournal
+from ui_global import Rs_doc, write_scan
+
+
+class TestScanJournal(unittest.TestCase):
+    ean = '4601234567893'
+    mark = '0' + ean + 'tEjE+7q' + 'MRC1' + 'CHK1'
+
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        get_query_result('INSERT INTO RS_types_goods (id, name, use_mark) VALUES ("tg_1", "Табак", 1)')
+        get_query_result('INSERT INTO RS_goods (id, code, name, type_good) VALUES ("good_1", "1", "Сигареты", "tg_1")')
+        get_query_result('INSERT INTO RS_barcodes (barcode, id_good, id_property, id_series, id_unit, ratio) '
+                         'VALUES (?, "good_1", "", "", "unit_1", 1)', (self.ean,))
+        get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse) '
+                         'VALUES ("doc_1", "Приход", "1", "", "", "")')
+
+        Rs_doc.id_doc = 'doc_1'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sut = ScanJournal(path=self.temp_dir.name)
+        # Фоновый поток не запускается: записью в базу управляет тест
+        patcher = patch.object(ScanJournal, '_start_worker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        if self.sut._file:
+            self.sut._file.close()
+        self.temp_dir.cleanup()
+
+    def scan(self, barcode, **kwargs):
+        return Rs_doc.process_the_barcode(Rs_doc, barcode, scan_journal=self.sut, **kwargs)
+
+    @staticmethod
+    def load_page(entries):
+        service = DocService('doc_1')
+        page = service.get_doc_details_page('doc_1', 0, 10)
+        service.add_pending_rows('doc_1', page, ScanJournal.get_pending_rows('doc_1', entries))
+        return page
+
+    def test_scans_are_counted_before_drain(self):
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan) VALUES ("doc_1", "good_1", "", "", "unit_1", 0, 2)')
+
+        for _ in range(2):
+            self.assertIsNone(self.scan(self.ean, have_qtty_plan=True, control=True)['Error'])
+        result = self.scan(self.ean, have_qtty_plan=True, control=True)
+
+        self.assertEqual('QuantityPlanReached', result['Error'])
+        self.assertEqual([(0,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+        self.sut.flush()
+
+        self.assertEqual([(2,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+        self.assertEqual(0, os.path.getsize(self.sut.get_file_path()))
+
+    def test_new_row_is_added_once(self):
+        for _ in range(3):
+            self.assertIsNone(self.scan(self.ean)['Error'])
+
+        self.sut.flush()
+
+        self.assertEqual([(3, 'False')], get_query_result('SELECT qtty, is_plan FROM RS_docs_table'))
+
+    def test_pending_mark_is_already_scanned(self):
+        self.assertIsNone(self.scan(self.mark, use_mark_setting='true')['Error'])
+
+        result = self.scan(self.mark, use_mark_setting='true')
+
+        self.assertEqual('AlreadyScanned', result['Error'])
+        self.assertEqual('1', result['doc_info']['approved'])
+
+        self.sut.flush()
+        self.assertEqual([('1',)], get_query_result('SELECT approved FROM RS_docs_barcodes'))
+        self.assertEqual('AlreadyScanned', self.scan(self.mark, use_mark_setting='true')['Error'])
+
+    def test_scans_are_accepted_while_batch_is_written(self):
+        self.scan(self.ean)
+        appended = []
+
+        def slow_write_scan(*args, **kwargs):
+            # Скан из другого потока во время записи пачки не ждет ее окончания
+            thread = threading.Thread(target=lambda: appended.append(self.scan(self.ean)))
+            thread.start()
+            thread.join(5)
+            write_scan(*args, **kwargs)
+
+        with patch('scan_journal.write_scan', slow_write_scan):
+            self.assertEqual(1, self.sut.drain())
+
+        self.assertEqual(1, len(appended))
+        self.assertEqual(1, self.sut.pending_count())
+        self.sut.flush()
+        self.assertEqual([(2,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+    def test_read_skips_scans_already_written(self):
+        self.scan(self.ean)
+        self.scan(self.ean)
+        entry = self.sut._pending[0]
+        # Пачка записана в базу, но еще не убрана из памяти журнала
+        write_scan('doc_1', entry['row'], entry['qtty'], entry['last_updated'])
+        get_query_result('REPLACE INTO RS_scan_journal (id, last_seq) VALUES (1, ?)', (entry['seq'],))
+
+        entries = self.sut.read(lambda entries: entries)
+
+        self.assertEqual([self.sut._pending[1]], entries)
+        pending_rows = ScanJournal.get_pending_rows('doc_1', entries)
+        self.assertEqual(1, pending_rows[('good_1', '', '')]['qtty'])
+        self.assertTrue(pending_rows[('good_1', '', '')]['new_row'])
+
+    def test_scan_during_batch_write_is_counted_once(self):
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan) VALUES ("doc_1", "good_1", "", "", "unit_1", 0, 3)')
+        self.scan(self.ean, have_qtty_plan=True, control=True)
+        self.scan(self.ean, have_qtty_plan=True, control=True)
+        entry = self.sut._pending[0]
+        # Первый скан уже в базе, пачка еще пишется (не убрана из памяти журнала)
+        self.sut._in_flight_seq = entry['seq']
+        write_scan('doc_1', entry['row'], entry['qtty'], entry['last_updated'])
+        get_query_result('REPLACE INTO RS_scan_journal (id, last_seq) VALUES (1, ?)', (entry['seq'],))
+
+        self.assertIsNone(self.scan(self.ean, have_qtty_plan=True, control=True)['Error'])
+
+    def test_pending_scans_are_sent_before_drain(self):
+        get_query_result('UPDATE RS_docs SET verified = 1')
+        self.scan(self.ean)
+        self.sut.drain()
+        get_query_result('UPDATE RS_docs_table SET sent = 1')
+        self.scan(self.ean)
+        self.scan(self.ean)
+        service = DocService('doc_1')
+
+        res = self.sut.read(lambda entries: service.get_last_edited_goods(
+            pending_rows=ScanJournal.get_pending_rows('doc_1', entries)))
+
+        rows = res[0]['RS_docs_table']
+        self.assertEqual(1, len(rows))
+        self.assertEqual(3, rows[0]['qtty'])
+
+    def test_page_shows_pending_scans(self):
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan, last_updated) VALUES ("doc_1", "good_1", "", "", "unit_1", 0, 5, "")')
+        self.scan(self.ean)
+        self.scan(self.ean)
+        page = self.sut.read(self.load_page)
+
+        self.assertEqual(2, page['rows'][0]['qtty'])
+        self.assertEqual(3, page['rows'][0]['IsDone'])
+        self.assertEqual(2, page['last_scanned']['qtty'])
+
+    def test_page_shows_pending_new_row(self):
+        self.scan(self.ean)
+        page = self.sut.read(self.load_page)
+
+        self.assertEqual([], page['rows'])
+        self.assertEqual('Сигареты', page['last_scanned']['good_name'])
+        self.assertEqual(1, page['last_scanned']['qtty'])
+
+    def test_drain_does_not_reload_session_marks(self):
+        session = DocSession('doc_1')
+        self.sut.add_listener(session)
+        self.scan(self.ean)
+        self.sut.flush()
+        session.load()
+
+        with patch.object(DocSession, '_load_marks', autospec=True, side_effect=DocSession._load_marks) as load:
+            for i in range(5):
+                mark = '0' + self.ean + f'tEjE+{i:02d}' + 'MRC1' + 'CHK1'
+                self.assertIsNone(self.scan(mark, use_mark_setting='true', doc_session=session)['Error'])
+                self.sut.drain()
+
+        self.assertEqual(0, load.call_count)
+        self.assertTrue(session.is_loaded())
+        self.assertEqual(6, session.get_row('good_1', '', 'unit_1')['qtty'])
+        self.assertEqual([(6,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+    def test_recover_applies_only_unapplied_scans(self):
+        self.scan(self.ean)
+        self.sut.drain()
+        self.scan(self.ean)
+        self.scan(self.ean)
+        # Сбой: файл журнала не очищен, в базу записан только первый скан
+        self.sut._file.close()
+        self.sut._file = None
+
+        recovered = ScanJournal(path=self.temp_dir.name)
+        self.assertEqual(2, recovered.recover())
+
+        self.assertEqual([(3,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+        self.assertEqual(0, recovered.recover())
+        recovered._file.close()
@@ -0,0 +1,135 @@
+import unittest
+from unittest.mock import patch
+
+from db_services import DbCreator, BarcodeService, get_query_result
+from doc_session import DocSession
+from ui_global import Rs_doc, get_connection
+from ui_utils import BarcodeParser
+
+
+class TestRsDocProcessTheBarcode(unittest.TestCase):
+    ean = '4601234567893'
+    mark = '0' + ean + 'tEjE+7q' + 'MRC1' + 'CHK1'
+
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        get_query_result('INSERT INTO RS_types_goods (id, name, use_mark) VALUES ("tg_1", "Табак", 1)')
+        get_query_result('INSERT INTO RS_goods (id, code, name, type_good) VALUES ("good_1", "1", "Сигареты", "tg_1")')
+        get_query_result('INSERT INTO RS_barcodes (barcode, id_good, id_property, id_series, id_unit, ratio) '
+                         'VALUES (?, "good_1", "", "", "unit_1", 1)', (self.ean,))
+        get_query_result('INSERT INTO RS_docs (id_doc, doc_type, doc_n, doc_date, id_countragents, id_warehouse) '
+                         'VALUES ("doc_1", "Приход", "1", "", "", "")')
+
+        Rs_doc.id_doc = 'doc_1'
+
+    def test_add_and_increase_qtty(self):
+        for _ in range(2):
+            result = Rs_doc.process_the_barcode(Rs_doc, self.ean)
+            self.assertIsNone(result['Error'])
+
+        rows = get_query_result('SELECT qtty, is_plan FROM RS_docs_table WHERE id_doc = "doc_1"')
+        self.assertEqual([(2, 'False')], rows)
+
+    def test_quantity_plan_reached(self):
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan) VALUES ("doc_1", "good_1", "", "", "unit_1", 1, 1)')
+
+        result = Rs_doc.process_the_barcode(Rs_doc, self.ean, have_qtty_plan=True, control=True)
+
+        self.assertEqual('QuantityPlanReached', result['Error'])
+        self.assertEqual([(1,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+    def test_mark_scanned_once(self):
+        result = Rs_doc.process_the_barcode(Rs_doc, self.mark, use_mark_setting='true')
+        self.assertIsNone(result['Error'])
+
+        result = Rs_doc.process_the_barcode(Rs_doc, self.mark, use_mark_setting='true')
+        self.assertEqual('AlreadyScanned', result['Error'])
+        self.assertEqual(
+            {'id', 'id_doc', 'GTIN', 'Series', 'id_good', 'id_property', 'id_series', 'id_unit', 'is_plan', 'approved'},
+            set(result['doc_info']))
+
+        self.assertEqual([(1,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+    def test_mark_already_scanned_in_session_without_queries(self):
+        doc_session = DocSession('doc_1')
+        result = Rs_doc.process_the_barcode(Rs_doc, self.mark, use_mark_setting='true', doc_session=doc_session)
+        self.assertIsNone(result['Error'])
+
+        statements = []
+        conn = get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            result = Rs_doc.process_the_barcode(Rs_doc, self.mark, use_mark_setting='true', doc_session=doc_session)
+        finally:
+            conn.set_trace_callback(None)
+
+        self.assertEqual('AlreadyScanned', result['Error'])
+        self.assertEqual([], statements)
+        self.assertEqual([(1,)], get_query_result('SELECT qtty FROM RS_docs_table'))
+
+    def test_mark_not_found_with_plan_and_control(self):
+        result = Rs_doc.process_the_barcode(Rs_doc, self.mark, have_mark_plan=True, control=True,
+                                            use_mark_setting='true')
+
+        self.assertEqual('NotFound', result['Error'])
+        self.assertEqual([], get_query_result('SELECT id FROM RS_docs_barcodes'))
+
+    def test_one_query_and_one_transaction_per_scan(self):
+        statements = []
+        conn = get_connection()
+        conn.set_trace_callback(statements.append)
+        try:
+            Rs_doc.process_the_barcode(Rs_doc, self.mark, use_mark_setting='true')
+        finally:
+            conn.set_trace_callback(None)
+
+        selects = [q for q in statements if q.lstrip().upper().startswith('SELECT')]
+        self.assertEqual(1, len(selects))
+        self.assertEqual(['BEGIN', 'COMMIT'], [q for q in statements if q in ('BEGIN', 'COMMIT')])
+
+
+class TestBarcodeServiceBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+
+        for i in range(3):
+            get_query_result('INSERT INTO RS_barcodes (barcode, id_good, id_property, id_series, id_unit, ratio) '
+                             'VALUES (?, ?, "", "", "unit_1", 1)', (f'460000000000{i}', f'good_{i}'))
+        get_query_result('INSERT INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, '
+                         'qtty_plan, is_plan) VALUES ("doc_1", "good_1", "", "", "unit_1", 1, 5, "True")')
+
+        self.sut = BarcodeService()
+
+    def test_batch_data_equal_single_data(self):
+        barcodes_info = [BarcodeParser(barcode).parse(as_dict=False)
+                         for barcode in ('4600000000001', '4600000000009', '4600000000000', '4600000000001')]
+
+        with patch.object(BarcodeService, 'barcodes_chunk_size', 3):
+            actual = self.sut.get_barcodes_data(barcodes_info, 'doc_1')
+
+        expected = [self.sut.get_barcode_data(barcode_info, 'doc_1') for barcode_info in barcodes_info]
+        self.assertEqual(expected, actual)
+        self.assertIsNone(actual[1])
+
+    def test_save_scan_batch(self):
+        row_id = get_query_result('SELECT id FROM RS_docs_table')[0][0]
+        rows = [
+            {'id': row_id, 'id_doc': 'doc_1', 'id_good': 'good_1', 'qtty': 3},
+            {'id': '', 'id_doc': 'doc_1', 'id_good': 'good_2', 'id_properties': '', 'id_series': '',
+             'id_unit': 'unit_1', 'qtty': 1},
+        ]
+        marks = [{'id': 0, 'id_doc': 'doc_1', 'id_good': 'good_1', 'id_property': '', 'id_series': '',
+                  'id_unit': 'unit_1', 'approved': '1', 'gtin': '046', 'series': 's1'}]
+
+        ids = self.sut.save_scan_batch(rows, marks)
+
+        self.assertEqual(row_id, ids[0])
+        self.assertEqual([(row_id, 'good_1', 3, 'True'), (ids[1], 'good_2', 1, 'True')],
+                         get_query_result('SELECT id, id_good, qtty, is_plan FROM RS_docs_table ORDER BY id'))
+        self.assertEqual([('046', 's1', '1')], get_query_result('SELECT GTIN, Series, approved FROM RS_docs_barcodes'))
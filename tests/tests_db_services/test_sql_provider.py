@@ -37,7 +37,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5', 5, '500']])
+        expect = [['id_5', 'id_doc_5', 5, '500']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -51,7 +51,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5', 5, '500'], ['id_5', 'id_doc_5', 5, '500']])
+        expect = [['id_5', 'id_doc_5', 5, '500'], ['id_5', 'id_doc_5', 5, '500']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -71,7 +71,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5', 5, '500']])
+        expect = [['id_5', 'id_doc_5', 5, '500']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -86,7 +86,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5', 5, '500'], ['id_5', 'id_doc_5', 5, '500']])
+        expect = [['id_5', 'id_doc_5', 5, '500'], ['id_5', 'id_doc_5', 5, '500']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -97,7 +97,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5', 5, '500', 'id_5', 'id_doc_5'], ['id_5', 'id_doc_5', 5, '500', 'id_5', 'id_doc_5']])
+        expect = [['id_5', 'id_doc_5', 5, '500', 'id_5', 'id_doc_5'], ['id_5', 'id_doc_5', 5, '500', 'id_5', 'id_doc_5']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -113,7 +113,7 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([[]])
+        expect = [[]]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
@@ -126,13 +126,40 @@ class TestSqlQueryProvider(unittest.TestCase):
         actual = sut.sql_text
         self.assertEqual(expect, actual)
 
-        expect = json.dumps([['id_5', 'id_doc_5']])
+        expect = [['id_5', 'id_doc_5']]
         actual = sut.sql_params
         self.assertEqual(expect, actual)
 
     def test_select(self):
-        # TODO AND create test
-        pass
+        self.sut.table_name = 'Error_log'
+        self.sut.create([{'log': 'first, with comma'}, {'log': 'second'}])
+
+        res = self.sut.select({'log': 'first, with comma'})
+
+        self.assertEqual(1, len(res))
+        self.assertEqual('first, with comma', res[0]['log'])
+
+    def test_sql_query_native_params(self):
+        self.sut.table_name = 'Error_log'
+        self.sut.create({'log': 'a,b'})
+
+        q = 'SELECT log FROM Error_log WHERE log = ?'
+
+        self.assertEqual([{'log': 'a,b'}], self.sut.sql_query(q, 'a,b'))
+        self.assertEqual([{'log': 'a,b'}], self.sut.sql_query(q, ('a,b',)))
+
+    def test_bridge_params_serialization(self):
+        sql_class = MagicMock()
+        sql_class.SQLQuery.return_value = '[]'
+        sut = SqlQueryProvider(table_name='Error_log', sql_class=sql_class, use_bridge=True)
+
+        sut.create({'log': 'test'})
+        sql_class.SQLExecMany.assert_called_once_with(
+            'INSERT INTO Error_log (log) VALUES (?)', json.dumps([['test']]))
+
+        sut.sql_query('SELECT * FROM Error_log WHERE log = ? AND timestamp = ?', ('test', '1'))
+        sql_class.SQLQuery.assert_called_once_with(
+            'SELECT * FROM Error_log WHERE log = ? AND timestamp = ?', 'test,1')
 
     def test_sql_query(self):
         self.sut.table_name = 'Error_log'
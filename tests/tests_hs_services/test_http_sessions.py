@@ -0,0 +1,70 @@
+import threading
+import unittest
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hs_services import DebugService, HttpSessionPool
+import hs_services
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpSessionPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.pool = HttpSessionPool()
+        self.default_pool = hs_services.http_sessions
+        hs_services.http_sessions = self.pool
+
+    def tearDown(self) -> None:
+        hs_services.http_sessions = self.default_pool
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        service = DebugService('127.0.0.1', port=self.server.server_port)
+        for _ in range(3):
+            self.assertEqual(service.export_log({'stage': 'total'})['status_code'], 200)
+        DebugService('127.0.0.1', port=self.server.server_port).export_log({})
+
+        self.assertEqual(self.pool.stats(), {'sessions': 1, 'requests': 4, 'connections': 1, 'reused': 3})
+
+    def test_no_keep_alive(self):
+        self.pool.configure(keep_alive=False)
+        service = DebugService('127.0.0.1', port=self.server.server_port)
+        for _ in range(2):
+            service.export_log({})
+
+        self.assertEqual(self.pool.stats()['connections'], 2)
+
+    def test_session_per_credentials(self):
+        session = self.pool.get_session('http://host', ('user', 'pass'))
+
+        self.assertIs(self.pool.get_session('http://host', ('user', 'pass')), session)
+        self.assertIsNot(self.pool.get_session('http://host', ('user', 'other')), session)
+        self.assertEqual(session.auth.username, 'user')
+
+    def test_default_timeout_does_not_limit_reading(self):
+        session = self.pool.get_session('http://host')
+        with patch.object(session, 'request') as request:
+            self.pool.request('GET', 'http://host/data', 'http://host')
+            self.pool.request('GET', 'http://host/data', 'http://host', timeout=1)
+
+        self.assertEqual((5, None), request.call_args_list[0].kwargs['timeout'])
+        self.assertEqual(1, request.call_args_list[1].kwargs['timeout'])
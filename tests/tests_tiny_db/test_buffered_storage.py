@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from tiny_db_services import TinyNoSQLProvider, BufferedJSONStorage
+
+
+class TestBufferedJSONStorage(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'SimpleKeep.json')
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def get_provider(self, **kwargs):
+        return TinyNoSQLProvider(table_name='test_table', db_path=self.temp_dir.name, buffered=True, **kwargs)
+
+    def read_file(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_flush_by_operations_count(self):
+        provider = self.get_provider(flush_ops=3, flush_interval=60)
+
+        provider.insert({'row_id': 1})
+        provider.insert({'row_id': 2})
+        self.assertEqual(provider.count(row_id=2), 1)
+        self.assertEqual(self.read_file(), {})
+
+        provider.insert({'row_id': 3})
+        self.assertEqual(len(self.read_file()['test_table']), 3)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        provider.close()
+
+    def test_flush_on_close_and_reopen(self):
+        provider = self.get_provider(flush_ops=100, flush_interval=60)
+        provider.insert_multiple([{'row_id': 1}, {'row_id': 2}])
+        provider.update({'qtty': 5}, row_id=2)
+        provider.close()
+
+        provider = self.get_provider()
+        self.assertEqual(provider.get(row_id=2), {'row_id': 2, 'qtty': 5})
+        provider.close()
+
+    def test_flush_all(self):
+        provider = self.get_provider(flush_ops=100, flush_interval=60)
+        provider.insert({'row_id': 1})
+
+        BufferedJSONStorage.flush_all()
+
+        self.assertEqual(len(self.read_file()['test_table']), 1)
+        provider.close()
+
+    def test_changes_hold_storage_lock(self):
+        provider = self.get_provider(flush_ops=100, flush_interval=60)
+        insert, locked = provider.table.insert, []
+
+        def insert_while_flushing(document):
+            # flush по таймеру идет в другом потоке и не должен получить словарь в середине изменения
+            thread = threading.Thread(target=lambda: locked.append(not provider.db.storage.lock.acquire(timeout=0.05)))
+            thread.start()
+            thread.join()
+            return insert(document)
+
+        provider.table.insert = insert_while_flushing
+        provider.insert({'row_id': 1})
+
+        self.assertEqual([True], locked)
+        provider.close()
+        self.assertEqual(len(self.read_file()['test_table']), 1)
@@ -0,0 +1,182 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from db_services import BarcodeService, DbCreator, get_query_result
+from ui_global import bulk_query
+from tiny_db_services import SqliteQueueProvider, ScanningQueueService, rs_settings
+
+
+class TestSqliteQueueProvider(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+        self.provider = SqliteQueueProvider()
+
+    def test_must_insert_and_search_data(self):
+        row = {'id_doc': '123', 'row_id': 5, 'test_data': 'test_data', 'sent': False}
+
+        self.assertEqual(self.provider.insert(row), 1)
+        self.assertEqual(self.provider.insert_multiple([row, row]), [2, 3])
+
+        self.assertEqual(self.provider.get(row_id=5), row)
+        self.assertEqual(self.provider.search(id_doc='123', sent=False), [row] * 3)
+        self.assertEqual(self.provider.count(id_doc='123'), 3)
+        self.assertEqual(self.provider.count(test_data='test_data'), 3)
+        self.assertEqual(self.provider.search(id_doc='123', test_data='other'), [])
+
+    def test_must_update_and_remove_data(self):
+        self.provider.insert_multiple([
+            {'id_doc': '123', 'row_id': 5, 'sent': False},
+            {'id_doc': '123', 'row_id': 6, 'sent': False},
+        ])
+
+        self.provider.update({'sent': True}, id_doc='123', row_id=5)
+        self.assertEqual(self.provider.search(id_doc='123', sent=False), [{'id_doc': '123', 'row_id': 6, 'sent': False}])
+        self.assertEqual(self.provider.count(sent=True), 1)
+
+        self.provider.remove(id_doc='123', row_id=6)
+        self.assertEqual(self.provider.get_all(), [{'id_doc': '123', 'row_id': 5, 'sent': True}])
+
+    def test_filters_by_index(self):
+        self.provider.insert({'id_doc': '123', 'row_id': 5, 'sent': False})
+
+        plan = get_query_result('EXPLAIN QUERY PLAN SELECT id, data FROM RS_scanning_queue '
+                                'WHERE id_doc = ? AND sent = ?', ('123', 0))
+        self.assertIn('scanning_queue_doc_sent', ' '.join(str(row[-1]) for row in plan))
+
+
+class TestScanningQueueServiceSqlite(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+        self.sut = ScanningQueueService()
+
+    def test_save_and_get_scanned_row_qtty(self):
+        self.assertEqual(self.sut.save_scanned_row_data({'id_doc': '123', 'row_id': 6, 'qtty': 3}), 1)
+        self.sut.save_scanned_rows_data([{'id_doc': '123', 'row_id': 6, 'qtty': 4},
+                                         {'id_doc': '123', 'row_id': 7, 'qtty': 1}])
+
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=6), 7)
+        self.assertEqual(len(self.sut.get_send_document_lines('123')), 3)
+
+    def test_barcode_worker_rows_are_counted(self):
+        # Запись очереди в том виде, в каком ее пишет BarcodeWorker._insert_queue_data
+        queue_row = {'id_doc': 'doc_1', 'id_good': 'good_1', 'id_properties': '', 'id_series': '',
+                     'id_unit': 'unit_1', 'id_cell': '', 'd_qtty': 3, 'row_key': 17, 'sent': False}
+        BarcodeService.insert_no_sql(dict(queue_row))
+        BarcodeService.insert_no_sql_many([dict(queue_row)])
+
+        self.assertEqual([('doc_1', '17', 6)], get_query_result('SELECT * FROM RS_scanning_queue_rows'))
+        self.assertEqual(6, self.sut.get_scanned_row_qtty('doc_1', 17))
+        self.assertEqual(2, self.sut.provider.count(id_doc='doc_1', row_key=17))
+
+    def test_migrate_from_tiny_db(self):
+        rs_settings.put('scan_queue_migrated', None, True)
+        tiny_provider = MagicMock(table_name='scanning_queue')
+        tiny_provider.get_all.return_value = [{'id_doc': '123', 'row_id': 6, 'qtty': 2, 'sent': False}]
+
+        self.assertEqual(self.sut.migrate_from_tiny_db(tiny_provider), 1)
+
+        tiny_provider.drop_table.assert_called_once_with('scanning_queue')
+        tiny_provider.close.assert_called_once()
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=6), 2)
+
+    def test_migration_is_not_repeated_after_crash(self):
+        rs_settings.put('scan_queue_migrated', None, True)
+        tiny_provider = MagicMock(table_name='scanning_queue')
+        tiny_provider.get_all.return_value = [{'id_doc': '123', 'row_id': 6, 'qtty': 2, 'sent': False}]
+        tiny_provider.drop_table.side_effect = RuntimeError('crash')
+
+        with self.assertRaises(RuntimeError):
+            self.sut.migrate_from_tiny_db(tiny_provider)
+        tiny_provider.drop_table.side_effect = None
+
+        self.assertEqual(self.sut.migrate_from_tiny_db(tiny_provider), 0)
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=6), 2)
+
+        with patch('tiny_db_services.TinyNoSQLProvider') as tiny_provider_mock:
+            self.assertEqual(self.sut.migrate_from_tiny_db(), 0)
+        tiny_provider_mock.assert_not_called()
+
+    def test_scanned_row_qtty_follows_changes(self):
+        self.sut.save_scanned_rows_data([{'id_doc': '123', 'row_id': 6, 'qtty': 3},
+                                         {'id_doc': '123', 'row_id': 6, 'qtty': -1},
+                                         {'id_doc': '123', 'qtty': 5}])
+
+        self.sut.provider.update({'row_id': 7}, id_doc='123', qtty=-1)
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=6), 3)
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=7), -1)
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=None), 5)
+
+        self.sut.provider.remove(id_doc='123', row_id=6)
+        self.assertEqual(self.sut.get_scanned_row_qtty(id_doc='123', row_id=6), 0)
+
+    def test_update_sent_lines(self):
+        self.sut.save_scanned_rows_data([{'id_doc': '123', 'row_id': i, 'qtty': 1} for i in range(5)])
+        lines = self.sut.get_send_document_lines('123')
+
+        with patch('tiny_db_services.bulk_query', wraps=bulk_query) as bulk_query_mock:
+            self.sut.update_sent_lines(lines[:3])
+
+        self.assertEqual(bulk_query_mock.call_count, 1)
+        self.assertEqual([row['row_id'] for row in self.sut.get_send_document_lines('123')], [3, 4])
+        self.assertEqual(self.sut.provider.count(id_doc='123', sent=True), 3)
+
+    def test_rows_added_during_send_stay_unsent(self):
+        self.sut.save_scanned_rows_data([{'id_doc': '123', 'row_key': 1, 'd_qtty': 1}])
+        lines = self.sut.get_send_document_lines('123')
+        self.sut.save_scanned_row_data({'id_doc': '123', 'row_key': 1, 'd_qtty': 2})
+
+        self.sut.update_sent_lines(lines)
+
+        self.assertEqual(self.sut.get_send_document_lines('123'), [{'id_doc': '123', 'row_key': 1, 'd_qtty': 2,
+                                                                    'sent': False}])
+        self.assertEqual(self.sut.get_scanned_row_qtty('123', 1), 3)
+
+
+class TestScanningQueueCompaction(unittest.TestCase):
+    def setUp(self) -> None:
+        service = DbCreator()
+        service.drop_all_tables()
+        service.create_tables()
+        self.sut = ScanningQueueService()
+
+    def queue_row(self, row_key, d_qtty, sent=False):
+        return {'id_doc': '123', 'id_good': 'good_1', 'id_properties': '', 'id_series': '', 'id_unit': 'unit_1',
+                'id_cell': '', 'd_qtty': d_qtty, 'row_key': row_key, 'sent': sent}
+
+    def test_sent_rows_are_folded(self):
+        self.sut.save_scanned_rows_data([self.queue_row('1', 1), self.queue_row('1', 2), self.queue_row('2', 1)],
+                                        sent=True)
+        self.sut.save_scanned_row_data(self.queue_row('1', 5))
+
+        result = self.sut.compact()
+
+        self.assertEqual((result['expired'], result['folded'], result['rows']), (0, 2, 3))
+        self.assertEqual(self.sut.provider.search(id_doc='123', row_key='1', sent=True), [self.queue_row('1', 3, True)])
+        self.assertEqual(self.sut.get_send_document_lines('123'), [self.queue_row('1', 5)])
+
+    def test_old_sent_rows_are_removed(self):
+        self.sut.save_scanned_rows_data([self.queue_row('1', 1), self.queue_row('2', 1)], sent=True)
+        self.sut.save_scanned_row_data(self.queue_row('3', 1))
+        get_query_result("UPDATE RS_scanning_queue SET created_at = created_at - 8 * 24 * 3600 "
+                         "WHERE data LIKE '%\"row_key\": \"1\"%' OR sent = 0")
+
+        result = self.sut.compact(retention_days=7)
+
+        self.assertEqual(result['expired'], 1)
+        self.assertEqual([row['row_key'] for row in self.sut.provider.get_all()], ['2', '3'])
+        self.assertEqual(ScanningQueueService.compaction_stats['rows'], 2)
+
+    def test_queue_is_removed_with_document(self):
+        from db_services import DocService
+
+        self.sut.save_scanned_row_data(self.queue_row('1', 1))
+        self.sut.save_scanned_row_data(dict(self.queue_row('1', 1), id_doc='456'))
+
+        DocService().delete_doc('123')
+
+        self.assertEqual(self.sut.provider.count(id_doc='123'), 0)
+        self.assertEqual(self.sut.provider.count(id_doc='456'), 1)
@@ -145,6 +145,18 @@ class TestScanningQueueService(unittest.TestCase):
         result = sut.get_scanned_row_qtty(id_doc='123', row_id=6)
         self.assertEqual(result, 6)
 
+    def test_update_sent_lines(self):
+        initial_data = [
+            {'id_doc': '123', 'row_id': 5, 'sent': False},
+            {'id_doc': '123', 'row_id': 6, 'sent': False},
+            {'id_doc': '123', 'row_id': 7, 'sent': False}
+        ]
+
+        self.provider.insert_multiple(initial_data)
+        sut = ScanningQueueService(provider=self.provider)
+        sut.update_sent_lines(sut.get_send_document_lines(id_doc='123')[:2])
+        self.assertEqual(sut.get_send_document_lines(id_doc='123'), [{'id_doc': '123', 'row_id': 7, 'sent': False}])
+
     def test_get_send_document_lines(self):
         from tests.data_for_tests.nosql.initial_data import initial_data
         expect = [
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 import json
 import os
 
@@ -7,7 +7,8 @@ from ui_models import Timer
 from ui_utils import HashMap
 from main import noClass
 from hs_services import HsService
-from db_services import DocService
+from db_services import DocService, DbCreator, TimerService
+from tiny_db_services import ScanningQueueService
 
 from data_for_tests.utils_for_tests import hashMap
 
@@ -47,6 +48,22 @@ class TestMainEvents(unittest.TestCase):
         DocService.update_data_from_json.assert_called_once()
         self.assertIsNone(self.rs_settings.get('notification_id'))
 
+    def test_upload_marks_scanning_queue_sent(self):
+        DbCreator().create_tables()
+        queue_service = ScanningQueueService()
+        queue_service.provider.remove(id_doc='doc_1')
+        queue_service.save_scanned_row_data({'id_doc': 'doc_1', 'row_key': 1, 'd_qtty': 1})
+        self.sut.http_service = MagicMock()
+        self.sut.http_service.send_data.return_value = MagicMock(error=False)
+        self.sut.db_service = MagicMock()
+
+        with patch.object(self.sut, '_check_http_settings', return_value=True), \
+                patch.object(TimerService, 'iter_data_to_send', return_value=iter([[{'id_doc': 'doc_1'}]])):
+            self.sut._upload_data()
+
+        self.assertEqual(queue_service.get_send_document_lines('doc_1'), [])
+        self.assertEqual(queue_service.provider.count(id_doc='doc_1', sent=True), 1)
+
     def get_load_data(self):
         with open(f'{self.data_path}/nsi_data.json', encoding='utf-8') as fp:
             return json.load(fp)
@@ -0,0 +1,74 @@
+import unittest
+
+from barcode_cache import BarcodeCache
+from query_cache import query_cache
+from ui_utils import BarcodeParser
+
+
+class TestBarcodeCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sut = BarcodeCache(max_size=2)
+        self.calls = []
+
+    def parser(self, barcode):
+        self.calls.append(barcode)
+        return {'SCHEME': 'EAN13', 'BARCODE': barcode}
+
+    def test_parse_result_is_cached_and_copied(self):
+        first = self.sut.parse('test', '2000000058177', self.parser)
+        first['SCHEME'] = 'changed'
+        second = self.sut.parse('test', '2000000058177', self.parser)
+
+        self.assertEqual(['2000000058177'], self.calls)
+        self.assertEqual('EAN13', second['SCHEME'])
+        self.assertEqual(1, self.sut.stats()['parse_hits'])
+
+    def test_application_identifiers_are_copied(self):
+        first = self.sut.parse('test', '2000000058177', BarcodeParser.parse_barcode_info)
+        first.ai['01'] = 'changed'
+        second = self.sut.parse('test', '2000000058177', self.parser)
+
+        self.assertIsNot(first.ai, second.ai)
+        self.assertNotIn('01', second.ai)
+
+    def test_mark_codes_bypass_cache(self):
+        mark = '0104601234567893215Qbag!{}93Zjqw'.format(chr(29))
+
+        self.sut.parse('test', mark, self.parser)
+        self.sut.parse('test', mark, self.parser)
+        self.sut.parse('test', '00000046198488X?io+qCABm8wAYa', self.parser)
+
+        self.assertEqual(3, len(self.calls))
+        self.assertEqual(0, self.sut.stats()['parsed'])
+
+    def test_lru_eviction(self):
+        for barcode in ('1', '2', '1', '3', '1', '2'):
+            self.sut.parse('test', barcode, self.parser)
+
+        self.assertEqual(['1', '2', '3', '2'], self.calls)
+
+    def test_resolution_invalidated_on_reload(self):
+        resolution = {'id_good': 'g', 'id_property': '', 'id_series': '', 'id_unit': 'u', 'ratio': 1,
+                      'use_mark': 0, 'name': 'not cached'}
+
+        def loader():
+            self.calls.append('load')
+            return resolution
+
+        self.assertEqual('g', self.sut.resolve('2000000058177', loader)['id_good'])
+        self.assertNotIn('name', self.sut.resolve('2000000058177', loader))
+        self.assertEqual(1, len(self.calls))
+
+        for table_name in self.sut.resolution_tables:
+            query_cache.bump(table_name)
+            self.sut.resolve('2000000058177', loader)
+
+        self.assertEqual(4, len(self.calls))
+
+    def test_not_found_is_cached(self):
+        def loader():
+            self.calls.append('load')
+
+        self.assertIsNone(self.sut.resolve('404', loader))
+        self.assertIsNone(self.sut.resolve('404', loader))
+        self.assertEqual(1, len(self.calls))
@@ -1,8 +1,8 @@
 import unittest
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from ui_utils import BarcodeParser, BarcodeWorker
-from ui_barcodes import parse_barcode
+from ui_barcodes import parse_barcode, split_mark_codes
 from java import jclass
 
 noClass = jclass("ru.travelfood.simple_ui.NoSQL")
@@ -362,6 +362,67 @@ class TestBarcodeParser(unittest.TestCase):
         self.assertEqual(expect, actual)
 
 
+    def test_pharma_with_expiry_batch_and_decimal_ai(self):
+        barcode = '0104601234567893172512311012AB{}21SER1{}3102001250{}3922199'.format(
+            self.gs1, self.gs1, self.gs1)
+
+        actual = self.sut(barcode=barcode).parse(as_dict=False)
+
+        self.assertEqual('', actual.error)
+        self.assertEqual('04601234567893', actual.gtin)
+        self.assertEqual('251231', actual.expiry)
+        self.assertEqual('12AB', actual.batch)
+        self.assertEqual('SER1', actual.serial)
+        self.assertEqual('001250', actual.weight)
+        self.assertEqual(['01', '17', '10', '21', '3102', '3922'], list(actual.ai))
+        self.assertEqual('12.50', actual.decimal('3102'))
+        self.assertEqual('1.99', actual.decimal('3922'))
+        self.assertNotIn('AI', actual.dict())
+
+    def test_unknown_ai(self):
+        barcode = '0104601234567893{}77abc'.format(self.gs1)
+
+        actual = self.sut(barcode=barcode).parse()
+
+        self.assertEqual('INVALID BARCODE', actual['ERROR'])
+        self.assertEqual('04601234567893', actual['GTIN'])
+
+    def test_gs_placeholder(self):
+        actual = self.sut(barcode='0104601234567893215Qbag!<GS>93Zjqw').parse()
+
+        self.assertEqual('5Qbag!', actual['SERIAL'])
+        self.assertEqual('Zjqw', actual['CHECK'])
+
+
+class TestUiBarcodesParseBarcode(unittest.TestCase):
+    def test_fields_do_not_leak_between_scans(self):
+        gs1 = chr(29)
+        parse_barcode('0104601234567893172512311012AB{}21SER1{}93Zjqw'.format(gs1, gs1))
+
+        actual = parse_barcode('0103041094787443215Qbag!{}93Zjqw'.format(gs1))
+
+        self.assertEqual({'SCHEME', 'GTIN', 'SERIAL', 'CHECK', 'FullCode'}, set(actual))
+        self.assertEqual('03041094787443', actual['GTIN'])
+
+    def test_tobacco_block(self):
+        gs1 = chr(29)
+        actual = parse_barcode('010460043993125621JgXJ5.T{}8005112000{}93Mdlr'.format(gs1, gs1))
+
+        self.assertEqual('112000', actual['NHRN'])
+        self.assertEqual('JgXJ5.T', actual['SERIAL'])
+
+
+class TestSplitMarkCodes(unittest.TestCase):
+    def test_mark_codes(self):
+        marks = ['010462007052044121tEjE+7qAAAAXi6n', '04620070520441tEjE+7qAAAAXi6n', '0104620070520441',
+                 '010462007052044121tEjE+7q{}93AAAA'.format(chr(29)), None]
+
+        actual = list(split_mark_codes(marks))
+
+        self.assertEqual([('04620070520441', 'tEjE+7qAAAAXi6n'), ('04620070520441', 'tEjE+7qAAAAXi6n'), ('', ''),
+                          ('04620070520441', 'tEjE+7q'), ('', '')], actual)
+
+
 class TestBarcodeWorker(unittest.TestCase):
     def setUp(self) -> None:
         rs_settings.put("path_to_databases", "./", True)
@@ -385,10 +446,10 @@ class TestBarcodeWorker(unittest.TestCase):
         sut = BarcodeWorker(id_doc)
         parser = BarcodeParser(barcode)
         barcode_info = parser.BarcodeInfo(error='error')
-        BarcodeParser.parse = MagicMock(return_value=barcode_info)
         sut._get_barcode_data = MagicMock(return_value={})
 
-        result = sut.process_the_barcode(barcode)
+        with patch.object(BarcodeParser, 'parse', return_value=barcode_info):
+            result = sut.process_the_barcode(barcode)
 
         self.assertTrue(type(result), BarcodeWorker.ProcessTheBarcodeResult)
         self.assertTrue(result.error, 'Invalid barcode')
@@ -675,3 +736,87 @@ class TestBarcodeWorker(unittest.TestCase):
 
         sut.process_the_barcode(barcode)
         result = sut.update_document_barcode_data()
+
+
+class TestBarcodeWorkerBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.id_doc = '96e94835-f8a0-11ed-a290-8babe363837e'
+        self.barcode_data = {
+            'id_good': 'baf54db7-7029-11e6-accf-0050568b35ac',
+            'id_property': 'c3d2a493-7026-11e6-accf-0050568b35ac',
+            'id_series': 'c3d2a493-7026-11e6-accf-0050568b35ac',
+            'id_unit': 'c3d2a493-7026-11e6-accf-0050568b35ac',
+            'ratio': 2,
+            'approved': '',
+            'mark_id': '',
+            'use_mark': False,
+            'row_key': 1,
+            'qtty': 1,
+            'qtty_plan': 5,
+        }
+
+    def get_sut(self, barcodes_data, **kwargs):
+        sut = BarcodeWorker(self.id_doc, **kwargs)
+        sut.db_service = MagicMock()
+        sut.db_service.get_barcodes_data = MagicMock(return_value=barcodes_data)
+        sut.db_service.save_scan_batch = MagicMock(side_effect=lambda rows, marks: [10 + i for i in range(len(rows))])
+        return sut
+
+    def test_quantity_is_accumulated_in_batch(self):
+        barcode = '2000000025988'
+        sut = self.get_sut([dict(self.barcode_data) for _ in range(3)], have_qtty_plan=True, use_scanning_queue=True)
+        rs_settings.put("use_mark", "false", False)
+
+        results = sut.process_barcodes([barcode] * 3)
+
+        self.assertEqual(['', '', 'Quantity plan reached'], [result.error for result in results])
+        rows, marks = sut.db_service.save_scan_batch.call_args[0]
+        self.assertEqual(1, len(rows))
+        self.assertEqual(5, rows[0]['qtty'])
+        self.assertEqual([], marks)
+
+        queue_rows = sut.db_service.insert_no_sql_many.call_args[0][0]
+        self.assertEqual([2, 2], [row['d_qtty'] for row in queue_rows])
+
+    def test_results_keep_order(self):
+        new_row_data = dict(self.barcode_data, row_key='', qtty=0.0, qtty_plan=0.0)
+        sut = self.get_sut([None, new_row_data])
+        rs_settings.put("use_mark", "false", False)
+
+        results = sut.process_barcodes(['2000000025988', '2000000058177'])
+
+        self.assertEqual(['2000000025988', '2000000058177'], [result.barcode for result in results])
+        self.assertEqual(['Not found', ''], [result.error for result in results])
+        self.assertEqual(10, results[1].row_key)
+        sut.db_service.get_barcodes_data.assert_called_once()
+
+    def test_queue_failure_rolls_back_batch(self):
+        from db_services import BarcodeService, DbCreator, get_query_result
+
+        DbCreator().create_tables()
+        get_query_result('DELETE FROM RS_docs_table WHERE id_doc = ?', (self.id_doc,))
+        new_row_data = dict(self.barcode_data, row_key='', qtty=0.0, qtty_plan=0.0)
+        sut = self.get_sut([new_row_data], use_scanning_queue=True)
+        sut.db_service.save_scan_batch = MagicMock(side_effect=BarcodeService.save_scan_batch)
+        sut.db_service.insert_no_sql_many = MagicMock(side_effect=RuntimeError('queue'))
+        rs_settings.put("use_mark", "false", False)
+
+        with self.assertRaises(RuntimeError):
+            sut.process_barcodes(['2000000058177'])
+
+        sut.db_service.save_scan_batch.assert_called_once()
+        self.assertEqual([(0,)], get_query_result('SELECT COUNT(*) FROM RS_docs_table WHERE id_doc = ?',
+                                                  (self.id_doc,)))
+
+    def test_mark_scanned_once_in_batch(self):
+        barcode = '00000046198488X?io+qCABm8wAYa'
+        mark_data = dict(self.barcode_data, use_mark=True, qtty_plan=100)
+        sut = self.get_sut([dict(mark_data), dict(mark_data)])
+        rs_settings.put("use_mark", "true", True)
+
+        results = sut.process_barcodes([barcode, barcode])
+
+        self.assertEqual(['', 'Already scanned'], [result.error for result in results])
+        rows, marks = sut.db_service.save_scan_batch.call_args[0]
+        self.assertEqual(1, len(marks))
+        self.assertEqual(3, rows[0]['qtty'])
@@ -0,0 +1,57 @@
+import unittest
+
+from scan_metrics import ScanMetrics
+
+
+class TestScanMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sut = ScanMetrics(window_size=100)
+
+    def test_percentiles(self):
+        for duration in range(1, 101):
+            self.sut.add('db_lookup', duration)
+
+        stats = self.sut.stats()['db_lookup']
+
+        self.assertEqual(100, stats['count'])
+        self.assertEqual(50, stats['p50'])
+        self.assertEqual(95, stats['p95'])
+        self.assertEqual(99, stats['p99'])
+        self.assertEqual(100, stats['max'])
+
+    def test_rolling_window(self):
+        for duration in range(200):
+            self.sut.add('parse', duration)
+
+        stats = self.sut.stats()['parse']
+
+        self.assertEqual(100, stats['count'])
+        self.assertEqual(149, stats['p50'])
+
+    def test_measure_and_timed(self):
+        @self.sut.timed('on_start')
+        def on_start():
+            return 'result'
+
+        with self.sut.measure('parse'):
+            pass
+        with self.assertRaises(ValueError):
+            with self.sut.measure('parse'):
+                raise ValueError
+
+        self.assertEqual('result', on_start())
+        stats = self.sut.stats()
+        self.assertEqual(['parse', 'on_start'], list(stats))
+        self.assertEqual(2, stats['parse']['count'])
+
+    def test_report_and_export(self):
+        self.assertEqual('Нет данных о времени сканирования', self.sut.report())
+
+        self.sut.add('http_post', 10)
+        self.sut.add('total', 20)
+
+        self.assertEqual(['total', 'http_post'], [row['stage'] for row in self.sut.export_data()])
+        self.assertIn('Отправка на сервер: 1 шт, p50 10 / p95 10 / p99 10 мс', self.sut.report())
+
+        self.sut.reset()
+        self.assertEqual({}, self.sut.stats())
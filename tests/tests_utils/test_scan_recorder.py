@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from java import jclass
+
+from scan_recorder import ScanRecorder
+from ui_utils import BarcodeWorker
+
+noClass = jclass("ru.travelfood.simple_ui.NoSQL")
+rs_settings = noClass("rs_settings")
+
+
+class TestScanRecorder(unittest.TestCase):
+    def setUp(self) -> None:
+        self.path = tempfile.mkdtemp()
+        self.sut = ScanRecorder(self.path)
+        rs_settings.put('record_scan_sessions', 'true', True)
+
+    def tearDown(self) -> None:
+        rs_settings.put('record_scan_sessions', 'false', True)
+        shutil.rmtree(self.path)
+
+    def test_record_and_load(self):
+        self.sut.record('doc/1', 'worker', ['4600000000001'], {'control': True}, 1.23456, [''])
+        self.sut.record('doc/1', 'worker_batch', ['1', '2'], {'control': True}, 2, ['Invalid barcode', ''])
+
+        file_path = self.sut.get_file_path('doc/1')
+        self.assertEqual([file_path], self.sut.get_files())
+        self.assertEqual(os.path.join(self.path, 'scan_sessions', 'doc_1.jsonl'), file_path)
+
+        records = ScanRecorder.load(file_path)
+        self.assertEqual(['worker', 'worker_batch'], [record['mode'] for record in records])
+        self.assertEqual(1.235, records[0]['duration_ms'])
+        self.assertEqual(['Invalid barcode', ''], records[1]['errors'])
+
+    def test_disabled(self):
+        rs_settings.put('record_scan_sessions', 'false', True)
+        self.sut.record('doc_1', 'worker', ['4600000000001'], {}, 1, [''])
+
+        self.assertEqual([], self.sut.get_files())
+
+    def test_barcode_worker_records_scan(self):
+        rs_settings.put('path_to_databases', self.path, True)
+        worker = BarcodeWorker('doc_1', control=True)
+
+        result = worker.process_the_barcode('invalid')
+
+        records = ScanRecorder.load(ScanRecorder().get_file_path('doc_1'))
+        self.assertEqual(1, len(records))
+        self.assertEqual(['invalid'], records[0]['barcodes'])
+        self.assertTrue(records[0]['flags']['control'])
+        self.assertEqual([result.error], records[0]['errors'])
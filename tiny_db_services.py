@@ -1,26 +1,121 @@
+import json
 import os
+import threading
+import time
+import weakref
 from typing import List, Union, Dict
 from functools import reduce
 from tinydb import TinyDB, Query, where
+from tinydb.storages import Storage
 
 from java import jclass
+from ui_global import get_query_result, bulk_query, transaction
 
 
 noClass = jclass("ru.travelfood.simple_ui.NoSQL")
 rs_settings = noClass("rs_settings")
 
 
+class BufferedJSONStorage(Storage):
+    """
+    Хранилище TinyDB, которое держит все документы в памяти. JSONStorage по умолчанию сериализует
+    и синхронизирует с диском весь файл при каждом insert/update/upsert/remove, это хранилище -
+    после flush_ops изменений, через flush_interval секунд после первого незаписанного изменения,
+    при close() и при выходе из приложения (flush_all, on_close_app).
+    Файл пишется во временный и переименовывается (os.replace): после сбоя на диске остается
+    либо прежняя, либо новая версия целиком, теряются только изменения после последней записи.
+    TinyDB меняет словарь из read() до вызова write(): изменяющие методы TinyNoSQLProvider держат self.lock,
+    поэтому flush (в том числе по таймеру) не видит словарь в середине изменения
+    """
+
+    _storages = weakref.WeakSet()
+
+    def __init__(self, path: str, flush_ops=100, flush_interval=5.0, encoding='utf-8', **kwargs):
+        super().__init__()
+        self.path = path
+        self.flush_ops = flush_ops
+        self.flush_interval = flush_interval
+        self.encoding = encoding
+        self.kwargs = kwargs
+        self.lock = threading.RLock()
+        self._data = None
+        self._loaded = False
+        self._ops = 0
+        self._timer = None
+        self._storages.add(self)
+
+    def read(self):
+        with self.lock:
+            if not self._loaded:
+                self._data = self._load()
+                self._loaded = True
+            return self._data
+
+    def write(self, data):
+        with self.lock:
+            self._data = data
+            self._loaded = True
+            self._ops += 1
+            if self._ops >= self.flush_ops or not self.flush_interval:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._ops:
+                return
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding=self.encoding) as f:
+                f.write(json.dumps(self._data, **self.kwargs))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._ops = 0
+
+    def close(self):
+        self.flush()
+        self._storages.discard(self)
+
+    @classmethod
+    def flush_all(cls):
+        for storage in list(cls._storages):
+            storage.flush()
+
+    def _load(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return None
+        with open(self.path, encoding=self.encoding) as f:
+            return json.load(f)
+
+
 class TinyNoSQLProvider:
-    def __init__(self, table_name, base_name='SimpleKeep', db_path=''):
+    def __init__(self, table_name, base_name='SimpleKeep', db_path='', buffered=False, flush_ops=100,
+                 flush_interval=5.0):
+        """buffered - хранить базу в памяти и записывать на диск пачкой изменений (BufferedJSONStorage)"""
+
         self.table_name = table_name
         self.base_name = base_name or rs_settings.get('sqlite_name')
         self.db_path = db_path or rs_settings.get('path_to_databases')
-        self.db = TinyDB(os.path.join(self.db_path, f'{self.base_name}.json'))
+        path = os.path.join(self.db_path, f'{self.base_name}.json')
+        if buffered:
+            self.db = TinyDB(path, storage=BufferedJSONStorage, flush_ops=flush_ops, flush_interval=flush_interval)
+        else:
+            self.db = TinyDB(path)
         self.table = self.db.table(self.table_name)
         self.query = Query()
+        # Изменения выполняются под блокировкой буферизованного хранилища (запись на диск по таймеру)
+        self.lock = getattr(self.db.storage, 'lock', None) or threading.RLock()
 
     def drop_table(self, table_name):
-        self.db.drop_table(table_name)
+        with self.lock:
+            self.db.drop_table(table_name)
 
     def get_all(self) -> list:
         return self.table.all()
@@ -32,10 +127,12 @@ class TinyNoSQLProvider:
         return self.table.search(cond=self._create_condition(**cond))
 
     def insert(self, data: dict) -> int:
-        return self.table.insert(data)
+        with self.lock:
+            return self.table.insert(data)
 
     def insert_multiple(self, data: List[dict]) -> List[int]:
-        return self.table.insert_multiple(data)
+        with self.lock:
+            return self.table.insert_multiple(data)
 
     def update(self, data: dict, **cond) -> List[int]:
         """
@@ -49,13 +146,22 @@ class TinyNoSQLProvider:
         db.update(your_operation(arguments), query)
         """
 
-        return self.table.update(data, cond=self._create_condition(**cond))
+        with self.lock:
+            return self.table.update(data, cond=self._create_condition(**cond))
+
+    def update_multiple(self, updates: List[tuple]) -> List[int]:
+        """updates - список (data, cond): все изменения за один проход по таблице и одну запись файла"""
+
+        with self.lock:
+            return self.table.update_multiple([(data, self._create_condition(**cond)) for data, cond in updates])
 
     def upsert(self, data, **cond) -> List[int]:
-        return self.table.upsert(data, cond=self._create_condition(**cond))
+        with self.lock:
+            return self.table.upsert(data, cond=self._create_condition(**cond))
 
     def remove(self, **cond):
-        self.table.remove(cond=self._create_condition(**cond))
+        with self.lock:
+            self.table.remove(cond=self._create_condition(**cond))
 
     def contains(self, **cond):
         return self.table.contains(self._create_condition(**cond))
@@ -63,6 +169,14 @@ class TinyNoSQLProvider:
     def count(self, **cond):
         return self.table.count(self._create_condition(**cond))
 
+    def sum(self, field, **cond):
+        return sum(row.get(field) or 0 for row in self.search(**cond))
+
+    def flush(self):
+        # Для JSONStorage по умолчанию каждое изменение уже на диске
+        if isinstance(self.db.storage, BufferedJSONStorage):
+            self.db.storage.flush()
+
     def close(self):
         self.db.close()
 
@@ -71,10 +185,277 @@ class TinyNoSQLProvider:
         return reduce(lambda a, b: a & b, conditions)
 
 
+class SqliteQueueProvider:
+    """
+    Провайдер с интерфейсом TinyNoSQLProvider поверх таблицы RS_scanning_queue основной базы.
+    Запись хранится целиком в data (JSON), id_doc, row_id и sent дублируются в колонки с индексами:
+    вставка не переписывает всю очередь, как JSON-файл TinyDB, а отбор по этим полям идет по индексу.
+    Условия по остальным полям проверяются после чтения записей.
+    qtty тоже дублируется в колонку: триггеры ведут по ней сумму по строке (id_doc, row_id)
+    в RS_scanning_queue_rows, sum('qtty', id_doc=..., row_id=...) читает одну запись.
+    Записи BarcodeWorker хранят id строки документа в row_key, а количество - в d_qtty: они попадают
+    в те же колонки (field_columns)
+    """
+
+    indexed_fields = ('id_doc', 'row_id', 'sent')
+    field_columns = {'row_key': 'row_id', 'd_qtty': 'qtty'}
+    # Поля-приращения: при сворачивании отправленных записей складываются
+    delta_fields = ('qtty', 'd_qtty')
+
+    def __init__(self, table_name='RS_scanning_queue'):
+        self.table_name = table_name
+
+    def drop_table(self, table_name=None):
+        get_query_result(f'DELETE FROM {self.table_name}')
+
+    def get_all(self) -> list:
+        return self._select()
+
+    def get(self, **cond) -> Union[Dict, None]:
+        result = self._select(limit=1, **cond)
+        return result[0] if result else None
+
+    def search(self, **cond) -> list:
+        return self._select(**cond)
+
+    def insert(self, data: dict) -> int:
+        with transaction():
+            get_query_result(f'INSERT INTO {self.table_name} (id_doc, row_id, sent, qtty, data, created_at) '
+                             f"VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))", self._get_params(data))
+            return get_query_result('SELECT last_insert_rowid()')[0][0]
+
+    def insert_multiple(self, data: List[dict]) -> List[int]:
+        if not data:
+            return []
+
+        with transaction():
+            res = get_query_result(f'SELECT IFNULL(MAX(id), 0) FROM {self.table_name}')
+            bulk_query(f'INSERT INTO {self.table_name} (id_doc, row_id, sent, qtty, data, created_at) '
+                       f"VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))", [self._get_params(row) for row in data])
+
+        return list(range(res[0][0] + 1, res[0][0] + len(data) + 1))
+
+    def update(self, data: dict, **cond) -> List[int]:
+        return self.update_multiple([(data, cond)])
+
+    def update_multiple(self, updates: List[tuple]) -> List[int]:
+        """updates - список (data, cond): записи отбираются по индексу, все изменения - одним executemany"""
+
+        with transaction():
+            changed = {}
+            for data, cond in updates:
+                for row_id, row in self._select_with_ids(**cond):
+                    row = changed.get(row_id, row)
+                    row.update(data)
+                    changed[row_id] = row
+
+            if changed:
+                bulk_query(f'UPDATE {self.table_name} SET id_doc = ?, row_id = ?, sent = ?, qtty = ?, data = ? '
+                           f'WHERE id = ?', [self._get_params(row) + (row_id,) for row_id, row in changed.items()])
+
+        return list(changed)
+
+    def upsert(self, data, **cond) -> List[int]:
+        with transaction():
+            return self.update(data, **cond) or [self.insert(dict(cond, **data))]
+
+    def remove(self, **cond):
+        ids = [row_id for row_id, _ in self._select_with_ids(**cond)]
+        bulk_query(f'DELETE FROM {self.table_name} WHERE id = ?', [(row_id,) for row_id in ids])
+
+    def contains(self, **cond):
+        return self.get(**cond) is not None
+
+    def count(self, **cond):
+        if all(self._is_indexed(key) for key in cond):
+            where, params = self._get_where(cond)
+            return get_query_result(f'SELECT COUNT(*) FROM {self.table_name}{where}', params)[0][0]
+
+        return len(self._select_with_ids(**cond))
+
+    def sum(self, field, **cond):
+        columns = {self._get_column(key): value for key, value in cond.items()}
+        if self._get_column(field) == 'qtty' and len(cond) == 2 and set(columns) == {'id_doc', 'row_id'}:
+            res = get_query_result('SELECT qtty FROM RS_scanning_queue_rows WHERE id_doc = ? AND row_id = ?',
+                                   (columns['id_doc'], '' if columns['row_id'] is None else columns['row_id']))
+            return res[0][0] if res else 0
+
+        return sum(row.get(field) or 0 for row in self._select(**cond))
+
+    def compact(self, retention_seconds) -> dict:
+        """
+        Сжатие очереди одной транзакцией:
+        - отправленные записи старше retention_seconds удаляются;
+        - оставшиеся отправленные записи одной строки (все поля, кроме qtty и d_qtty, совпадают)
+          сворачиваются в одну с суммой количеств и временем последней из них.
+        Возвращает количество удаленных (expired) и свернутых (folded) записей и сколько осталось (rows)
+        """
+
+        result = {'expired': 0, 'folded': 0}
+        with transaction():
+            get_query_result(f"DELETE FROM {self.table_name} WHERE sent = 1 "
+                             f"AND created_at < CAST(strftime('%s', 'now') AS INTEGER) - ?", (int(retention_seconds),))
+            result['expired'] = get_query_result('SELECT changes()')[0][0]
+
+            groups = {}
+            for row_id, created_at, data in get_query_result(
+                    f'SELECT id, created_at, data FROM {self.table_name} WHERE sent = 1 ORDER BY id'):
+                row = json.loads(data)
+                key = json.dumps({field: value for field, value in row.items() if field not in self.delta_fields},
+                                 sort_keys=True)
+                groups.setdefault(key, []).append((row_id, created_at, row))
+
+            folded = []
+            for rows in groups.values():
+                if len(rows) < 2:
+                    continue
+
+                summary = dict(rows[-1][2])
+                for field in self.delta_fields:
+                    if any(field in row for _, _, row in rows):
+                        summary[field] = sum(row.get(field) or 0 for _, _, row in rows)
+                folded.append((rows, summary))
+
+            if folded:
+                bulk_query(f'DELETE FROM {self.table_name} WHERE id = ?',
+                           [(row_id,) for rows, _ in folded for row_id, _, _ in rows])
+                bulk_query(f'INSERT INTO {self.table_name} (id_doc, row_id, sent, qtty, data, created_at) '
+                           f'VALUES (?, ?, ?, ?, ?, ?)',
+                           [self._get_params(summary) + (rows[-1][1],) for rows, summary in folded])
+                result['folded'] = sum(len(rows) for rows, _ in folded)
+
+            get_query_result('DELETE FROM RS_scanning_queue_rows WHERE qtty = 0')
+            result['rows'] = get_query_result(f'SELECT COUNT(*) FROM {self.table_name}')[0][0]
+
+        return result
+
+    def close(self):
+        # Соединение с базой общее (ui_global), закрывать нечего
+        pass
+
+    def _select(self, limit=None, **cond) -> list:
+        return [row for _, row in self._select_with_ids(limit, **cond)]
+
+    def _select_with_ids(self, limit=None, **cond) -> list:
+        indexed_cond = {key: value for key, value in cond.items() if self._is_indexed(key)}
+        other_cond = {key: value for key, value in cond.items() if not self._is_indexed(key)}
+
+        where, params = self._get_where(indexed_cond)
+        # Лимит в запросе - только если все условия проверяются в нем
+        limit_text = f' LIMIT {int(limit)}' if limit and not other_cond else ''
+        res = get_query_result(f'SELECT id, data FROM {self.table_name}{where} ORDER BY id{limit_text}', params)
+
+        result = []
+        for row_id, data in res:
+            row = json.loads(data)
+            if all(row.get(key) == value for key, value in other_cond.items()):
+                result.append((row_id, row))
+                if limit and len(result) >= limit:
+                    break
+
+        return result
+
+    def _get_column(self, field) -> str:
+        return self.field_columns.get(field, field)
+
+    def _is_indexed(self, field) -> bool:
+        return self._get_column(field) in self.indexed_fields
+
+    def _get_where(self, cond: dict) -> tuple:
+        if not cond:
+            return '', ()
+
+        where = ' WHERE ' + ' AND '.join(f'{self._get_column(key)} = ?' for key in cond)
+        return where, tuple(int(value) if key == 'sent' else value for key, value in cond.items())
+
+    @staticmethod
+    def _get_params(data: dict) -> tuple:
+        return (data.get('id_doc'), data.get('row_id', data.get('row_key')), int(bool(data.get('sent'))),
+                data.get('qtty', data.get('d_qtty')) or 0, json.dumps(data, ensure_ascii=False))
+
+
 class ScanningQueueService:
+    # Отправленные записи хранятся retention_days дней, сжатие по таймеру - не чаще раза в compaction_interval секунд
+    retention_days = 7
+    compaction_interval = 3600
+    # Итоги сжатий за время работы приложения (отладочный экран)
+    compaction_stats = {'runs': 0, 'expired': 0, 'folded': 0, 'removed_docs': 0, 'rows': None,
+                        'last_duration_ms': None}
+
     def __init__(self, provider=None):
         self.table_name = 'scanning_queue'
-        self.provider = provider or TinyNoSQLProvider(table_name=self.table_name)
+        self.provider = provider or SqliteQueueProvider()
+
+    def compact(self, retention_days=None) -> dict:
+        """Сжатие очереди (SqliteQueueProvider.compact), итоги добавляются в compaction_stats"""
+
+        if retention_days is None:
+            retention_days = int(rs_settings.get('scan_queue_retention_days') or self.retention_days)
+
+        start = time.perf_counter()
+        result = self.provider.compact(retention_days * 24 * 3600)
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        stats = ScanningQueueService.compaction_stats
+        stats['runs'] += 1
+        stats['expired'] += result['expired']
+        stats['folded'] += result['folded']
+        stats['rows'] = result['rows']
+        stats['last_duration_ms'] = duration_ms
+        rs_settings.put('scan_queue_compacted_at', time.time(), True)
+
+        return dict(result, duration_ms=duration_ms)
+
+    def compact_if_due(self):
+        """Сжатие по расписанию (Timer): если с прошлого прошло больше compaction_interval секунд"""
+
+        compacted_at = float(rs_settings.get('scan_queue_compacted_at') or 0)
+        if time.time() - compacted_at >= self.compaction_interval:
+            return self.compact()
+
+    def remove_doc(self, id_doc):
+        # Очередь удаленного документа больше не нужна
+        self.provider.remove(id_doc=id_doc)
+        ScanningQueueService.compaction_stats['removed_docs'] += 1
+
+    @classmethod
+    def compaction_report(cls) -> str:
+        stats = cls.compaction_stats
+        if not stats['runs'] and not stats['removed_docs']:
+            return 'Очередь сканирований не сжималась'
+
+        return ('Очередь сканирований: сжатий {runs}, удалено старых {expired}, свернуто {folded}, '
+                'удалено документов {removed_docs}, записей {rows}, последнее сжатие {last_duration_ms} мс'
+                .format(**stats))
+
+    def migrate_from_tiny_db(self, tiny_provider=None) -> int:
+        """
+        Однократный перенос очереди из TinyDB (SimpleKeep.json) в провайдер сервиса.
+        Отметка о переносе (scan_queue_migrated) ставится до записи: сбой между записью и очисткой
+        TinyDB не приводит к повторному переносу и задвоению очереди, а следующие запуски не открывают
+        SimpleKeep.json. Возвращает количество перенесенных записей
+        """
+
+        if rs_settings.get('scan_queue_migrated'):
+            return 0
+
+        if tiny_provider is None:
+            db_path = rs_settings.get('path_to_databases') or ''
+            if not os.path.exists(os.path.join(db_path, 'SimpleKeep.json')):
+                rs_settings.put('scan_queue_migrated', True, True)
+                return 0
+            tiny_provider = TinyNoSQLProvider(table_name=self.table_name, db_path=db_path)
+
+        try:
+            data = tiny_provider.get_all()
+            rs_settings.put('scan_queue_migrated', True, True)
+            if data:
+                self.provider.insert_multiple([dict(row) for row in data])
+                tiny_provider.drop_table(tiny_provider.table_name)
+        finally:
+            tiny_provider.close()
+
+        return len(data)
 
     def get_doc_scanning_queue(self, id_doc) -> dict:
         result = {}
@@ -91,15 +472,30 @@ class ScanningQueueService:
         self.provider.insert(data=data)
         return self.provider.count(id_doc=data['id_doc'])
 
+    def save_scanned_rows_data(self, data: list, sent=False):
+        # Строки пачки сканирований пишутся одной операцией
+        for row in data:
+            row['sent'] = sent
+        if data:
+            self.provider.insert_multiple(data=data)
+
     def get_scanned_row_qtty(self, id_doc, row_id):
-        data = self.provider.search(id_doc=id_doc, row_id=row_id)
-        return sum([row['qtty'] for row in data])  # or 'd_qtty'
+        return self.provider.sum('qtty', id_doc=id_doc, row_id=row_id)  # or 'd_qtty'
 
     def get_send_document_lines(self, id_doc) -> list:
         data = self.provider.search(id_doc=id_doc, sent=False)
         return data
 
     def update_sent_lines(self, data: list, sent=True):
+        """
+        Отметка отправки строк, полученных get_send_document_lines до отправки.
+        Строка ищется по всем полям (id_doc и row_id/row_key - по индексу): записи,
+        добавленные в ту же строку документа во время отправки, не отмечаются.
+        Все строки отмечаются одной операцией провайдера
+        """
+
+        updates = [(dict(row, sent=sent), dict(row)) for row in data]
         for row in data:
             row['sent'] = sent
-            self.provider.update(data=row, id_doc=row['id_doc'], row_id=row['row_id'])
+        if updates:
+            self.provider.update_multiple(updates)
@@ -2,6 +2,7 @@
 
 import re
 from datetime import datetime
+from decimal import Decimal
 
 
 def parse_barcode(barcode):
@@ -85,81 +86,190 @@ def gtin_check(gtin: str):
     return check_sum_digit == int(gtin[-1])
 
 
-sresult = {'SCHEME': 'GS1'}
+GS = chr(29)
+
+
+def _build_gs1_ai_table() -> dict:
+    """
+    Словарь идентификаторов применения (AI) GS1: AI -> (длина данных, длина переменная).
+    Поле переменной длины заканчивается разделителем GS (FNC1) или концом кода,
+    длина для него - максимальная
+    """
+
+    table = {
+        '00': (18, False), '01': (14, False), '02': (14, False), '03': (14, False),
+        '10': (20, True), '11': (6, False), '12': (6, False), '13': (6, False), '15': (6, False),
+        '16': (6, False), '17': (6, False), '20': (2, False), '21': (20, True), '22': (20, True),
+        '235': (28, True), '240': (30, True), '241': (30, True), '242': (6, True), '243': (20, True),
+        '250': (30, True), '251': (30, True), '253': (30, True), '254': (20, True), '255': (25, True),
+        '30': (8, True), '37': (8, True),
+        '400': (30, True), '401': (30, True), '402': (17, False), '403': (30, True),
+        '420': (20, True), '421': (12, True), '422': (3, False), '423': (15, True), '424': (3, False),
+        '425': (15, True), '426': (3, False), '427': (3, True),
+        '4300': (35, True), '4301': (35, True), '4302': (70, True), '4303': (70, True), '4304': (70, True),
+        '4305': (70, True), '4306': (70, True), '4307': (2, False), '4308': (30, True), '4309': (20, False),
+        '4310': (35, True), '4311': (35, True), '4312': (70, True), '4313': (70, True), '4314': (70, True),
+        '4315': (70, True), '4316': (70, True), '4317': (2, False), '4318': (20, True), '4319': (30, True),
+        '4320': (35, True), '4321': (1, False), '4322': (1, False), '4323': (1, False), '4324': (10, False),
+        '4325': (10, False), '4326': (6, False),
+        '7001': (13, False), '7002': (30, True), '7003': (10, False), '7004': (4, True), '7005': (12, True),
+        '7006': (6, False), '7007': (12, True), '7008': (3, True), '7009': (10, True), '7010': (2, True),
+        '7020': (20, True), '7021': (20, True), '7022': (20, True), '7023': (30, True), '7040': (4, False),
+        '7240': (20, True),
+        '8001': (14, False), '8002': (20, True), '8003': (30, True), '8004': (30, True), '8005': (6, False),
+        '8006': (18, False), '8007': (34, True), '8008': (12, True), '8009': (50, True), '8010': (30, True),
+        '8011': (12, True), '8012': (20, True), '8013': (25, True), '8017': (18, False), '8018': (18, False),
+        '8019': (10, True), '8020': (25, True), '8026': (18, False),
+        '8110': (70, True), '8111': (4, False), '8112': (70, True), '8200': (70, True),
+    }
+
+    table.update({f'41{n}': (13, False) for n in range(8)})
+    table.update({f'70{n}': (30, True) for n in range(30, 40)})
+    table.update({f'71{n}': (20, True) for n in range(7)})
+    table.update({str(ai): (90, True) for ai in range(90, 100)})
+
+    # Количества и меры с десятичной точкой: последняя цифра AI - число знаков после запятой
+    for prefix in range(310, 370):
+        table.update({f'{prefix}{n}': (6, False) for n in range(10)})
+    for prefix, length, variable in (('390', 15, True), ('391', 18, True), ('392', 15, True),
+                                     ('393', 18, True), ('394', 4, False), ('395', 6, False)):
+        table.update({f'{prefix}{n}': (length, variable) for n in range(10)})
+
+    return table
+
+
+GS1_AI = _build_gs1_ai_table()
+# Длина AI по первым двум цифрам: в словаре GS1 она однозначно определяется ими
+GS1_AI_LENGTH = {ai[:2]: len(ai) for ai in GS1_AI}
+# Поля результата разбора по AI
+GS1_FIELDS = {'01': 'GTIN', '17': 'EXPIRY', '10': 'BATCH', '21': 'SERIAL', '91': 'NHRN', '92': 'CHECK',
+              '93': 'CHECK', '8005': 'NHRN', **{f'310{n}': 'WEIGHT' for n in range(10)}}
+# AI с десятичной точкой и AI, у которых перед суммой стоит трехзначный код валюты ISO 4217
+GS1_DECIMAL_PREFIXES = tuple(str(prefix) for prefix in range(310, 370)) + ('390', '391', '392', '393', '394', '395')
+GS1_CURRENCY_PREFIXES = ('391', '393')
+
+
+def parse_gs1_elements(code: str) -> tuple:
+    """
+    Разбор кода GS1 на элементы за один проход по индексу.
+    Возвращает (словарь AI -> значение в порядке следования, ошибка или '')
+    """
+
+    if '<GS>' in code:
+        code = code.replace('<GS>', GS)
+    ai_lengths = GS1_AI_LENGTH
+    elements = {}
+    length = len(code)
+    i = 0
+
+    while i < length:
+        ai_length = ai_lengths.get(code[i:i + 2])
+        if ai_length is None:
+            if code[i] == GS:
+                i += 1
+                continue
+            return elements, 'INVALID BARCODE'
+
+        ai = code[i:i + ai_length]
+        spec = GS1_AI.get(ai)
+        if spec is None:
+            return elements, 'INVALID BARCODE'
+
+        data_length, variable = spec
+        start = i + ai_length
+        if variable:
+            end = code.find(GS, start)
+            if end == -1:
+                elements[ai] = code[start:]
+                break
+            elements[ai] = code[start:end]
+            i = end + 1
+        else:
+            end = start + data_length
+            if end > length:
+                return elements, 'INVALID BARCODE'
+            elements[ai] = code[start:end]
+            i = end
+
+    return elements, ''
+
+
+def gs1_decimal_value(ai: str, value: str) -> str:
+    """Значение AI с десятичной точкой (310n, 392n...) в виде числа: '3103', '000353' -> '0.353'"""
+
+    if len(ai) != 4 or not ai.startswith(GS1_DECIMAL_PREFIXES):
+        return value
+
+    currency = ''
+    if ai.startswith(GS1_CURRENCY_PREFIXES):
+        currency, value = value[:3] + ' ', value[3:]
+
+    if not value.isdigit():
+        return currency + value
+
+    return currency + format(Decimal(value).scaleb(-int(ai[3])), 'f')
+
+
+def gs1_fields(elements: dict) -> dict:
+    """Поля результата разбора (GTIN, SERIAL, CHECK...) по элементам кода GS1"""
+
+    result = {}
+    for ai, value in elements.items():
+        name = GS1_FIELDS.get(ai)
+        if name:
+            # Код проверки 93 в Честном знаке - 4 символа
+            result[name] = value[:4] if ai == '93' else value
+
+    return result
+
+
+EAN13_PATTERN = re.compile(r'\d{13}')
+# Веса цифр EAN-13 для контрольной суммы: нечетные позиции - 1, четные - 3
+EAN13_WEIGHTS = (1, 3) * 6
+GS1_IDENTIFIER = ']d2'
+
+
+def is_valid_ean13(code: str) -> bool:
+    if len(code) != 13 or EAN13_PATTERN.fullmatch(code) is None:
+        return False
+
+    checksum = sum(int(digit) * weight for digit, weight in zip(code, EAN13_WEIGHTS))
+    return (10 - checksum % 10) % 10 == int(code[12])
+
+
+def split_mark_codes(codes):
+    """
+    GTIN и серии кодов марок из обмена (mark_code в данных документов, CSV) за один проход: (GTIN, Series).
+    Без разделителя GS код - это 01 + GTIN + 21 + серия или GTIN + серия, коды короче 21 символа не разбираются.
+    Код с разделителем разбирается по AI, хвост с кодом проверки в серию не попадает
+    """
+
+    empty = ('', '')
+    for code in codes:
+        if not code:
+            yield empty
+        elif GS in code or '<GS>' in code:
+            if code[:3] == GS1_IDENTIFIER:
+                code = code[3:]
+            elements = parse_gs1_elements(code)[0]
+            yield elements.get('01', ''), elements.get('21', '')
+        elif len(code) < 21:
+            yield empty
+        elif code[:2] == '01':
+            yield code[2:16], code[18:]
+        else:
+            yield code[:14], code[14:]
 
 
 def gs1_gtin(barcode: str) -> dict:
-    if chr(29) in barcode:
-
-        while barcode:
-            if barcode[:2] == '01':
-                sresult['GTIN'] = barcode[2:16]
-                if len(barcode) > 16:
-                    barcode = barcode[16:]
-                else:
-                    barcode = None
-
-            elif barcode[:3] == chr(29) + '01':
-                sresult['GTIN'] = barcode[3:17]
-                if len(barcode) > 17:
-                    barcode = barcode[17:]
-                else:
-                    barcode = None
-            elif barcode[:2] == '17':
-                sresult['EXPIRY'] = barcode[2:8]
-                if len(barcode) > 8:
-                    barcode = barcode[8:]
-                else:
-                    barcode = None
-
-            elif barcode[:2] == '10':
-                if chr(29) in barcode:
-                    index = barcode.index(chr(29))
-                    sresult['BATCH'] = barcode[2:index]
-                    barcode = barcode[index + 1:]
-                else:
-                    sresult['BATCH'] = barcode[2:]
-                    barcode = None
-
-            elif barcode[:2] == '21':
-                if chr(29) in barcode:
-                    index = barcode.index(chr(29))
-                    sresult['SERIAL'] = barcode[2:index]
-                    barcode = barcode[index + 1:]
-                else:
-                    sresult['SERIAL'] = barcode[2:]
-                    barcode = None
-
-            elif barcode[:2] == '91':
-                if chr(29) in barcode:
-                    index = barcode.index(chr(29))
-                    sresult['NHRN'] = barcode[2:index]
-                    barcode = barcode[index + 1:]
-                else:
-                    sresult['NHRN'] = barcode[2:6]
-                    barcode = None
-
-            elif barcode[:2] == '93':  # Молочка, вода
-                sresult['CHECK'] = barcode[2:6]
-                barcode = barcode[7:]
-
-            elif barcode[:2] == '92':  # Далее следует код проверки, 44 символа
-                # if len(barcode[2:])==44:
-                sresult['CHECK'] = barcode[2:]
-                barcode = None
-            elif barcode[:4] == '8005':  # Табак, Блок
-                sresult['NHRN'] = barcode[5:11]
-                barcode = barcode[11:]
-            elif barcode[:4] == '3103':  # Молочка с Весом
+    if GS not in barcode and '<GS>' not in barcode:
+        return {'SCHEME': 'GS1', 'ERROR': 'No GS Separator'}
 
-                sresult['WEIGHT'] = barcode[4:]
-                barcode = None
+    elements, error = parse_gs1_elements(barcode)
+    result = {'SCHEME': 'GS1', **gs1_fields(elements)}
 
-            else:
-                return {'ERROR': 'INVALID BARCODE', 'BARCODE': sresult}
-    else:
-        sresult['ERROR'] = 'No GS Separator'
-        return sresult
+    if error:
+        return {'ERROR': error, 'BARCODE': result}
 
     # if ('GTIN' , 'BATCH' , 'EXPIRY' , 'SERIAL') in result.keys():
     #     if gtin_check(result['GTIN']) == False and expiry_date_check(result['EXPIRY']) == False:
@@ -172,7 +282,7 @@ def gs1_gtin(barcode: str) -> dict:
     #         return result
     # else:
     #     return {'ERROR': 'INCOMPLETE DATA', 'BARCODE': result}
-    return sresult
+    return result
 
 
 def expiry_date_check(e: str):
@@ -4,6 +4,7 @@ import re
 
 import ui_barcodes
 import ui_global
+from goods_search import goods_search_index
 from datetime import datetime
 
 
@@ -35,7 +36,8 @@ def get_query_text(q_name='') -> str:
     elif q_name == 'RS_docs_table':
         return 'REPLACE INTO RS_docs_table (id_doc, id_good, id_properties, id_series, id_unit, qtty, qtty_plan, price, id_price) VALUES (?,?,?,?,?,?,?,?,?)'
     elif q_name == 'RS_docs_barcodes':
-        return 'REPLACE INTO RS_docs_barcodes (id_doc, id_barcode, is_plan) VALUES (?,?,?)'
+        return 'REPLACE INTO RS_docs_barcodes (id_doc, id_good, id_property, id_series, id_unit, is_plan, GTIN, Series) ' \
+               'VALUES (?,?,?,?,?,?,?,?)'
 
 
 def get_query_text_export():
@@ -99,6 +101,7 @@ def load_from_csv(path='', file=''):
             rs_doc_data = []
             rs_doc_table_data = []
             rs_doc_barcode = []
+            marks = []
             rs_marking_codes = []
             rs_properties = []
             temp_doc_n = ''
@@ -123,8 +126,9 @@ def load_from_csv(path='', file=''):
                         rs_doc_table_data[curr_count] = tuple(lst)
                         # rs_doc_table_data[curr_count][6]=int(rs_doc_table_data[curr_count][6]) + int(row[6])
                     if row[5]:
-                        # RS_docs_barcodes (id_doc, id_barcode, is_plan)
-                        rs_doc_barcode.append((doc_num, row[5], '1'))
+                        # RS_docs_barcodes (id_doc, id_good, id_property, id_series, id_unit, is_plan), GTIN и Series ниже
+                        rs_doc_barcode.append((doc_num, row[0], row[8], '', row[1] + row[0], '1'))
+                        marks.append(row[5])
                         # RS_marking_codes(id, mark_code, id_good, id_property, id_series, id_unit) VALUES(?, ?, ?, ?, ?, ?)
                         rs_marking_codes.append((row[5], row[5], row[0], row[8], '', row[1] + row[0]))
 
@@ -135,6 +139,9 @@ def load_from_csv(path='', file=''):
                 elif my_reader.line_num == 5:
                     list_headers = row.copy()
 
+        # Марки документа разбираются на GTIN и серию одним проходом
+        rs_doc_barcode = [values + mark for values, mark in zip(rs_doc_barcode, ui_barcodes.split_mark_codes(marks))]
+
         # Заполняем таблицы
         ui_global.bulk_query_replace(get_query_text('RS_docs'), rs_doc_data)
         ui_global.bulk_query_replace(get_query_text('RS_docs_table'), rs_doc_table_data)
@@ -201,6 +208,7 @@ def load_from_csv(path='', file=''):
         ui_global.bulk_query_replace(get_query_text('RS_goods'), rs_goods_data)
         ui_global.bulk_query_replace(get_query_text('RS_units'), rs_units_data)
         ui_global.bulk_query_replace(get_query_text('RS_barcodes'), rs_barcodes_data)
+        goods_search_index.rebuild()
 
         return 200
 
@@ -225,12 +233,11 @@ def list_folder(path: str, delete_files: bool):
 
 
 def export_csv(path, IP, AndroidID):
-    docs = ui_global.get_query_result('SELECT id_doc, doc_n from RS_docs Where verified = 1')
+    # Документы и их строки читаются порциями (iter_query) и сразу пишутся в файл
+    docs = ui_global.iter_query('SELECT id_doc, doc_n from RS_docs Where verified = 1')
+    qtext = get_query_text_export()
     count = 0
     for doc_item in docs:
-        qtext = get_query_text_export()
-
-        res = ui_global.get_query_result(qtext, (doc_item[0],), True)
         count += 1
         with open(path + 'doc_out_' + doc_item[1] + '.csv', 'w', newline='', encoding='utf-8') as csvfile:
             my_reader = csv.writer(csvfile, dialect='excel', delimiter=';', quotechar='"')
@@ -238,11 +245,10 @@ def export_csv(path, IP, AndroidID):
             my_reader.writerow(('Приход на склад ' + doc_item[1], 'Москва1', AndroidID, IP))
             my_reader.writerow(('GTIN', 'КодВУчетнойСистеме', 'Наименование', 'DeclaredQuantity', 'CurrentQuantity',
                                 'Коробка', 'Марка', 'МаркаИСМП', 'Инвойс', 'Принадлежность'))
-            for el in res:
-                gtin = ui_barcodes.get_gtin_serial_from_datamatrix(el['МаркаИСМП'])
-                el['GTIN'] = gtin['GTIN']
+            for el in ui_global.iter_query(qtext, (doc_item[0],)):
+                gtin, _ = next(ui_barcodes.split_mark_codes([el['МаркаИСМП']]))
                 my_reader.writerow((
-                                   el['GTIN'], el['id_good'], el['name'], el['DeclaredQuantity'], el['CurrentQuantity'],
+                                   gtin, el['id_good'], el['name'], el['DeclaredQuantity'], el['CurrentQuantity'],
                                    el['Марка'], el['МаркаИСМП'], el['Инвойс'], el['Принадлежность']))
 
     return str(count) + ' документов'
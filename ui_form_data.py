@@ -1441,6 +1441,98 @@ def get_plan_good_from_doc():
     '''
 
 
+# Товар по штрихкоду для кэша штрихкодов (barcode_cache)
+def get_barcode_resolution_query():
+    return '''
+    SELECT
+    barcodes.id_good AS id_good,
+    barcodes.id_property AS id_property,
+    barcodes.id_series AS id_series,
+    barcodes.id_unit AS id_unit,
+    barcodes.ratio AS ratio,
+    types_goods.use_mark AS use_mark
+
+    FROM RS_barcodes AS barcodes
+    LEFT JOIN RS_goods AS goods
+        ON goods.id = barcodes.id_good
+    LEFT JOIN RS_types_goods AS types_goods
+        ON types_goods.id = goods.type_good
+
+    WHERE barcodes.barcode = ?
+    LIMIT 1
+    '''
+
+
+# Строка товаров документа для товара из кэша штрихкодов (как doc_table в get_scan_data_query)
+def get_scan_doc_row_query():
+    return '''
+    SELECT
+    id AS row_id,
+    ifnull(qtty_plan,0) AS qtty_plan,
+    ifnull(qtty,0) AS qtty
+
+    FROM RS_docs_table
+    WHERE id_doc = :id_doc
+    AND id_good = :id_good
+    AND id_properties = :id_property
+    AND id_series = :id_series
+    LIMIT 1
+    '''
+
+
+# Все данные для обработки скана одним запросом: товар по штрихкоду, вид товара (маркировка),
+# строка товаров документа (как в get_plan_good_from_doc) и марка документа (как в get_query_mark_find_in_doc)
+def get_scan_data_query():
+    return '''
+    SELECT
+    barcodes.id_good AS id_good,
+    barcodes.id_property AS id_property,
+    barcodes.id_series AS id_series,
+    barcodes.id_unit AS id_unit,
+    barcodes.ratio AS ratio,
+    types_goods.use_mark AS use_mark,
+
+    doc_table.id AS row_id,
+    ifnull(doc_table.qtty_plan,0) AS qtty_plan,
+    ifnull(doc_table.qtty,0) AS qtty,
+
+    doc_barcodes.id AS mark_id,
+    doc_barcodes.id_doc AS mark_id_doc,
+    IFNULL(doc_barcodes.GTIN, '0') AS mark_GTIN,
+    IFNULL(doc_barcodes.Series, '0') AS mark_Series,
+    IFNULL(doc_barcodes.id_good, '') AS mark_id_good,
+    IFNULL(doc_barcodes.id_property, '') AS mark_id_property,
+    IFNULL(doc_barcodes.id_series, '') AS mark_id_series,
+    IFNULL(doc_barcodes.id_unit, '') AS mark_id_unit,
+    doc_barcodes.is_plan AS mark_is_plan,
+    doc_barcodes.approved AS mark_approved
+
+    FROM RS_barcodes AS barcodes
+    LEFT JOIN RS_goods AS goods
+        ON goods.id = barcodes.id_good
+    LEFT JOIN RS_types_goods AS types_goods
+        ON types_goods.id = goods.type_good
+
+    LEFT JOIN RS_docs_table AS doc_table
+        ON doc_table.id = (
+            SELECT id FROM RS_docs_table
+            WHERE id_doc = :id_doc
+            AND id_good = barcodes.id_good
+            AND id_properties = barcodes.id_property
+            AND id_series = barcodes.id_series
+            LIMIT 1)
+
+    LEFT JOIN RS_docs_barcodes AS doc_barcodes
+        ON doc_barcodes.id = (
+            SELECT id FROM RS_docs_barcodes
+            WHERE id_doc = :id_doc AND GTIN = :GTIN AND Series = :Series
+            LIMIT 1)
+
+    WHERE barcodes.barcode = :barcode
+    LIMIT 1
+    '''
+
+
 #      s =    '''
 #    with tmp as (
 #     SELECT ifnull(qtty_plan,0) as qtty_plan,
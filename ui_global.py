@@ -6,8 +6,14 @@ import ui_barcodes
 import os
 import ui_form_data
 import queue
+import time
 from datetime import datetime, timedelta
 
+from barcode_cache import barcode_cache
+from db_connection import connection_manager
+from query_cache import query_cache
+from scan_metrics import scan_metrics
+
 
 query_list = queue.Queue()
 # Вот таким незатейливым методом определяем, мы запустились на компе или на ТСД **
@@ -17,8 +23,6 @@ if os.path.exists('//data/data/ru.travelfood.simple_ui/databases/'): #локал
 else:
     db_path = 'rightscan5.db'  # D:\PythonProjects\RightScan\SUI_noPony\
 
-conn = None
-
 
 
 def find_barcode_in_marking_codes_table(self, struct_barcode: list):
@@ -56,6 +60,104 @@ def check_barcode_compliance(el_dict: dict, id_doc):
     return res
 
 
+def get_barcode_resolution(barcode: str):
+    """Товар по штрихкоду (id_good, id_property, id_series, id_unit, ratio, use_mark) через кэш штрихкодов или None"""
+
+    def load():
+        res = get_query_result(ui_form_data.get_barcode_resolution_query(), (barcode,), True)
+        return res[0] if res else None
+
+    return barcode_cache.resolve(barcode, load)
+
+
+def get_scan_data(id_doc, search_value, barcode_info: dict) -> dict:
+    """
+    Товар по штрихкоду вместе со строкой товаров документа и маркой документа - одним запросом
+    вместо find_barcode_in_barcode_table, find_barcode_in_marking_codes_table и check_barcode_compliance.
+    Строка документа - ключ 'doc_row', марка - 'mark' (None, если их нет).
+    Для обычных штрихкодов (не марок) товар берется из кэша штрихкодов, из базы читается только строка документа
+    """
+
+    if barcode_info.get('SCHEME') != 'GS1':
+        return get_scan_data_by_resolution(id_doc, search_value)
+
+    args_dict = {
+        'id_doc': id_doc,
+        'barcode': search_value,
+        'GTIN': barcode_info.get('GTIN'),
+        'Series': barcode_info.get('SERIAL'),
+    }
+
+    res = get_query_result(ui_form_data.get_scan_data_query(), args_dict, True)
+    if not res:
+        return {}
+
+    row = res[0]
+    scan_data = {key: row[key] for key in ('id_good', 'id_property', 'id_series', 'id_unit', 'ratio', 'use_mark')}
+
+    scan_data['doc_row'] = None
+    if row['row_id'] is not None:
+        scan_data['doc_row'] = {'id': row['row_id'], 'qtty_plan': row['qtty_plan'], 'qtty': row['qtty']}
+
+    scan_data['mark'] = None
+    if row['mark_id'] is not None:
+        scan_data['mark'] = {key[len('mark_'):]: value for key, value in row.items() if key.startswith('mark_')}
+
+    return scan_data
+
+
+def get_scan_data_by_resolution(id_doc, search_value) -> dict:
+    scan_data = get_barcode_resolution(search_value)
+    if not scan_data:
+        return {}
+
+    args_dict = {'id_doc': id_doc, 'id_good': scan_data['id_good'], 'id_property': scan_data['id_property'],
+                 'id_series': scan_data['id_series']}
+    res = get_query_result(ui_form_data.get_scan_doc_row_query(), args_dict, True)
+
+    scan_data['doc_row'] = None
+    if res:
+        scan_data['doc_row'] = {'id': res[0]['row_id'], 'qtty_plan': res[0]['qtty_plan'], 'qtty': res[0]['qtty']}
+    scan_data['mark'] = None
+
+    return scan_data
+
+
+def write_scan(id_doc, row: dict, qtty, last_updated, row_id=None, mark: dict = None, find_row=True):
+    """
+    Запись скана в базу одной транзакцией: количество строки товаров документа (row_id - id найденной строки,
+    без него строка ищется по товару, характеристике и серии, если find_row, и добавляется, если ее нет) и марка:
+    mark = {'id': id найденной марки или None для новой, 'barcode_from_scanner', 'GTIN', 'Series'}
+    """
+
+    with transaction():
+        if mark:
+            if mark.get('id'):
+                query_text = 'Update  RS_docs_barcodes SET approved=?, barcode_from_scanner=? Where id=?'
+                get_query_result(query_text, ('1', mark['barcode_from_scanner'], mark['id']))
+            else:
+                query_text = 'Insert Into RS_docs_barcodes (id_doc, id_good, id_property, id_series, id_unit, ' \
+                             'barcode_from_scanner, approved, GTIN, Series) VALUES (?,?,?,?,?,?,?,?,?)'
+                get_query_result(query_text, (
+                    id_doc, row['id_good'], row['id_property'], row['id_series'], row['id_unit'],
+                    mark['barcode_from_scanner'], '1', mark['GTIN'], mark['Series']))
+
+        if not row_id and find_row:
+            res = get_query_result(
+                'SELECT id FROM RS_docs_table WHERE id_doc = ? AND id_good = ? AND id_properties = ? AND id_series = ? '
+                'LIMIT 1', (id_doc, row['id_good'], row['id_property'], row['id_series']))
+            row_id = res[0][0] if res else None
+
+        if row_id:
+            qtext = 'UPDATE RS_docs_table SET qtty=qtty+?, last_updated = ?, sent = 0 WHERE id = ?'
+            get_query_result(qtext, (qtty, last_updated, row_id))
+        else:
+            qtext = 'REPLACE INTO RS_docs_table(id_doc, id_good, id_properties,id_series, id_unit, qtty, price, id_price, is_plan, sent, last_updated) VALUES (?,?,?,?,?,?,?,?,?,?,?)'
+            get_query_result(qtext, (
+                id_doc, row['id_good'], row['id_property'], row['id_series'],
+                row['id_unit'], qtty, 0, '', 'False', 0, last_updated))
+
+
 def check_adr_barcode_compliance(el_dict: dict, id_doc):
     """ 1 Такой товар в принципе есть в документе """
 
@@ -86,15 +188,8 @@ def check_adr_barcode_compliance(el_dict: dict, id_doc):
 
 def get_query_result(query_text: str, args = "", return_dict=False) -> list:
     # **********************
-
-    # global conn
-    # get_database_connection()
-    try:
-        conn = sqlite3.connect(db_path)
-
-    except Error:
-
-        raise ValueError('No connection with database')
+    # Соединение не открывается на каждый запрос, а берется из db_connection.connection_manager
+    conn = get_connection()
 
     cursor = conn.cursor()
     try:
@@ -105,76 +200,103 @@ def get_query_result(query_text: str, args = "", return_dict=False) -> list:
     except Exception as e:
         raise e
 
+    query_cache.bump_for_query(query_text)
+
     # Если надо - возвращаем не результат запроса, а словарь с импортированным результатом
     if return_dict:
         res = [dict(line) for line in
                [zip([column[0] for column in cursor.description], row) for row in cursor.fetchall()]]
     else:
         res = cursor.fetchall()
-    conn.commit()
-    conn.close()
+    cursor.close()
     return res
 
 
-def execute_script(query_text):
-    # global conn  # = None
-    # get_database_connection()
+def iter_query(query_text: str, args=None, batch_size=500):
+    """
+    Построчное чтение результата запроса порциями по batch_size (fetchmany) вместо fetchall.
+    Строки - sqlite3.Row: доступ и по индексу, и по имени колонки, соответствие имен колонок
+    вычисляется один раз на курсор. Для больших выборок (выгрузки, журналы), чтобы не держать в памяти весь результат:
+        for row in iter_query('SELECT * FROM RS_docs_table WHERE id_doc = ?', (id_doc,)):
+            row['id_good']
+    """
+
+    conn = get_connection()
+
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
     try:
-        conn = sqlite3.connect(db_path)
+        if args:
+            cursor.execute(query_text, args)
+        else:
+            cursor.execute(query_text)
 
-    except Error:
-        raise ValueError('No connection with database')
+        query_cache.bump_for_query(query_text)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def execute_script(query_text):
+    # executescript сам фиксирует открытую транзакцию перед выполнением скрипта
+    conn = get_connection()
 
     cursor = conn.cursor()
     try:
         cursor.executescript(query_text)
-        conn.commit()
     except sqlite3.Error as er:
         raise ValueError(er)
-    conn.close()
+    cursor.close()
+    query_cache.clear()
 
 
 def bulk_query_replace(query_text: str, args: object = "") -> object:
     # **********************
-    # global conn
-    # get_database_connection()
-    conn = None
+    res = []
     try:
-        conn = sqlite3.connect(db_path)
+        with transaction() as conn:
+            cursor = conn.cursor()
+            if args:
+                cursor.executemany(query_text, args)
+            res = cursor.fetchall()
+    except sqlite3.Error as er:
+        raise ValueError(er)
 
-    except Error:
-        raise ValueError('No connection with database')
+    query_cache.bump_for_query(query_text)
+    return res
 
-    cursor = conn.cursor()
-    try:
-        if args:
-            cursor.executemany(query_text, args)
 
-        conn.commit()
+def bulk_query(q: str, args: List[tuple]):
+    try:
+        with transaction() as conn:
+            conn.executemany(q, args)
     except sqlite3.Error as er:
         raise ValueError(er)
 
-    res = cursor.fetchall()
+    query_cache.bump_for_query(q)
 
-    conn.close()
-    return res
 
+def get_connection() -> sqlite3.Connection:
+    return connection_manager.get_connection(db_path)
 
-def bulk_query(q: str, args: List[tuple]):
-    try:
-        conn = sqlite3.connect(db_path)
-    except sqlite3.Error:
-        raise ValueError('No connection with database')
 
-    cursor = conn.cursor()
+def transaction():
+    """
+    Все запросы внутри блока with выполняются одной транзакцией:
+        with ui_global.transaction():
+            get_query_result(...)
+            bulk_query(...)
+    """
+    return connection_manager.transaction(db_path)
 
-    try:
-        cursor.executemany(q, args)
-        conn.commit()
-    except sqlite3.Error as er:
-        raise ValueError(er)
 
-    conn.close()
+def close_connection():
+    connection_manager.close(db_path)
 
 def get_name_list(str_entty):
     query = "SELECT name FROM " + str_entty
@@ -369,11 +491,14 @@ class Rs_doc():
     # КОнтроль планов в документе - control
     # Есть план по маркируемой продукции have_mark_plan
     def process_the_barcode(self, barcode, have_qtty_plan = False, have_zero_plan = False, control = False, have_mark_plan = False,
-                            elem = None, use_mark_setting = 'false', user_tmz=0): # add_if_not_found=False, add_if_not_in_plan=False):
+                            elem = None, use_mark_setting = 'false', user_tmz=0, doc_session=None, scan_journal=None): # add_if_not_found=False, add_if_not_in_plan=False):
+        # doc_session - сессия документа экрана (doc_session.DocSession) с множеством одобренных марок
+        # scan_journal - журнал отложенной записи (scan_journal.ScanJournal), если она включена
         # Получим структуру баркода
         if barcode[0] == chr(29) and len(barcode) > 31:  # Remove first GS1 char from barcode
             barcode = barcode[1:]
-        barcode_info = ui_barcodes.parse_barcode(barcode)
+        with scan_metrics.measure('parse'):
+            barcode_info = barcode_cache.parse('ui_barcodes', barcode, ui_barcodes.parse_barcode)
         if barcode_info.__contains__('ERROR'):
             return {'Error': 'Invalid Barcode', 'Descr': 'Неверный штрихкод',
                     'Barcode': barcode_info, 'doc_info': self.id_doc}
@@ -386,26 +511,38 @@ class Rs_doc():
         else:  # ******************Сюда можно добавить новые виды штрихкодов ********************
             search_value = barcode_info['BARCODE']
 
-        res = find_barcode_in_barcode_table(search_value)  # Ищет баркод или ГТИИН по общей таблице штрихкодов. Возвращает товар, его вид, характеристику серию итп.
-        if not len(res) == 0:
-            elem = res[0] #Берем первый результат. В правильном списке штрихкодов не может быть повторений
+        # Повторно отсканированная марка отсекается по множеству сессии, до запросов к базе
+        if use_mark_setting == 'true' and shema == 'GS1' and doc_session \
+                and doc_session.is_mark_approved(barcode_info['GTIN'], barcode_info['SERIAL'], check_db=False):
+            return {'Error': 'AlreadyScanned', 'Descr': 'Такая марка уже была отсканирована',
+                    'Barcode': barcode_info,
+                    'doc_info': {'id_doc': self.id_doc, 'GTIN': barcode_info['GTIN'],
+                                 'Series': barcode_info['SERIAL'], 'approved': '1'}}
+
+        # Товар, строка документа и марка - одним запросом, запись - одной транзакцией
+        with scan_metrics.measure('db_lookup'):
+            if scan_journal:
+                # Данные из базы вместе с еще не записанными в нее сканами журнала
+                scan_data = scan_journal.get_scan_data(self.id_doc, barcode_info, lambda: get_scan_data(self.id_doc, search_value, barcode_info))
+            else:
+                scan_data = get_scan_data(self.id_doc, search_value, barcode_info)  # Ищет баркод или ГТИИН по общей таблице штрихкодов. Возвращает товар, его вид, характеристику серию итп.
+        if scan_data:
+            elem = scan_data
             ratio = elem['ratio']
         else:
             return {'Error': 'NotFound', 'Descr': 'Штрихкод не найден в базе', 'Barcode': barcode}
 
+        checks_start = time.perf_counter()
         use_mark = use_mark_setting  == 'true' and elem['use_mark'] == 1 #get_constants('use_mark')
 
         # Проверяем маркировку
         if use_mark:
             if shema == 'GS1':
-                el_marked = None
                 # Используем маркировку и товар маркируется
                 # Нашли в документе GTIN + серия
-                res = find_barcode_in_marking_codes_table(self, barcode_info)
+                el_marked = scan_data['mark']
 
-                if res:
-                    el_marked = res[0] #Выбираем первую строку из списка (если в таблице штрихкодов порядок, в рес всегда только одна строка)
-                else:
+                if not el_marked:
                     # Не нашли, проверяем есть ли в документе план и контроль
                     if have_mark_plan and control: #ЕстьПланКОдовМаркировки и контроль
                         return {'Error': 'NotFound', 'Descr': 'Марка не найдена в документе',
@@ -428,10 +565,10 @@ class Rs_doc():
                         'Barcode': barcode}
 
         #Товар в таблице документа (Товар найден в документе)
-        res = check_barcode_compliance(elem, self.id_doc)  #Получаем строку таблицы товары документа
-        if res: #Товар найден в документе
+        doc_row = scan_data['doc_row']  #Строка таблицы товары документа
+        if doc_row: #Товар найден в документе
             if have_qtty_plan: #Есть план по количеству
-                if res[0]['qtty_plan'] < res[0]['qtty'] + ratio: #Количество товара в документе уже набрано, и мы превышаем план
+                if doc_row['qtty_plan'] < doc_row['qtty'] + ratio: #Количество товара в документе уже набрано, и мы превышаем план
                     if control:
                         return {'Result': f'Количество план будет превышено при добавлении {str(ratio)} единиц товара',
                                 'Error': 'QuantityPlanReached',
@@ -445,18 +582,35 @@ class Rs_doc():
                         'Descr': 'В данный документ нельзя добавить товар не из списка'}
 
 
+        # Время проверок учитывается только для прошедших их штрихкодов
+        scan_metrics.add('checks', (time.perf_counter() - checks_start) * 1000)
+
         # Блок добавления товара в документ
+        current_time_utc_0 = (datetime.now() - timedelta(hours=user_tmz)).strftime("%Y-%m-%d %H:%M:%S")
+        mark = None
         if use_mark:
             # Добавляем товар в таблицу маркировки
             if el_marked and el_marked['id_good']: #Товар был найден, только обновляем уже найденную строку
-                query_text = 'Update  RS_docs_barcodes SET approved=?, barcode_from_scanner=? Where id=?'
-                get_query_result(query_text, ('1', barcode, int(el_marked['id'])))
+                mark = {'id': int(el_marked['id']), 'barcode_from_scanner': barcode,
+                        'GTIN': barcode_info['GTIN'], 'Series': barcode_info['SERIAL']}
             else: #Добавляем новую строку в таблицу баркодов документа
-                self.add_new_barcode_in_doc_barcodes_table(self, elem , barcode_info)
-
+                mark = {'id': None, 'barcode_from_scanner': barcode_info['FullCode'],
+                        'GTIN': barcode_info['GTIN'], 'Series': barcode_info['SERIAL']}
+        row = {key: elem.get(key) for key in ('id_good', 'id_property', 'id_series', 'id_unit')}
+
+        marks_versions = doc_session.get_versions('marks') if doc_session else None
+        with scan_metrics.measure('db_write'):
+            if scan_journal:
+                # Отложенная запись: скан учтен в памяти журнала, в базу его запишет фоновый поток
+                scan_journal.append(self.id_doc, row, ratio, current_time_utc_0, mark,
+                                    new_row=not doc_row or doc_row['id'] is None)
+            else:
+                # Строку документа уже нашли, повторно не ищем
+                write_scan(self.id_doc, row, ratio, current_time_utc_0, doc_row['id'] if doc_row else None, mark,
+                           find_row=False)
 
-        # Обновляем таблицу товары
-        self.update_doc_table_data(self, elem, ratio, user_tmz)
+        if use_mark and doc_session:
+            doc_session.add_approved_mark(barcode_info['GTIN'], barcode_info['SERIAL'], marks_versions)
 
         return {'Result': 'Марка добавлена в документ', 'Error': None,
                         'barcode': barcode_info['GTIN'] + barcode_info['SERIAL']}
@@ -11,6 +11,10 @@ import printing_factory
 from ui_utils import HashMap, RsDoc, BarcodeWorker, get_ip_address
 from db_services import DocService, ErrorService, GoodsService, AdrDocService, TimerService
 from tiny_db_services import ScanningQueueService
+from doc_session import DocSession
+from scan_metrics import scan_metrics
+from scan_journal import scan_journal
+from scan_recorder import scan_recorder
 from hs_services import HsService
 from ru.travelfood.simple_ui import SimpleUtilites as suClass
 
@@ -1642,6 +1646,7 @@ class DocDetailsScreen(Screen):
         self.service = DocService(self.id_doc)
         self.items_on_page = 20
         self.queue_service = ScanningQueueService()
+        self.doc_session = None
 
     def on_start(self) -> None:
         pass
@@ -1682,6 +1687,7 @@ class DocDetailsScreen(Screen):
         self.hash_map.show_screen(self.screen_name, args)
         self._validate_screen_values()
 
+    @scan_metrics.timed('on_start')
     def _on_start(self):
         self._set_visibility_on_start()
         self.hash_map.put('SetTitle', self.hash_map["doc_type"])
@@ -1690,10 +1696,11 @@ class DocDetailsScreen(Screen):
         have_zero_plan = False
         have_mark_plan = False
 
-        last_scanned_details = self._get_doc_details_data(last_scanned=True)
+        doc_details_page = self._get_doc_details_page()
+        last_scanned_details = [doc_details_page['last_scanned']] if doc_details_page['last_scanned'] else []
         last_scanned_data = self._prepare_table_data(last_scanned_details)
         last_scanned_item = last_scanned_data[1] if len(last_scanned_data) >= 2 else None
-        doc_details = self._get_doc_details_data()
+        doc_details = doc_details_page['rows']
         table_data = self._prepare_table_data(doc_details)
         if table_data and last_scanned_item:
             table_data.insert(1, last_scanned_item)
@@ -1710,8 +1717,7 @@ class DocDetailsScreen(Screen):
 
         if doc_details:
             self.hash_map['table_lines_qtty'] = len(doc_details)
-            have_qtty_plan = sum(
-                [self._format_to_float(str(item['qtty_plan'])) for item in doc_details if item['qtty_plan']]) > 0
+            have_qtty_plan = self._get_doc_session().have_qtty_plan
             # have_zero_plan = not have_qtty_plan
             have_zero_plan = True
             have_mark_plan = self._get_have_mark_plan()
@@ -1720,11 +1726,12 @@ class DocDetailsScreen(Screen):
         self.hash_map['have_zero_plan'] = have_zero_plan
         self.hash_map['have_mark_plan'] = have_mark_plan
 
-        control = self.service.get_doc_value('control', self.id_doc) not in (0, '0', 'false', 'False', None)
+        control = self._get_doc_session().control
         self.hash_map['control'] = control
 
         self.hash_map['return_selected_data'] = ''
-        self.hash_map.put("doc_goods_table", table_view.to_json())
+        with scan_metrics.measure('hash_map'):
+            self.hash_map.put("doc_goods_table", table_view.to_json())
 
     def _barcode_scanned(self):
         id_doc = self.hash_map.get('id_doc')
@@ -1750,7 +1757,9 @@ class DocDetailsScreen(Screen):
             have_zero_plan,
             control,
             have_mark_plan,
-            use_mark_setting=self.rs_settings.get('use_mark'))
+            use_mark_setting=self.rs_settings.get('use_mark'),
+            doc_session=self._get_doc_session(),
+            scan_journal=scan_journal if scan_journal.is_enabled() else None)
 
         # self.toast(res['Error'])
 
@@ -1795,17 +1804,50 @@ class DocDetailsScreen(Screen):
         self.hash_map.put("Show_fact_qtty_input", '1' if allow_fact_input else '-1')
         self.hash_map.put("Show_fact_qtty_note", '-1' if allow_fact_input else '1')
 
-    def _get_doc_details_data(self, last_scanned=False):
+    def _get_doc_details_page(self):
         self._check_previous_page()
         first_element = int(self.hash_map.get('current_first_element_number'))
         row_filters = self.hash_map.get('rows_filter')
         search_string = self.hash_map.get('SearchString') if self.hash_map.get('SearchString') else None
 
-        data = self.service.get_doc_details_data(self.id_doc, 0 if last_scanned else first_element,
-                                                 1 if last_scanned else self.items_on_page, row_filters, search_string)
-        if not last_scanned:
-            self._check_next_page(len(data))
-        return data
+        def load_page(entries=None):
+            page = self.service.get_doc_details_page(self.id_doc, first_element, self.items_on_page, row_filters,
+                                                     search_string, after=self._get_page_key(first_element))
+            if entries:
+                self.service.add_pending_rows(self.id_doc, page, scan_journal.get_pending_rows(self.id_doc, entries))
+            return page
+
+        # Сканы, которые журнал еще не записал в базу, сразу видны в таблице
+        page = scan_journal.read(load_page) if scan_journal.is_enabled() else load_page()
+        self._set_page_totals(first_element, page)
+        return page
+
+    def _get_page_key(self, first_element):
+        """Ключ последней строки предыдущей страницы для выборки страницы по ключу вместо OFFSET"""
+
+        page_keys = self.hash_map.get_json('doc_details_page_keys') or {}
+        if page_keys.get('filter') != self._get_page_keys_filter():
+            return None
+
+        return page_keys['keys'].get(str(first_element))
+
+    def _set_page_totals(self, first_element, page):
+        page_keys = self.hash_map.get_json('doc_details_page_keys') or {}
+        current_filter = self._get_page_keys_filter()
+        if page_keys.get('filter') != current_filter:
+            page_keys = {'filter': current_filter, 'keys': {}}
+
+        if page['next_key']:
+            page_keys['keys'][str(first_element + len(page['rows']))] = page['next_key']
+        self.hash_map.put('doc_details_page_keys', page_keys, to_json=True)
+
+        total = page['total'] or 0
+        self.hash_map.put('doc_rows_total', str(total))
+        self.hash_map.put('doc_pages_count', str(-(-total // self.items_on_page)))
+        self._check_next_page(len(page['rows']), has_next_page=first_element + len(page['rows']) < total)
+
+    def _get_page_keys_filter(self):
+        return [self.id_doc, self.hash_map.get('rows_filter'), self.hash_map.get('SearchString') or None]
 
     def _next_page(self):
         first_element = int(self.hash_map.get('current_first_element_number')) + self.items_on_page
@@ -1829,8 +1871,11 @@ class DocDetailsScreen(Screen):
         self.hash_map.put('current_page', '1')
         self.hash_map.put("Show_previous_page", "0")
 
-    def _check_next_page(self, elems_count):
-        if elems_count < self.items_on_page:
+    def _check_next_page(self, elems_count, has_next_page=None):
+        if has_next_page is None:
+            has_next_page = elems_count >= self.items_on_page
+
+        if not has_next_page:
             if not self.hash_map.containsKey('current_first_element_number'):
                 self.hash_map.put('current_first_element_number', '0')
             self.hash_map.put("Show_next_page", "0")
@@ -2025,8 +2070,15 @@ class DocDetailsScreen(Screen):
         return float(value.replace(u'\xa0', u'').replace(',', '.') or '0.0')
 
     def _get_have_mark_plan(self):
-        count = self.service.get_count_mark_codes(id_doc=self.id_doc)
-        return count > 0
+        return self._get_doc_session().have_mark_plan
+
+    def _get_doc_session(self) -> DocSession:
+        # Экран живет между событиями (new_handlers.current_screen), сессия документа - вместе с ним
+        id_doc = self.hash_map.get('id_doc') or self.id_doc
+        if self.doc_session is None or self.doc_session.id_doc != id_doc:
+            self.doc_session = DocSession(id_doc)
+            scan_journal.add_listener(self.doc_session)
+        return self.doc_session
 
     class TextView(widgets.TextView):
         def __init__(self, value):
@@ -2100,7 +2152,8 @@ class GroupScanDocDetailsScreen(DocDetailsScreen):
         self.set_scanner_lock(True)
         if self._check_connection():
             self._update_document_data()
-            scan_result = self._barcode_scanned()
+            with scan_metrics.measure('total'):
+                scan_result = self._barcode_scanned()
 
             if scan_result.get('Error'):
                 self.hash_map.run_event('doc_scan_error_sound')
@@ -2118,9 +2171,22 @@ class GroupScanDocDetailsScreen(DocDetailsScreen):
         docs_data = self._get_update_current_doc_data()
         if docs_data:
             try:
+                # Загрузка заменяет строки документа - сначала записываем в базу его отложенные сканы
+                if scan_journal.has_pending(self._get_doc_ids(docs_data)):
+                    scan_journal.flush()
                 self.service.update_data_from_json(docs_data)
             except Exception as e:
                 self.service.write_error_on_log(f'Ошибка записи документа:  {e}')
+            self._get_doc_session().invalidate()
+
+    def _get_doc_ids(self, docs_data) -> set:
+        try:
+            data = json.loads(docs_data)
+        except (TypeError, ValueError):
+            data = docs_data
+
+        docs = data.get(self.service.docs_table_name) if isinstance(data, dict) else None
+        return {item.get('id_doc') for item in docs or []} | {self.id_doc}
 
     def _get_update_current_doc_data(self):
         try:
@@ -2143,7 +2209,8 @@ class GroupScanDocDetailsScreen(DocDetailsScreen):
         if self.hash_map.get_bool('barcode_scanned'):
             answer = None
             try:
-                answer = self._post_goods_to_server()
+                with scan_metrics.measure('http_post'):
+                    answer = self._post_goods_to_server()
             except Exception as e:
                 self.service.write_error_on_log(e.args[0])
 
@@ -2153,7 +2220,12 @@ class GroupScanDocDetailsScreen(DocDetailsScreen):
             self.on_start()
 
     def _post_goods_to_server(self):
-        res = self.service.get_last_edited_goods(to_json=False)
+        if scan_journal.is_enabled():
+            # Отложенные сканы отправляются из памяти журнала, не дожидаясь записи в базу
+            res = scan_journal.read(lambda entries: self.service.get_last_edited_goods(
+                to_json=False, pending_rows=scan_journal.get_pending_rows(self.id_doc, entries)))
+        else:
+            res = self.service.get_last_edited_goods(to_json=False)
         hs_service = HsService(self.get_http_settings())
 
         if isinstance(res, dict) and res.get('Error'):
@@ -2312,6 +2384,7 @@ class GroupScanDocDetailsScreenNew(DocDetailsScreen):
         if self.listener in listeners:
             listeners[self.listener]()
 
+    @scan_metrics.timed('total')
     def _barcode_scanned(self):
         if self.hash_map.get("event") == "onResultPositive":
             barcode = self.hash_map.get('fld_barcode')
@@ -2321,12 +2394,24 @@ class GroupScanDocDetailsScreenNew(DocDetailsScreen):
         if not barcode:
             return
 
-        barcode_worker = BarcodeWorker(id_doc=self.id_doc, **self._get_barcode_process_params(), use_scanning_queue=True)
+        barcode_worker = BarcodeWorker(id_doc=self.id_doc, **self._get_barcode_process_params(), use_scanning_queue=True,
+                                       doc_session=self._get_doc_session())
         # print(barcode_worker)
-        result = barcode_worker.process_the_barcode(barcode)
-        if result.error:
-            self._process_error_scan_barcode(result)
-            return result.error
+        # splitlines/strip не подходят: они считают разделитель GS1 (chr(29)) концом строки и пробелом
+        barcodes = [line for line in barcode.replace('\r', '\n').split('\n') if line]
+        if len(barcodes) > 1:
+            # Пакетный режим сканера или список штрихкодов, вставленный в поле ввода
+            results = barcode_worker.process_barcodes(barcodes)
+            errors = [result for result in results if result.error]
+            for result in errors:
+                self._process_error_scan_barcode(result)
+            if len(errors) == len(results):
+                return errors[-1].error
+        else:
+            result = barcode_worker.process_the_barcode(barcode)
+            if result.error:
+                self._process_error_scan_barcode(result)
+                return result.error
 
         send_data = self.queue_service.get_send_document_lines(self.id_doc)
         return send_data
@@ -2560,19 +2645,22 @@ class AdrDocDetailsScreen(DocDetailsScreen):
 
         super()._on_start()
 
-    def _get_doc_details_data(self, last_scanned=False):
+    def _get_doc_details_page(self):
         super()._check_previous_page()
         row_filters = self.hash_map.get('rows_filter')
         first_element = int(self.hash_map.get('current_first_element_number'))
         search_string = self.hash_map.get('SearchString') if self.hash_map.get('SearchString') else None
-        data = self.service.get_doc_details_data(id_doc=self.id_doc, curCell=self.current_cell,
-                                                 first_elem=0 if last_scanned else first_element,
-                                                 items_on_page=1 if last_scanned else self.items_on_page,
+        page = self.service.get_doc_details_page(id_doc=self.id_doc, curCell=self.current_cell,
+                                                 first_elem=first_element,
+                                                 items_on_page=self.items_on_page,
                                                  row_filters=row_filters,
-                                                 search_string=search_string)
-        if not last_scanned:
-            super()._check_next_page(len(data))
-        return data
+                                                 search_string=search_string,
+                                                 after=self._get_page_key(first_element))
+        self._set_page_totals(first_element, page)
+        return page
+
+    def _get_page_keys_filter(self):
+        return super()._get_page_keys_filter() + [self.current_cell, self.service.table_type]
 
     def on_input(self) -> None:
         super().on_input()
@@ -3388,7 +3476,8 @@ class GoodsListScreen(Screen):
         self.service = GoodsService()
 
     def on_start(self) -> None:
-        cards_data = self._get_goods_list_data(self.hash_map.get('selected_goods_type'))
+        cards_data = self._get_goods_list_data(self.hash_map.get('selected_goods_type'),
+                                               self.hash_map.get('SearchString'))
         goods_cards = self._get_goods_cards_view(cards_data)
         self.hash_map['goods_cards'] = goods_cards.to_json()
         self.hash_map['return_selected_data'] = ""
@@ -3410,7 +3499,10 @@ class GoodsListScreen(Screen):
             self.hash_map.show_screen("Карточка товара")
         elif listener == "select_goods_type":
             self.hash_map.show_screen("Выбор категории товаров")
+        elif listener == "Search":
+            self.hash_map.refresh_screen()
         elif listener == "ON_BACK_PRESSED":
+            self.hash_map.remove('SearchString')
             self.hash_map.put("FinishProcess", "")
         elif listener == 'barcode':
             self._identify_barcode_goods()
@@ -3422,8 +3514,8 @@ class GoodsListScreen(Screen):
         self._validate_screen_values()
         self.hash_map.show_screen(self.screen_name, args)
 
-    def _get_goods_list_data(self, selected_good_type=None) -> list:
-        results = self.service.get_goods_list_data(selected_good_type)
+    def _get_goods_list_data(self, selected_good_type=None, search_string=None) -> list:
+        results = self.service.get_goods_list_data(selected_good_type, search_string=search_string)
         cards_data = []
         for record in results:
             single_card_data = {
@@ -5179,12 +5271,28 @@ class DebugSettingsScreen(Screen):
             'ip_host',
             {'hint': 'IP-адрес для выгрузки базы/лога', 'default_text': debug_host_ip or ''},
             to_json=True)
+        self.hash_map.put('scan_metrics', scan_metrics.report())
+        self.hash_map.put('scan_queue_stats', ScanningQueueService.compaction_report())
+        self.hash_map.put('http_stats', hs_services.http_sessions.report())
+        self.hash_map.put('record_scan_sessions', self.rs_settings.get('record_scan_sessions') or 'false')
+        self.hash_map.put('use_scan_journal', self.rs_settings.get('use_scan_journal') or 'false')
 
     def on_input(self):
+        for key in ('record_scan_sessions', 'use_scan_journal'):
+            value = self.hash_map.get(key)
+            if value is not None:
+                self.rs_settings.put(key, value, True)
+
+        if self.rs_settings.get('use_scan_journal') != 'true':
+            # Отложенная запись выключена - то, что осталось в журнале, пишем в базу сразу
+            scan_journal.flush()
+
         listeners = {
             'btn_fill_ratio': self._fill_ratio,
             'btn_copy_base': self._copy_base,
             'btn_unload_log': self._unload_log,
+            'btn_unload_scan_metrics': self._unload_scan_metrics,
+            'btn_unload_scan_sessions': self._unload_scan_sessions,
             'btn_local_files': self._local_files,
             'btn_templates': self.open_templates_screen,
             'ON_BACK_PRESSED': self._on_back_pressed
@@ -5246,6 +5354,31 @@ class DebugSettingsScreen(Screen):
         else:
             self.hash_map.toast('Ошибка соединения')
 
+    def _unload_scan_metrics(self):
+        ip_host = self.hash_map['ip_host']
+
+        res = self.hs_service(ip_host).export_log(scan_metrics.export_data())
+        if res['status_code'] == 200:
+            self.hash_map.toast('Время сканирования выгружено')
+        else:
+            self.hash_map.toast('Ошибка соединения')
+
+    def _unload_scan_sessions(self):
+        ip_host = self.hash_map['ip_host']
+        files = scan_recorder.get_files()
+        if not files:
+            self.hash_map.toast('Записанных сессий сканирования нет')
+            return
+
+        for file_path in files:
+            with open(file_path, 'rb') as f:
+                res = self.hs_service(ip_host).export_file(os.path.basename(file_path), f)
+            if res['status_code'] != 200:
+                self.hash_map.toast('Ошибка соединения')
+                return
+
+        self.hash_map.toast(f'Выгружено сессий сканирования: {len(files)}')
+
     def _local_files(self):
         import ui_csv
 
@@ -5290,6 +5423,7 @@ class Timer:
 
         self.load_docs()
         self._upload_data()
+        self._compact_scanning_queue()
         # self.upload_all_docs()
 
     def put_notification(self, text, title=None):
@@ -5332,24 +5466,38 @@ class Timer:
             return
 
         service = TimerService()
-        data = service.get_data_to_send()
 
-        if not data:
-            return
+        # Документы выгружаются пачками, статус отправки ставится после каждой успешной пачки
+        for data in service.iter_data_to_send():
+            queue_lines = self._get_scanning_queue_lines(data)
+            try:
+                answer = self.http_service.send_data(data)
+            except Exception as e:
+                self.db_service.write_error_on_log(f'Ошибка выгрузки документов: {e}')
+                return
 
-        try:
-            answer = self.http_service.send_data(data)
-        except Exception as e:
-            self.db_service.write_error_on_log(f'Ошибка выгрузки документов: {e}')
-            return
+            if answer.error:
+                # self.put_notification(title='Ошибка при отправке документов', text=answer.error_text)
+                self.db_service.write_error_on_log(f'Ошибка выгрузки документов: {answer.error_text}')
+                return
 
-        if answer.error:
-            # self.put_notification(title='Ошибка при отправке документов', text=answer.error_text)
-            self.db_service.write_error_on_log(f'Ошибка выгрузки документов: {answer.error_text}')
-        else:
             docs_list_string = ', '.join([f"'{d['id_doc']}'" for d in data])
             self.db_service.update_uploaded_docs_status(docs_list_string)
+            ScanningQueueService().update_sent_lines(queue_lines)
 
+    @staticmethod
+    def _get_scanning_queue_lines(docs: list) -> list:
+        # Строки очереди сканирований выгружаемых документов: после успешной выгрузки
+        # они отмечаются отправленными и попадают под сжатие очереди
+        queue_service = ScanningQueueService()
+        id_docs = dict.fromkeys(doc['id_doc'] for doc in docs)
+        return [line for id_doc in id_docs for line in queue_service.get_send_document_lines(id_doc)]
+
+    def _compact_scanning_queue(self):
+        try:
+            ScanningQueueService().compact_if_due()
+        except Exception as e:
+            self.db_service.write_error_on_log(f'Ошибка сжатия очереди сканирований: {e}')
 
     def upload_all_docs(self):
         self.db_service = DocService()
@@ -5370,6 +5518,7 @@ class Timer:
 
                 docs_goods_formatted_list = self.db_service.get_docs_and_goods_for_upload()
                 if docs_goods_formatted_list:
+                    queue_lines = self._get_scanning_queue_lines(docs_goods_formatted_list)
                     answer = self.http_service.send_documents(docs_goods_formatted_list)
                     if answer:
                         if answer.get('Error') is not None:
@@ -5380,6 +5529,7 @@ class Timer:
                         else:
                             docs_list_string = ', '.join([f"'{d['id_doc']}'" for d in docs_goods_formatted_list])
                             self.db_service.update_uploaded_docs_status(docs_list_string)
+                            ScanningQueueService().update_sent_lines(queue_lines)
             except Exception as e:
                 self.db_service.write_error_on_log(f'Ошибка выгрузки документов: {e}')
 
@@ -5418,6 +5568,9 @@ class MainEvents:
         # toast = (f'Обновляемся с {release} на {current_release}')
 
         self._create_tables()
+        self._migrate_scanning_queue()
+        self._recover_scan_journal()
+        self._configure_http_sessions()
 
         if current_release is None:
             toast = 'Не удалось определить версию конфигурации'
@@ -5474,10 +5627,48 @@ class MainEvents:
             service = db_services.DocService()
             service.write_error_on_log(f'SQL_Error: {sql_error}')
 
+    def _configure_http_sessions(self):
+        # Параметры общих HTTP-сессий (hs_services.http_sessions), заданные в настройках
+        settings = {}
+        for key, setting, value_type in (('pool_size', 'http_pool_size', int),
+                                         ('keep_alive', 'http_keep_alive', lambda value: value in (True, 'true')),
+                                         ('connect_timeout', 'http_connect_timeout', float),
+                                         ('read_timeout', 'http_read_timeout', float)):
+            value = self.rs_settings.get(setting)
+            if value is not None:
+                settings[key] = value_type(value)
+
+        if settings:
+            hs_services.http_sessions.configure(**settings)
+
+    def _migrate_scanning_queue(self):
+        # Очередь сканирований из прежнего JSON-файла TinyDB переносится в базу один раз
+        try:
+            ScanningQueueService().migrate_from_tiny_db()
+        except Exception as e:
+            db_services.DocService().write_error_on_log(f'Ошибка переноса очереди сканирований: {e}')
+
+    def _recover_scan_journal(self):
+        # Сканы, которые до сбоя попали только в журнал отложенной записи
+        try:
+            recovered = scan_journal.recover()
+        except Exception as e:
+            db_services.DocService().write_error_on_log(f'Ошибка восстановления журнала сканирований: {e}')
+            return
+
+        if recovered:
+            db_services.DocService().write_error_on_log(
+                f'Журнал сканирований: восстановлено {recovered} сканов, не записанных в базу')
+
     def _create_tables(self):
         service = db_services.DbCreator()
         service.create_tables()
 
+        # Статистика для плиток могла разойтись с документами (например, после изменений мимо триггеров)
+        doc_service = db_services.DocService()
+        if doc_service.check_docs_stat():
+            doc_service.rebuild_docs_stat()
+
 
 # ^^^^^^^^^^^^^^^^^^^^^ Main events ^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 
@@ -1,14 +1,18 @@
 import json
-import re
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from typing import Callable, Union, List, Dict
 from functools import wraps
 import socket
+import time
 from datetime import datetime, timedelta
 
 from java import jclass
-from ui_global import Rs_doc, find_barcode_in_barcode_table
+import ui_barcodes
+from barcode_cache import barcode_cache
+from ui_global import Rs_doc, find_barcode_in_barcode_table, transaction
 from db_services import DocService, BarcodeService
+from scan_metrics import scan_metrics
+from scan_recorder import scan_recorder
 
 noClass = jclass("ru.travelfood.simple_ui.NoSQL")
 rs_settings = noClass("rs_settings")
@@ -270,11 +274,14 @@ class RsDoc(Rs_doc):
             have_mark_plan=False,
             elem=None,
             use_mark_setting='false',
-            user_tmz=0):
+            user_tmz=0,
+            doc_session=None):
 
+        start = time.perf_counter()
         Rs_doc.id_doc = self.id_doc
         result = Rs_doc.process_the_barcode(
-            Rs_doc, barcode, have_qtty_plan, have_zero_plan, control, have_mark_plan, elem, use_mark_setting, user_tmz
+            Rs_doc, barcode, have_qtty_plan, have_zero_plan, control, have_mark_plan, elem, use_mark_setting, user_tmz,
+            doc_session
         )
         if not result.get('Error'):
             service = DocService(self.id_doc)
@@ -284,6 +291,15 @@ class RsDoc(Rs_doc):
             if res.get('id'):
                 result['key'] = res['id']
 
+        flags = {
+            'have_qtty_plan': have_qtty_plan,
+            'have_zero_plan': have_zero_plan,
+            'have_mark_plan': have_mark_plan,
+            'control': control,
+        }
+        scan_recorder.record(self.id_doc, 'rs_doc', [barcode], flags, (time.perf_counter() - start) * 1000,
+                             [result.get('Error') or ''])
+
         return result
 
     def add(self, args):
@@ -304,6 +320,8 @@ class BarcodeWorker:
         self.have_qtty_plan = kwargs.get('have_qtty_plan', False)
         self.have_zero_plan = kwargs.get('have_zero_plan', False)
         self.use_scanning_queue = kwargs.get('use_scanning_queue', False)
+        # Сессия документа экрана (doc_session.DocSession): строки документа берутся из нее и пишутся через нее
+        self.doc_session = kwargs.get('doc_session')
         self.barcode_info = None
         self.document_row = None
         self.db_service = BarcodeService()
@@ -313,25 +331,165 @@ class BarcodeWorker:
         self.mark_update_data = {}
         self.docs_table_update_data = {}
         self.queue_update_data = {}
+        # Строки документа с количеством, набранным в текущей пачке (process_barcodes)
+        self._batch_rows = None
 
     def process_the_barcode(self, barcode):
+        start = time.perf_counter()
+        result = self._process_the_barcode(barcode)
+        self._record_scan('worker', [barcode], start, [result])
+        return result
+
+    def _process_the_barcode(self, barcode):
         self.process_result.barcode = barcode
-        self.barcode_info = BarcodeParser(barcode).parse(as_dict=False)
+        with scan_metrics.measure('parse'):
+            self.barcode_info = barcode_cache.parse('BarcodeParser', barcode, BarcodeParser.parse_barcode_info)
 
         if self.barcode_info.error:
             self._set_process_result_info('invalid_barcode')
             return self.process_result
 
-        self.barcode_data = self._get_barcode_data()
+        if self._is_mark_approved_in_session():
+            self._set_process_result_info('mark_already_scanned')
+            return self.process_result
+
+        with scan_metrics.measure('db_lookup'):
+            self.barcode_data = self._get_barcode_data()
 
         if self.barcode_data:
-            self.check_barcode()
-            self.update_document_barcode_data()
+            with scan_metrics.measure('checks'):
+                self.check_barcode()
+            with scan_metrics.measure('db_write'), transaction():
+                self.update_document_barcode_data()
         else:
             self._set_process_result_info('not_found')
 
         return self.process_result
 
+    def process_barcodes(self, barcodes: list) -> list:
+        """
+        Обработка пачки штрихкодов (пакетный режим сканера, список в диалоге ВвестиШтрихкод).
+        Сначала разбираются все коды, данные по ним получаются одним запросом, проверки плана,
+        нулевого плана и марок выполняются в памяти с учетом количества, набранного в этой же пачке.
+        Строки документа и марки пишутся одной транзакцией, очередь сканирования - одной операцией.
+        Возвращает ProcessTheBarcodeResult по каждому штрихкоду в исходном порядке
+        """
+
+        start = time.perf_counter()
+        # В пакетном режиме время этапов пишется на всю пачку
+        with scan_metrics.measure('parse'):
+            barcodes_info = [barcode_cache.parse('BarcodeParser', barcode, BarcodeParser.parse_barcode_info)
+                             for barcode in barcodes]
+        valid_info = [barcode_info for barcode_info in barcodes_info if not barcode_info.error]
+        with scan_metrics.measure('db_lookup'):
+            barcodes_data = iter(self.db_service.get_barcodes_data(valid_info, self.id_doc))
+
+        results = []
+        docs_table_data = {}
+        marks_data = []
+        queue_data = []
+        new_rows_results = {}
+        scanned_marks = set()
+        self._batch_rows = {}
+        checks_start = time.perf_counter()
+
+        try:
+            for barcode, barcode_info in zip(barcodes, barcodes_info):
+                self._start_processing(barcode, barcode_info)
+                results.append(self.process_result)
+
+                if barcode_info.error:
+                    self._set_process_result_info('invalid_barcode')
+                    continue
+
+                self.barcode_data = next(barcodes_data) or {}
+                if not self.barcode_data:
+                    self._set_process_result_info('not_found')
+                    continue
+
+                mark_key = (barcode_info.gtin, barcode_info.serial)
+                if self._use_mark() and barcode_info.scheme == 'GS1' and (
+                        mark_key in scanned_marks or self._is_mark_approved_in_session()):
+                    self._set_process_result_info('mark_already_scanned')
+                    continue
+
+                self.check_barcode()
+                if self.process_result.error:
+                    continue
+
+                row_key = self._get_row_key()
+                if self.mark_update_data:
+                    marks_data.append(self.mark_update_data)
+                    scanned_marks.add(mark_key)
+
+                if self.docs_table_update_data:
+                    docs_table_data[row_key] = self.docs_table_update_data
+                    self._batch_rows[row_key] = {
+                        'row_key': self.docs_table_update_data['id'],
+                        'qtty': self.docs_table_update_data['qtty'],
+                        'qtty_plan': self.docs_table_update_data['qtty_plan'],
+                    }
+
+                if self.queue_update_data:
+                    queue_data.append((row_key, self.queue_update_data))
+
+                self._set_process_result_info('success_mark' if self._use_mark() else 'success_barcode')
+                if not self.process_result.row_key:
+                    new_rows_results.setdefault(row_key, []).append(self.process_result)
+        finally:
+            self._batch_rows = None
+        scan_metrics.add('checks', (time.perf_counter() - checks_start) * 1000)
+
+        marks_versions = self.doc_session.get_versions('marks') if self.doc_session else None
+        # Строки документа, марки и очередь сканирований пишутся одной транзакцией
+        with scan_metrics.measure('db_write'), transaction():
+            rows_ids = dict(zip(docs_table_data, self.db_service.save_scan_batch(
+                list(docs_table_data.values()), marks_data)))
+
+            # id новых строк документа известны только после записи
+            for row_key, row_results in new_rows_results.items():
+                for result in row_results:
+                    result.row_key = rows_ids.get(row_key, '')
+
+            for row_key, queue_row in queue_data:
+                queue_row['row_key'] = queue_row['row_key'] or rows_ids.get(row_key, '')
+            self.db_service.insert_no_sql_many([queue_row for _, queue_row in queue_data])
+
+        if self.doc_session:
+            self.doc_session.add_approved_marks(scanned_marks, marks_versions)
+
+        self._record_scan('worker_batch', barcodes, start, results)
+        return results
+
+    def _record_scan(self, mode, barcodes, start, results):
+        flags = {
+            'have_qtty_plan': self.have_qtty_plan,
+            'have_zero_plan': self.have_zero_plan,
+            'have_mark_plan': self.have_mark_plan,
+            'control': self.control,
+            'use_scanning_queue': self.use_scanning_queue,
+        }
+        scan_recorder.record(self.id_doc, mode, barcodes, flags, (time.perf_counter() - start) * 1000,
+                             [result.error for result in results])
+
+    def _start_processing(self, barcode, barcode_info):
+        self.process_result = self.ProcessTheBarcodeResult(barcode=barcode)
+        self.barcode_info = barcode_info
+        self.barcode_data = {}
+        self.mark_update_data = {}
+        self.docs_table_update_data = {}
+        self.queue_update_data = {}
+
+    def _is_mark_approved_in_session(self) -> bool:
+        """Марка уже одобрена в документе - проверка по множеству сессии, без запросов к базе"""
+
+        return bool(self.doc_session) and rs_settings.get('use_mark') == 'true' \
+            and self.barcode_info.scheme == 'GS1' \
+            and self.doc_session.is_mark_approved(self.barcode_info.gtin, self.barcode_info.serial, check_db=False)
+
+    def _get_row_key(self) -> tuple:
+        return self.barcode_data['id_good'], self.barcode_data['id_property'], self.barcode_data['id_unit']
+
     def _get_barcode_data(self):
         try:
             barcode_data = self.db_service.get_barcode_data(self.barcode_info, self.id_doc)
@@ -369,6 +527,12 @@ class BarcodeWorker:
         if self.process_result.error:
             return
 
+        if self.doc_session:
+            self._set_document_row_from_session()
+
+        if self._batch_rows and self._get_row_key() in self._batch_rows:
+            self.barcode_data.update(self._batch_rows[self._get_row_key()])
+
         new_qtty = self.barcode_data['qtty'] + self.barcode_data['ratio']
         if self.barcode_data['row_key']:
             if self.have_qtty_plan and self.barcode_data['qtty_plan'] < new_qtty:
@@ -385,6 +549,18 @@ class BarcodeWorker:
                 self._insert_doc_table_data(new_qtty)
 
 
+    def _set_document_row_from_session(self):
+        row = self.doc_session.get_row(
+            self.barcode_data['id_good'], self.barcode_data['id_property'], self.barcode_data['id_unit'])
+        if row:
+            self.barcode_data['row_key'] = row['id']
+            self.barcode_data['qtty'] = row['qtty'] or 0.0
+            self.barcode_data['qtty_plan'] = row['qtty_plan'] or 0.0
+        else:
+            self.barcode_data['row_key'] = ''
+            self.barcode_data['qtty'] = 0.0
+            self.barcode_data['qtty_plan'] = 0.0
+
     def _insert_mark_data(self):
         self.mark_update_data = {
             'id': self.barcode_data['mark_id'],
@@ -436,11 +612,26 @@ class BarcodeWorker:
             pass
             # self.db_service.update_table(table_name="RS_docs_barcodes", docs_table_update_data=self.mark_update_data)
 
-        if self.docs_table_update_data:
-            self.db_service.update_table(table_name="RS_docs_table", docs_table_update_data=self.docs_table_update_data)
+        # Строка документа и запись очереди сканирований - одной транзакцией
+        try:
+            with transaction():
+                if self.docs_table_update_data:
+                    if self.doc_session:
+                        row = self.doc_session.update_row(self.docs_table_update_data)
+                        self.docs_table_update_data['id'] = row['id']
+                        if self.queue_update_data:
+                            self.queue_update_data['row_key'] = row['id']
+                    else:
+                        self.db_service.update_table(table_name="RS_docs_table",
+                                                     docs_table_update_data=self.docs_table_update_data)
 
-        if self.queue_update_data:
-            self.db_service.insert_no_sql(self.queue_update_data)
+                if self.queue_update_data:
+                    self.db_service.insert_no_sql(self.queue_update_data)
+        except Exception:
+            # Запись откатилась, а строка в сессии уже обновлена
+            if self.doc_session:
+                self.doc_session.invalidate()
+            raise
 
         if self._use_mark():
             self._set_process_result_info('success_mark')
@@ -544,107 +735,28 @@ class BarcodeParser:
             return self.barcode_info
 
     @staticmethod
-    def is_valid_ean13(code):
-        pattern = r'^\d{13}$'
-        if not re.match(pattern, code):
-            return False
-
-        factors = [1, 3] * 6
-        checksum = sum(int(code[i]) * factors[i] for i in range(12))
-        checksum = (10 - (checksum % 10)) % 10
+    def parse_barcode_info(barcode):
+        return BarcodeParser(barcode).parse(as_dict=False)
 
-        return checksum == int(code[-1])
+    @staticmethod
+    def is_valid_ean13(code):
+        return ui_barcodes.is_valid_ean13(code)
 
     def check_datamatrix(self, barcode):
         barcode = self.clear_identifier(barcode)
         self.check_gs1_gtin(barcode)
 
     def check_gs1_gtin(self, barcode: str):
-        if self.gs1_separator in barcode:
-            while barcode:
-                if barcode[:2] == '01':
-                    self.barcode_info.gtin = barcode[2:16]
-                    if len(barcode) > 16:
-                        barcode = barcode[16:]
-                    else:
-                        barcode = None
-
-                elif barcode[:3] == chr(29) + '01':
-                    self.barcode_info.gtin = barcode[3:17]
-                    if len(barcode) > 17:
-                        barcode = barcode[17:]
-                    else:
-                        barcode = None
-
-                elif barcode[:2] == '17':
-                    self.barcode_info.expiry = barcode[2:8]
-                    if len(barcode) > 8:
-                        barcode = barcode[8:]
-                    else:
-                        barcode = None
-
-                elif barcode[:2] == '10':
-                    if chr(29) in barcode:
-                        index = barcode.index(chr(29))
-                        self.barcode_info.batch = barcode[2:index]
-                        barcode = barcode[index + 1:]
-                    else:
-                        self.barcode_info.batch = barcode[2:]
-                        barcode = None
-
-                elif barcode[:2] == '21':
-                    if chr(29) in barcode:
-                        index = barcode.index(chr(29))
-                        self.barcode_info.serial = barcode[2:index]
-                        barcode = barcode[index + 1:]
-                    else:
-                        self.barcode_info.serial = barcode[2:]
-                        barcode = None
-
-                elif barcode[:2] == '91':
-                    if chr(29) in barcode:
-                        index = barcode.index(chr(29))
-
-                        self.barcode_info.nhrn = barcode[2:index]
-                        barcode = barcode[index + 1:]
-                    else:
-                        self.barcode_info.nhrn = barcode[2:6]
-                        barcode = None
-
-                elif barcode[:2] == '93':  # Молочка, вода
-                    self.barcode_info.check = barcode[2:6]
-                    barcode = barcode[7:]
-
-                elif barcode[:2] == '92':  # Далее следует код проверки, 44 символа
-                    # if len(barcode[2:])==44:
-                    self.barcode_info.check = barcode[2:]
-                    barcode = None
-
-                elif barcode[:4] == '8005':  # Табак, Блок
-                    self.barcode_info.nhrn = barcode[4:10]
-                    barcode = barcode[11:]
-
-                elif barcode[:4] == '3103':  # Молочка с Весом
-                    self.barcode_info.weight = barcode[4:]
-                    barcode = None
-
-                else:
-                    self.barcode_info.error = 'INVALID BARCODE'
-                    return
-        else:
+        if self.gs1_separator not in barcode and '<GS>' not in barcode:
             self.barcode_info.error = 'No GS Separator'
+            return
 
-        # if ('GTIN' , 'BATCH' , 'EXPIRY' , 'SERIAL') in result.keys():
-        #     if gtin_check(result['GTIN']) == False and expiry_date_check(result['EXPIRY']) == False:
-        #         return {'ERROR': 'INVALID GTIN & EXPIRY DATE', 'BARCODE': result}
-        #     elif expiry_date_check(result['EXPIRY']) == False:
-        #         return {'ERROR': 'INVALID EXPIRY DATE', 'BARCODE': result}
-        #     elif gtin_check(result['GTIN']) == False:
-        #         return {'ERROR': 'INVALID GTIN', 'BARCODE': result}
-        #     else:
-        #         return result
-        # else:
-        #     return {'ERROR': 'INCOMPLETE DATA', 'BARCODE': result}
+        barcode_info = self.barcode_info
+        elements, barcode_info.error = ui_barcodes.parse_gs1_elements(barcode)
+        # Поля BarcodeInfo - те же, что в ui_barcodes.gs1_gtin, все AI кода доступны в BarcodeInfo.ai
+        barcode_info.ai = elements
+        for name, value in ui_barcodes.gs1_fields(elements).items():
+            setattr(barcode_info, name.lower(), value)
 
     def clear_identifier(self, barcode):
         """
@@ -671,9 +783,15 @@ class BarcodeParser:
         batch: str = ''
         nhrn: str = ''
         weight: str = ''
+        # Все элементы кода GS1: AI -> значение
+        ai: dict = field(default_factory=dict)
 
         def dict(self):
-            return {k.upper(): str(v) for k, v in asdict(self).items() if v}
+            return {k.upper(): str(v) for k, v in asdict(self).items() if v and k != 'ai'}
+
+        def decimal(self, ai) -> str:
+            """Значение AI с десятичной точкой (310n, 392n...) в виде числа"""
+            return ui_barcodes.gs1_decimal_value(ai, self.ai.get(ai, ''))
 
 
 def get_ip_address():